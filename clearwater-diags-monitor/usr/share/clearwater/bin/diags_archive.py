@@ -0,0 +1,284 @@
+#!/usr/bin/python
+
+# @file diags_archive.py
+#
+# Copyright (C) Metaswitch Networks 2018
+# If license terms are provided to you in a COPYING file in the root directory
+# of the source code repository by which you are accessing this code, then
+# the license outlined in that COPYING file applies to your use.
+# Otherwise no rights are granted except for those provided to you by
+# Metaswitch Networks in a separate written agreement.
+
+
+# Writes a diags dump archive in a single pass. The dump directory and every
+# source listed in the sources file are streamed straight into a tar archive,
+# which is piped through a (multi-threaded, where available) compressor, so
+# that nothing is copied or compressed more than once.
+#
+# The sources file has a line for each source, of the form
+#
+#   <action> <archive path> <source path>
+#
+# separated by tabs, where the action is "add" to add the source (a file or
+# a directory tree) to the archive, or "move" to also delete it once the
+# archive has been written. For example:
+#
+#   add   20180101120000Z.node.sprout.temp/root/etc/clearwater   /etc/clearwater
+#   move  20180101120000Z.node.sprout.temp/core.sprout.1514808000  /var/clearwater-diags-monitor/tmp/core.sprout.1514808000
+#
+# Usage:
+#
+#   diags_archive.py [--codec CODEC] [--threads N] [--sources FILE]
+#                    <archive> <dump directory> <dump name>
+#
+# If none of the compressors for the codec asked for is installed, the
+# archive is compressed with gzip instead.
+#
+#   diags_archive.py --installed-codec CODEC
+#
+# prints the codec that will be used in place of CODEC.
+
+
+import os
+import sys
+import tarfile
+import argparse
+import subprocess
+import multiprocessing
+from distutils.spawn import find_executable
+
+# The compressors for each codec, in order of preference. Each one reads the
+# archive on stdin and writes the compressed archive to stdout.
+CODECS = {"gzip": [["pigz", "-c", "-p", "{threads}"], ["gzip", "-c"]],
+          "xz": [["xz", "-c", "-T", "{threads}"]],
+          "zstd": [["zstd", "-c", "-q", "-T{threads}"]]}
+
+DEFAULT_CODEC = "gzip"
+
+
+def _installed_command(codec):
+  for command in CODECS[codec]:
+    if find_executable(command[0]):
+      return command
+  return None
+
+
+def installed_codec(codec):
+  """Return the codec that will be used in place of a codec: the codec
+  itself if one of its compressors is installed, and gzip otherwise"""
+  return codec if _installed_command(codec) else DEFAULT_CODEC
+
+
+def compressor_command(codec, threads):
+  """Return the command to compress with a codec (or with gzip, if none of
+  the codec's compressors is installed), or None if there's no compressor
+  installed at all"""
+  command = _installed_command(installed_codec(codec))
+  if command is None:
+    return None
+  return [arg.format(threads=threads) for arg in command]
+
+
+class _WriteError(Exception):
+  # Raised when the archive itself can't be written, as opposed to a source
+  # that can't be read.
+  pass
+
+
+class _Output(object):
+  # The compressor's stdin, distinguishing errors writing to it from errors
+  # reading the sources.
+
+  def __init__(self, fileobj):
+    self._fileobj = fileobj
+
+  def write(self, data):
+    try:
+      self._fileobj.write(data)
+    except IOError as e:
+      raise _WriteError(e)
+
+
+class _PaddedFile(object):
+  # Logs can be truncated (for example when they're rotated) while they're
+  # being archived. tar has already written the size in the file's header by
+  # then, so pad the file out to that size to keep the archive valid.
+
+  def __init__(self, fileobj, size):
+    self._fileobj = fileobj
+    self._remaining = size
+
+  def read(self, size):
+    try:
+      data = self._fileobj.read(min(size, self._remaining))
+    except IOError:
+      data = ""
+    if len(data) < size:
+      data += "\0" * (min(size, self._remaining) - len(data))
+    self._remaining -= len(data)
+    return data
+
+
+class _Archive(tarfile.TarFile):
+
+  def addfile(self, tarinfo, fileobj=None):
+    if fileobj is not None:
+      fileobj = _PaddedFile(fileobj, tarinfo.size)
+    tarfile.TarFile.addfile(self, tarinfo, fileobj)
+
+
+def _add_tree(archive, path, arcname, errors):
+  # Add a file, or a directory and everything beneath it, skipping (and
+  # reporting) anything that can't be read rather than abandoning the rest of
+  # the tree. Symbolic links are added as links, as cp -rp would copy them.
+  try:
+    archive.add(path, arcname, recursive=False)
+  except (IOError, OSError) as e:
+    errors.append("%s: %s" % (path, e))
+    return
+
+  if os.path.isdir(path) and not os.path.islink(path):
+    try:
+      names = sorted(os.listdir(path))
+    except OSError as e:
+      errors.append("%s: %s" % (path, e))
+      return
+
+    for name in names:
+      _add_tree(archive,
+                os.path.join(path, name),
+                os.path.join(arcname, name),
+                errors)
+
+
+def _remove_tree(path):
+  # Remove the files that have been moved into the archive, leaving any
+  # directories in place (as the diags monitor always has).
+  if os.path.isdir(path) and not os.path.islink(path):
+    for dirpath, _, filenames in os.walk(path):
+      for filename in filenames:
+        os.unlink(os.path.join(dirpath, filename))
+  else:
+    os.unlink(path)
+
+
+def read_sources(path):
+  """Return the list of (action, archive path, source path) in a sources
+  file"""
+  sources = []
+
+  with open(path) as f:
+    for line in f:
+      line = line.rstrip("\n")
+      if line:
+        sources.append(tuple(line.split("\t", 2)))
+
+  return sources
+
+
+def write_archive(output, dump_dir, dump_name, sources=(), codec=DEFAULT_CODEC, threads=None):
+  """Write a dump archive. Returns the list of sources that couldn't be
+  archived (as error strings). Raises an EnvironmentError if the archive
+  couldn't be written, in which case no moved sources are deleted.
+
+  @param output    - The archive to write.
+  @param dump_dir  - The dump directory, which is added in full.
+  @param dump_name - The name of the dump directory in the archive.
+  @param sources   - The other sources to add, as returned by read_sources.
+  @param codec     - The codec to compress the archive with (or gzip, if
+    it isn't installed).
+  @param threads   - How many threads to compress with (by default, one per
+    CPU)."""
+  command = compressor_command(codec, threads or multiprocessing.cpu_count())
+  if command is None:
+    raise EnvironmentError("no compressor is installed")
+
+  errors = []
+
+  with open(output, "wb") as f:
+    compressor = subprocess.Popen(command, stdin=subprocess.PIPE, stdout=f)
+
+    archive = None
+
+    try:
+      archive = _Archive.open(fileobj=_Output(compressor.stdin), mode="w|")
+      _add_tree(archive, dump_dir, dump_name, errors)
+
+      for _, arcname, path in sources:
+        if os.path.lexists(path):
+          _add_tree(archive, path, arcname, errors)
+        else:
+          errors.append("%s: not present" % path)
+
+      archive.close()
+    except _WriteError as e:
+      # Don't let tarfile try to finish the archive when it's cleaned up.
+      if archive is not None:
+        archive.fileobj.closed = True
+        archive.closed = True
+      raise EnvironmentError("writing to %s failed: %s" % (command[0], e.args[0]))
+    finally:
+      try:
+        compressor.stdin.close()
+      except IOError:
+        pass
+      rc = compressor.wait()
+
+  if rc != 0:
+    raise EnvironmentError("%s failed (%d)" % (command[0], rc))
+
+  for action, _, path in sources:
+    if action == "move" and os.path.lexists(path):
+      try:
+        _remove_tree(path)
+      except OSError as e:
+        errors.append("%s: %s" % (path, e))
+
+  return errors
+
+
+def parse_args(args=None):
+  parser = argparse.ArgumentParser(description="Write a diags dump archive")
+  parser.add_argument("output", nargs="?", help="The archive to write")
+  parser.add_argument("dump_dir", nargs="?", help="The dump directory")
+  parser.add_argument("dump_name", nargs="?", help="The name of the dump "
+                                                   "directory in the archive")
+  parser.add_argument("--sources", help="The sources file")
+  parser.add_argument("--codec", choices=sorted(CODECS), default=DEFAULT_CODEC,
+                      help="The codec to compress the archive with")
+  parser.add_argument("--threads", type=int,
+                      help="How many threads to compress with (by default, "
+                           "one per CPU)")
+  parser.add_argument("--installed-codec", choices=sorted(CODECS),
+                      help="Print the codec that will be used in place of "
+                           "this one, and exit")
+  args = parser.parse_args(args)
+
+  if args.installed_codec is None and args.dump_name is None:
+    parser.error("the archive, dump directory and dump name are required")
+
+  return args
+
+
+if __name__ == "__main__":
+  args = parse_args()
+
+  if args.installed_codec:
+    print installed_codec(args.installed_codec)
+    sys.exit(0)
+
+  sources = read_sources(args.sources) if args.sources else []
+
+  try:
+    errors = write_archive(args.output,
+                           args.dump_dir,
+                           args.dump_name,
+                           sources,
+                           args.codec,
+                           args.threads)
+  except EnvironmentError as e:
+    print "Failed to write %s: %s" % (args.output, e)
+    sys.exit(1)
+
+  for error in errors:
+    print "Not archived: %s" % error
@@ -0,0 +1,177 @@
+# @file alarm_registry.py
+#
+# Copyright (C) Metaswitch Networks 2018
+# If license terms are provided to you in a COPYING file in the root directory
+# of the source code repository by which you are accessing this code, then
+# the license outlined in that COPYING file applies to your use.
+# Otherwise no rights are granted except for those provided to you by
+# Metaswitch Networks in a separate written agreement.
+
+
+# This module provides a registry of the alarms defined on this node, as read
+# from the *_alarms.json files installed by each package. The definitions are
+# indexed by alarm index and severity, and the index is cached in a file so
+# that the JSON files are only parsed again when they change. A registry
+# reloads its index if definitions are installed or removed while it's in
+# use.
+
+
+import os
+import glob
+import json
+import marshal
+import syslog
+import threading
+
+
+ALARMS_DIR = "/usr/share/clearwater/infrastructure/alarms"
+
+# Where the index is cached.
+CACHE_FILE = "/var/run/clearwater/alarm_index"
+
+# The values of ituAlarmPerceivedSeverity (see RFC 3877), which alarm
+# identifiers use for the severity.
+SEVERITIES = {"CLEARED": 1,
+              "INDETERMINATE": 2,
+              "CRITICAL": 3,
+              "MAJOR": 4,
+              "MINOR": 5,
+              "WARNING": 6}
+
+
+class UnknownAlarmError(ValueError):
+  """An alarm identifier doesn't match any alarm definition"""
+  pass
+
+
+class AlarmRegistry(object):
+  """The alarms defined by the *_alarms.json files in a directory"""
+
+  def __init__(self, directory=ALARMS_DIR, cache_file=CACHE_FILE):
+    self.directory = directory
+    self.cache_file = cache_file
+    self._index = None
+    self._index_stamp = None
+    self._lock = threading.Lock()
+
+  def lookup(self, identifier):
+    """Return the name and severity name of an alarm identifier (of the form
+    "<index>.<severity>"), or None if no alarm is defined for it"""
+    index, _, severity = identifier.partition(".")
+    try:
+      key = (int(index), int(severity))
+    except ValueError:
+      return None
+
+    return self.index().get(key)
+
+  def describe(self, identifier):
+    """Return a description of an alarm identifier for use in logs, such as
+    "3500.3 (MEMCACHED_PROCESS_FAIL, CRITICAL)"."""
+    definition = self.lookup(identifier)
+    if definition is None:
+      return identifier
+    return "%s (%s, %s)" % (identifier, definition[0], definition[1])
+
+  def check(self, identifier):
+    """Raise an UnknownAlarmError if an alarm identifier isn't defined. If
+    no alarms are defined at all (for example because the definitions
+    aren't installed) every identifier is accepted."""
+    if self.index() and self.lookup(identifier) is None:
+      raise UnknownAlarmError("unknown alarm: '%s'" % identifier)
+
+  def index(self):
+    """Return the index of alarm definitions, as a dictionary of (alarm
+    index, severity) to (alarm name, severity name). The index is loaded
+    from the cache file if the definitions haven't changed since it was
+    written, and built from the definitions otherwise. It is loaded again
+    if the definitions directory or the cache file has changed since."""
+    with self._lock:
+      if self._index is None or self._stamp() != self._index_stamp:
+        self._index = self._load()
+        self._index_stamp = self._stamp()
+      return self._index
+
+  def _stamp(self):
+    # The modification times of the definitions directory, which changes
+    # when definition files are installed or removed, and of the cache file,
+    # which changes when another process rebuilds the index. Checking these
+    # is much cheaper than checking every definition file.
+    stamp = []
+    for path in (self.directory, self.cache_file):
+      try:
+        stamp.append(os.stat(path).st_mtime)
+      except OSError:
+        stamp.append(None)
+    return stamp
+
+  def _signature(self):
+    # The definition files, with their sizes and modification times, which
+    # change whenever the definitions do.
+    signature = []
+    for path in sorted(glob.glob(os.path.join(self.directory, "*_alarms.json"))):
+      try:
+        stat = os.stat(path)
+      except OSError:
+        continue
+      signature.append((path, stat.st_size, stat.st_mtime))
+    return signature
+
+  def _load(self):
+    signature = self._signature()
+
+    try:
+      with open(self.cache_file, "rb") as f:
+        cached_signature, index = marshal.load(f)
+      if cached_signature == signature:
+        return index
+    except (IOError, EOFError, ValueError, TypeError):
+      pass
+
+    index = self._build(signature)
+
+    # Write the cache atomically, so that other processes never read a
+    # partial file. Failing to write it only means rebuilding next time.
+    try:
+      temp_path = "%s.%d" % (self.cache_file, os.getpid())
+      with open(temp_path, "wb") as f:
+        marshal.dump((signature, index), f)
+      os.rename(temp_path, self.cache_file)
+    except (IOError, OSError):
+      pass
+
+    return index
+
+  def _build(self, signature):
+    index = {}
+
+    for path, _, _ in signature:
+      try:
+        with open(path) as f:
+          definitions = json.load(f)["alarms"]
+      except (IOError, ValueError, KeyError) as e:
+        syslog.syslog(syslog.LOG_ERR, "invalid alarm definitions in %s: %s" % (path, e))
+        continue
+
+      for alarm in definitions:
+        for level in alarm.get("levels", []):
+          severity = SEVERITIES.get(level.get("severity"))
+          if severity is not None:
+            index[(int(alarm["index"]), severity)] = (str(alarm["name"]),
+                                                      str(level["severity"]))
+
+    return index
+
+
+_registry = None
+_registry_lock = threading.Lock()
+
+
+def get_registry():
+  """Return the AlarmRegistry shared by this process"""
+  global _registry
+
+  with _registry_lock:
+    if _registry is None:
+      _registry = AlarmRegistry()
+    return _registry
@@ -9,42 +9,594 @@
 
 
 # This module provides a method for transporting alarm requests to a net-
-# snmp alarm sub-agent for further handling. If the agent is unavailable,
-# the request will timeout after 2 seconds and be dropped.
+# snmp alarm sub-agent for further handling. Requests are spooled (see
+# below) and sent in the background, so that they aren't lost if the agent
+# is unavailable.
+#
+# Callers that send several requests should use an AlarmClient (or the shared
+# one returned by get_client), which keeps its ZMQ context and socket open
+# between requests. sendrequest is kept for existing callers, and uses the
+# shared client.
+#
+# An AlarmClient can also be given an AlarmState, which remembers the last
+# request the client made for each alarm, so that a sender repeatedly issuing
+# an alarm in the same state doesn't send a request to the agent every time.
+# Only the client's own requests are known to it (alarms are also issued by
+# issue-alarm, and by other processes), so only a repeat of the last request
+# for the alarm, from the same issuer, is suppressed. The state is held in
+# memory, so only long-lived senders (daemons holding an AlarmClient, or
+# calling sendrequest repeatedly) benefit. It isn't shared through a file,
+# as a sender would then suppress a raise after issue-alarm had cleared the
+# alarm. Running this module as a script issues an alarm in the same way as
+# issue-alarm, without suppressing repeats.
+#
+# Requests can also be added to an AlarmSpool, which returns immediately.
+# Spooled requests are sent by a background thread, and any that the agent
+# doesn't answer are kept in the spool and sent when it is available again,
+# either by the same process or by running this module with --flush-spool
+# (which is done by cron every minute).
 
 
 import re
 import zmq
 import sys
+import json
+import time
+import fcntl
 import syslog
 import os.path
+import Queue
+import atexit
+import threading
+import alarm_registry
 from subprocess import call
 
 
-def sendrequest(request):
-  try:
-    context = zmq.Context()
+ALARM_AGENT = "ipc:///var/run/clearwater/alarms"
+
+# How long to wait for the agent to answer a request, in milliseconds.
+REQUEST_TIMEOUT_MS = 2000
+
+# How long to keep trying to deliver outstanding messages when a socket is
+# closed, in milliseconds.
+LINGER_MS = 100
+
+# How long (in seconds) to suppress repeats of an alarm in the same state. The
+# state is sent again after this, in case the agent has lost it.
+DEDUP_WINDOW = 60
+
+# Where requests are spooled. This is on a tmpfs, so requests survive the
+# agent or the sender restarting, but not the node rebooting (when every
+# process raises its alarms again anyway).
+SPOOL_FILE = "/var/run/clearwater/alarm_spool"
+
+# How often (in seconds) to retry sending spooled requests while the agent is
+# unavailable.
+SPOOL_RETRY_INTERVAL = 10
+
+
+def parse_alarm(request):
+  """Return the alarm index and severity of an issue-alarm request (of the
+  form ["issue-alarm", <issuer>, "<index>.<severity>"]), or None if the
+  request isn't one."""
+  if len(request) != 3 or request[0] != "issue-alarm":
+    return None
+
+  index, _, severity = request[2].rpartition(".")
+  return (index, severity) if index else None
+
+
+class AlarmState(object):
+  """The last request successfully made by a client for each alarm, used to
+  suppress repeats of it"""
+
+  def __init__(self, window=DEDUP_WINDOW):
+    """@param window - How long (in seconds) to suppress repeated requests."""
+    self.window = window
+    self._alarms = {}
+    self._lock = threading.Lock()
+
+  def is_repeat(self, issuer, index, severity):
+    """Whether the last request for the alarm was made by the same issuer
+    with the same severity, within the window"""
+    with self._lock:
+      issued = self._alarms.get(index)
+
+    return (issued is not None and
+            issued[:2] == (issuer, severity) and
+            time.time() - issued[2] < self.window)
+
+  def record(self, issuer, index, severity):
+    """Record that the issuer has issued the alarm with this severity"""
+    with self._lock:
+      self._alarms[index] = (issuer, severity, time.time())
+
+
+class AlarmSpool(object):
+  """A file of alarm requests waiting to be sent, which may be shared by
+  several processes. Requests are added to the end of the file, and sent in
+  order by flush."""
+
+  def __init__(self, path=SPOOL_FILE):
+    self.path = path
+
+    # flush sends the requests in a separate file, so that requests can be
+    # added while it is waiting for the agent.
+    self._sending_path = path + ".sending"
+
+  def append(self, request):
+    """Add a request to the spool"""
+    with self._locked(".lock"):
+      with open(self.path, "a") as f:
+        f.write(json.dumps(request) + "\n")
+        f.flush()
+        os.fsync(f.fileno())
+
+  def flush(self, send):
+    """Send the spooled requests in order, stopping if one isn't answered
+    (which leaves it and those after it in the spool). Where several
+    requests issue the same alarm, only the last is sent. A request that
+    send raises an exception for is logged and discarded, as it would fail
+    in the same way every time. Returns the number of requests sent (or
+    discarded), or None if another process is already flushing the spool.
+
+       @param send - Function that sends a request, returning the agent's
+         reply or None if it didn't answer."""
+    try:
+      with self._locked(".flush", fcntl.LOCK_EX | fcntl.LOCK_NB):
+        return self._flush(send)
+    except _LockHeld:
+      return None
+
+  def _flush(self, send):
+    # Move any newly spooled requests to the end of the requests being sent.
+    with self._locked(".lock"):
+      requests = self._read(self._sending_path) + self._read(self.path)
+      requests = coalesce_requests(requests)
+      self._write(self._sending_path, requests)
+
+      if os.path.exists(self.path):
+        os.unlink(self.path)
+
+    sent = 0
+
+    for request in requests:
+      try:
+        if send(request) is None:
+          break
+      except Exception as e:
+        syslog.syslog(syslog.LOG_ERR,
+                      "discarding spooled request: '%s': %s" % (" ".join(request), e))
 
-    client = context.socket(zmq.REQ)
-    client.connect("ipc:///var/run/clearwater/alarms")
+      sent += 1
 
-    poller = zmq.Poller()
-    poller.register(client, zmq.POLLIN)
+    if sent == len(requests):
+      os.unlink(self._sending_path)
+    elif sent > 0:
+      self._write(self._sending_path, requests[sent:])
 
-    for reqelem in request[0:-1]:
-      client.send(reqelem, zmq.SNDMORE)
+    return sent
 
-    client.send(request[-1])
+  def pending(self):
+    """Whether there are any requests in the spool"""
+    return any(os.path.exists(path) and os.path.getsize(path) > 0
+               for path in (self.path, self._sending_path))
 
-    socks = dict(poller.poll(2000))
+  def _locked(self, suffix, operation=fcntl.LOCK_EX):
+    return _FileLock(self.path + suffix, operation)
 
-    if client in socks:
-      message = client.recv()
+  def _read(self, path):
+    try:
+      with open(path) as f:
+        lines = f.readlines()
+    except IOError:
+      return []
+
+    requests = []
+    for line in lines:
+      try:
+        requests.append([str(part) for part in json.loads(line)])
+      except ValueError:
+        # A partly written line, from a process that was killed while
+        # spooling a request.
+        syslog.syslog(syslog.LOG_ERR, "discarding spooled request: '%s'" % line)
+
+    return requests
+
+  def _write(self, path, requests):
+    temp_path = path + ".tmp"
+    with open(temp_path, "w") as f:
+      for request in requests:
+        f.write(json.dumps(request) + "\n")
+      f.flush()
+      os.fsync(f.fileno())
+    os.rename(temp_path, path)
+
+
+class _LockHeld(Exception):
+  """A non-blocking attempt to take a _FileLock failed"""
+  pass
+
+
+class _FileLock(object):
+  """Context manager holding an flock on a lock file"""
+
+  def __init__(self, path, operation):
+    self.path = path
+    self.operation = operation
+
+  def __enter__(self):
+    self._file = open(self.path, "a")
+    try:
+      fcntl.flock(self._file, self.operation)
+    except IOError:
+      self._file.close()
+      if self.operation & fcntl.LOCK_NB:
+        raise _LockHeld()
+      raise
+
+  def __exit__(self, *args):
+    self._file.close()
+
+
+def coalesce_requests(requests):
+  """Where several requests issue the same alarm, keep only the last of them
+  (in place of the first). Other requests are kept in order."""
+  coalesced = []
+  alarm_positions = {}
+
+  for request in requests:
+    alarm = parse_alarm(request)
+
+    if alarm is not None and alarm[0] in alarm_positions:
+      coalesced[alarm_positions[alarm[0]]] = request
     else:
-      syslog.syslog(syslog.LOG_ERR, "dropped request: '%s'" % " ".join(request))
+      if alarm is not None:
+        alarm_positions[alarm[0]] = len(coalesced)
+      coalesced.append(request)
+
+  return coalesced
+
+
+class AlarmClient(object):
+  """Client for the alarm agent, keeping a ZMQ context and REQ socket open
+  between requests. The client may be shared between threads."""
+
+  def __init__(self,
+               address=ALARM_AGENT,
+               timeout_ms=REQUEST_TIMEOUT_MS,
+               state=None,
+               spool=None,
+               registry=None):
+    """@param address    - The address of the alarm agent.
+       @param timeout_ms - How long to wait for the agent to answer.
+       @param state      - The AlarmState used to suppress repeated
+         issue-alarm requests, if any.
+       @param spool      - The AlarmSpool used by send_spooled, if any.
+       @param registry   - The AlarmRegistry used to check issue-alarm
+         requests, and describe them in logs, if any."""
+    self.address = address
+    self.timeout_ms = timeout_ms
+    self.state = state
+    self.spool = spool
+    self.registry = registry
+
+    # Counts of requests sent to the agent, requests that it didn't answer,
+    # requests suppressed as repeats, and queued requests dropped because a
+    # later request for the same alarm superseded them.
+    self.counters = {"sent": 0, "dropped": 0, "suppressed": 0, "coalesced": 0}
+
+    self._context = zmq.Context()
+    self._socket = None
+    self._lock = threading.Lock()
+
+    # Requests sent with send_nowait are queued for a background thread,
+    # which is only started when first needed.
+    self._queue = Queue.Queue()
+    self._sender = None
+
+    # Similarly, spooled requests are sent by a background thread, which is
+    # woken when a request is spooled.
+    self._flusher = None
+    self._flush_needed = threading.Event()
+    self._closing = False
+
+  def request(self, request):
+    """Send a request to the agent, and wait for it to answer. Returns the
+    agent's reply, or None if it didn't answer in time. If the request
+    repeats the client's last request for the alarm, it isn't sent and
+    "suppressed" is returned. Raises an alarm_registry.UnknownAlarmError if
+    the request issues an alarm that the client's registry doesn't define.
+
+       @param request - The request, as a list of message parts."""
+    self._check(request)
+    alarm = parse_alarm(request)
+
+    if (alarm is not None and
+        self.state is not None and
+        self.state.is_repeat(request[1], *alarm)):
+      self._count("suppressed")
+      return "suppressed"
+
+    reply = self._send(request)
+
+    if reply is not None and alarm is not None and self.state is not None:
+      # The request has been sent, so failing to record it mustn't fail it.
+      try:
+        self.state.record(request[1], *alarm)
+      except Exception as e:
+        syslog.syslog(syslog.LOG_ERR, str(e))
+
+    return reply
+
+  def send_nowait(self, request, callback=None):
+    """Queue a request to be sent to the agent by a background thread, and
+    return immediately. If several queued requests issue the same alarm
+    before the thread gets to them, only the last is sent.
+
+       @param request  - The request, as a list of message parts.
+       @param callback - If supplied, called (on the background thread) with
+         the agent's reply, or None if the request failed."""
+    self._check(request)
 
-    context.destroy(100)
+    with self._lock:
+      if self._sender is None:
+        self._sender = threading.Thread(target=self._send_queued,
+                                        name="alarm-sender")
+        self._sender.daemon = True
+        self._sender.start()
+
+    self._queue.put((request, callback))
+
+  def send_spooled(self, request):
+    """Add a request to the client's spool, and return immediately. The
+    spooled requests are sent in order by a background thread. If the agent
+    is unavailable, they stay in the spool until it is available again.
+
+       @param request - The request, as a list of message parts."""
+    self._check(request)
+    self.spool.append(request)
+
+    with self._lock:
+      if self._flusher is None:
+        self._flusher = threading.Thread(target=self._flush_spool,
+                                         name="alarm-spool-flusher")
+        self._flusher.daemon = True
+        self._flusher.start()
+
+    self._flush_needed.set()
+
+  def flush(self):
+    """Wait until all the requests queued with send_nowait have been sent,
+    and try once to send any spooled requests"""
+    self._queue.join()
+
+    if self.spool is not None:
+      self.spool.flush(self.request)
+
+  def close(self):
+    """Send any queued requests (and try once to send any spooled requests),
+    then close the client's socket and context"""
+    if self._sender is not None:
+      self._queue.put(None)
+      self._sender.join()
+      self._sender = None
+
+    if self._flusher is not None:
+      self._closing = True
+      self._flush_needed.set()
+      self._flusher.join()
+      self._flusher = None
+
+    with self._lock:
+      self._close_socket()
+      self._context.term()
+
+  def _send(self, request):
+    with self._lock:
+      if self._socket is None:
+        self._socket = self._context.socket(zmq.REQ)
+        self._socket.setsockopt(zmq.LINGER, LINGER_MS)
+        self._socket.connect(self.address)
+
+      try:
+        for reqelem in request[0:-1]:
+          self._socket.send(reqelem, zmq.SNDMORE)
+
+        self._socket.send(request[-1])
+        self.counters["sent"] += 1
+
+        if self._socket.poll(self.timeout_ms, zmq.POLLIN):
+          return self._socket.recv()
+
+      except Exception:
+        # The socket may be part way through a request, so start again with a
+        # new one.
+        self._close_socket()
+        raise
+
+      # A REQ socket can't send another request until it has had a reply to
+      # the last one, so replace it with a new socket.
+      syslog.syslog(syslog.LOG_ERR, "dropped request: '%s'" % self._describe(request))
+      self.counters["dropped"] += 1
+      self._close_socket()
+      return None
+
+  def _check(self, request):
+    if self.registry is not None and parse_alarm(request) is not None:
+      self.registry.check(request[2])
+
+  def _describe(self, request):
+    if self.registry is not None and parse_alarm(request) is not None:
+      request = request[:2] + [self.registry.describe(request[2])]
+    return " ".join(request)
+
+  def _count(self, counter):
+    with self._lock:
+      self.counters[counter] += 1
+
+  def _close_socket(self):
+    if self._socket is not None:
+      self._socket.close(LINGER_MS)
+      self._socket = None
+
+  def _send_queued(self):
+    while True:
+      # Take everything that has been queued, so that bursts of requests can
+      # be coalesced.
+      items = [self._queue.get()]
+      while True:
+        try:
+          items.append(self._queue.get_nowait())
+        except Queue.Empty:
+          break
+
+      try:
+        for request, callbacks in self._coalesce(items):
+          reply = None
+
+          try:
+            reply = self.request(request)
+          except Exception as e:
+            syslog.syslog(syslog.LOG_ERR, str(e))
+
+          for callback in callbacks:
+            try:
+              callback(reply)
+            except Exception as e:
+              syslog.syslog(syslog.LOG_ERR, str(e))
+
+      finally:
+        for _ in items:
+          self._queue.task_done()
+
+      if None in items:
+        return
+
+  def _flush_spool(self):
+    # The thread only wakes up by itself to retry while there are requests
+    # in the spool. Otherwise it waits for a request to be spooled.
+    retry_interval = None
+
+    while True:
+      self._flush_needed.wait(retry_interval)
+      self._flush_needed.clear()
+      retry_interval = None
+
+      try:
+        if self.spool.pending():
+          self.spool.flush(self.request)
+
+          if self.spool.pending():
+            retry_interval = SPOOL_RETRY_INTERVAL
+      except Exception as e:
+        syslog.syslog(syslog.LOG_ERR, str(e))
+        retry_interval = SPOOL_RETRY_INTERVAL
+
+      if self._closing:
+        return
+
+  def _coalesce(self, items):
+    """Coalesce a burst of queued requests. Where several requests issue the
+    same alarm, only the last is sent, in place of the first. Returns a list
+    of (request, callbacks) pairs, where the callbacks are those of all the
+    requests that the request replaces."""
+    coalesced = []
+    alarm_positions = {}
+
+    for item in items:
+      if item is None:
+        break
+
+      request, callback = item
+      callbacks = [callback] if callback is not None else []
+      alarm = parse_alarm(request)
+
+      if alarm is not None and alarm[0] in alarm_positions:
+        position = alarm_positions[alarm[0]]
+        coalesced[position] = (request, coalesced[position][1] + callbacks)
+        self._count("coalesced")
+      else:
+        if alarm is not None:
+          alarm_positions[alarm[0]] = len(coalesced)
+        coalesced.append((request, callbacks))
+
+    return coalesced
+
+
+_client = None
+_client_pid = None
+_client_lock = threading.Lock()
+
+
+def get_client():
+  """Return the AlarmClient shared by this process, creating it if
+  necessary. ZMQ contexts can't be used across a fork, so a forked child gets
+  a new client."""
+  global _client, _client_pid
+
+  with _client_lock:
+    if _client is None or _client_pid != os.getpid():
+      _client = AlarmClient(state=AlarmState(),
+                            spool=AlarmSpool(),
+                            registry=alarm_registry.get_registry())
+      _client_pid = os.getpid()
+
+      # Make sure that requests queued with send_nowait are sent before the
+      # process exits.
+      atexit.register(_close_client, _client, _client_pid)
+
+    return _client
+
+
+def _close_client(client, pid):
+  # A forked child mustn't close its parent's client.
+  if os.getpid() == pid:
+    client.close()
+
+
+def sendrequest(request):
+  # The request is spooled, so that it isn't lost if the agent is unavailable,
+  # unless it can't be spooled, in which case it's sent directly.
+  try:
+    client = get_client()
+
+    if os.path.isdir(os.path.dirname(client.spool.path)):
+      try:
+        client.send_spooled(request)
+        return
+      except EnvironmentError as e:
+        syslog.syslog(syslog.LOG_ERR, "failed to spool request: %s" % e)
+
+    client.request(request)
 
   except Exception as e:
     syslog.syslog(syslog.LOG_ERR, str(e))
 
+
+if __name__ == "__main__":
+  if sys.argv[1:] == ["--flush-spool"]:
+    # Send any spooled requests that couldn't be sent earlier.
+    try:
+      client = AlarmClient()
+      AlarmSpool().flush(client.request)
+      client.close()
+
+    except Exception as e:
+      syslog.syslog(syslog.LOG_ERR, str(e))
+
+    sys.exit(0)
+
+  # Otherwise, usage is the same as issue-alarm.
+  if len(sys.argv) != 3:
+    sys.stderr.write("Usage : alarms.py <alarm issuer name> <alarm identifier>\n")
+    syslog.syslog(syslog.LOG_ERR, "unexpected parameter count: %d" % len(sys.argv))
+    sys.exit(1)
+
+  try:
+    client = AlarmClient(registry=alarm_registry.get_registry())
+    client.request(["issue-alarm", sys.argv[1], sys.argv[2]])
+    client.close()
+
+  except Exception as e:
+    syslog.syslog(syslog.LOG_ERR, str(e))
@@ -19,66 +19,197 @@
 # For example:
 #
 #   ent_log.py namespace CL_SIG_NS_MISMATCH $signaling_namespace
+#
+# Long-running tools can instead import this module and use an EntLogger,
+# which keeps syslog open between logs, and suppresses repeated logs so that
+# (for example) a flapping process can't flood syslog.
 
 
+import os
 import sys
+import glob
+import json
+import time
 import syslog
+import threading
 
 CL_SCRIPT_ID = 6000
 
-# PDLogs is a map of log tuples, indexed by a log template identifier. The
-# log tuple takes the following form (to align with the C++ equivalent in
-# cpp-common/inculde/craft_ent_definitions.h).
-#
-# (Template ID,
-#  Severity,
-#  Message,
-#  Cause,
-#  Effect,
-#  Action
-# )
-
-PDLogs = {
-  'CL_SIG_NS_MISMATCH': (
-    CL_SCRIPT_ID + 1,
-    syslog.LOG_ERR,
-    'Fatal - Clearwater signaling network namespace (%s) does not exist.',
-    'The signaling network namespace (signaling_namespace) defined in /etc/clearwater/config '
-    'does not exist in the kernel (ip netns list).',
-    'Call processing is not available.',
-    'Create the network namespace in the kernel, or adjust the value of signaling_namespace '
-    'in /etc/clearwater/config to match the desired network namespace if it exists.'
-  ),
-  'CL_ETCD_STARTED': (
-    CL_SCRIPT_ID + 2,
-    syslog.LOG_NOTICE,
-    'clearwater-etcd has started.',
-    'The application is starting.',
-    'Normal.',
-    'None.'
-  ),
-  'CL_ETCD_EXITED': (
-    CL_SCRIPT_ID + 3,
-    syslog.LOG_ERR,
-    'clearwater-etcd is exiting.',
-    'The application is exiting.',
-    'Shared config management and datastore cluster management are no longer available.',
-    'This occurs normally when the application is stopped. Wait for monit to restart the application.'
-  ),
-
-}
-
-if len(sys.argv) >= 3:
-  if sys.argv[2] in PDLogs:
-    syslog.openlog(sys.argv[1], 1, syslog.LOG_LOCAL7)
-
-    log = PDLogs[sys.argv[2]]
-
-    if len(sys.argv) >= 4:
-      msg = log[2] % tuple(sys.argv[3:])
-    else:
-      msg = log[2]
-
-    syslog.syslog(log[1], '%d - Description: %s @@Cause: %s @@Effect: %s @@Action: %s' %
-      (log[0], msg, log[3], log[4], log[5]))
+# The log templates are read from the *_ent_logs.json files in this directory.
+TEMPLATES_DIR = "/usr/share/clearwater/infrastructure/ent_logs"
+
+# By default, each template may be logged at most RATE_LIMIT times in any
+# RATE_PERIOD seconds, and a log identical to one made in the last
+# DEDUP_WINDOW seconds is suppressed.
+RATE_LIMIT = 10
+RATE_PERIOD = 60
+DEDUP_WINDOW = 60
+
+
+def load_templates(directory=TEMPLATES_DIR):
+  """Load the log templates, returning a map of log tuples indexed by log
+  template identifier. The log tuple takes the following form (to align with
+  the C++ equivalent in cpp-common/inculde/craft_ent_definitions.h).
+
+  (Template ID,
+   Severity,
+   Message,
+   Cause,
+   Effect,
+   Action
+  )
+  """
+  templates = {}
+
+  for path in sorted(glob.glob(os.path.join(directory, "*_ent_logs.json"))):
+    with open(path) as f:
+      for log in json.load(f)["ent_logs"]:
+        templates[str(log["name"])] = (log["id"],
+                                       getattr(syslog, log["severity"]),
+                                       str(log["message"]),
+                                       str(log["cause"]),
+                                       str(log["effect"]),
+                                       str(log["action"]))
+
+  return templates
+
+
+# Stands in for the message while a template is built.
+_MESSAGE = "\0MESSAGE\0"
+
+
+class TemplateRegistry(object):
+  """Log templates, each precompiled into a single format string that only
+  needs the message variables filling in"""
+
+  def __init__(self, templates):
+    """@param templates - A map of log tuples, as returned by
+         load_templates."""
+    self._compiled = {}
+
+    for name, log in templates.items():
+      # Only the message has variables to fill in, so it is spliced in after
+      # the rest of the text is built, and only % signs in the rest are
+      # escaped. If no variables are supplied, the message is used as it is.
+      text = "%d - Description: %s @@Cause: %s @@Effect: %s @@Action: %s" % (
+        log[0], _MESSAGE, log[3], log[4], log[5])
+      self._compiled[name] = (log[1],
+                              text.replace("%", "%%").replace(_MESSAGE, log[2]),
+                              text.replace(_MESSAGE, log[2]))
+
+  def __contains__(self, name):
+    return name in self._compiled
+
+  def format(self, name, *args):
+    """Return the severity and text of a log"""
+    severity, template, text = self._compiled[name]
+    if args:
+      text = template % args
+    return severity, text
+
+
+_registry = None
+_syslog_ident = None
+_syslog_lock = threading.Lock()
+
+
+def get_registry():
+  """Return the TemplateRegistry of the installed templates, loading them the
+  first time this is called"""
+  global _registry
+
+  with _syslog_lock:
+    if _registry is None:
+      _registry = TemplateRegistry(load_templates())
+    return _registry
+
+
+def _syslog(ident, severity, text):
+  # syslog has a single handle per process, which is only reopened if it
+  # needs a different ident.
+  global _syslog_ident
+
+  with _syslog_lock:
+    if ident != _syslog_ident:
+      syslog.openlog(ident, syslog.LOG_PID, syslog.LOG_LOCAL7)
+      _syslog_ident = ident
+
+    syslog.syslog(severity, text)
+
+
+class EntLogger(object):
+  """Issues ENT logs on behalf of an entity, limiting how often each template
+  is logged and suppressing duplicate logs"""
+
+  def __init__(self,
+               ident,
+               registry=None,
+               rate_limit=RATE_LIMIT,
+               rate_period=RATE_PERIOD,
+               dedup_window=DEDUP_WINDOW):
+    """@param ident        - The issuing entity.
+       @param registry     - The TemplateRegistry to use (by default the
+         installed templates).
+       @param rate_limit   - The number of times each template may be logged
+         in any rate_period seconds.
+       @param rate_period  - See rate_limit.
+       @param dedup_window - How long (in seconds) to suppress logs identical
+         to one already made."""
+    self.ident = ident
+    self.registry = registry or get_registry()
+    self.rate_limit = rate_limit
+    self.rate_period = rate_period
+    self.dedup_window = dedup_window
+
+    # Counts of logs made, and of logs suppressed by the rate limit and as
+    # duplicates.
+    self.counters = {"logged": 0, "rate_limited": 0, "duplicates": 0}
+
+    self._recent = {}
+    self._last_logged = {}
+    self._lock = threading.Lock()
+
+  def log(self, name, *args):
+    """Issue a log. Returns True if it was logged, and False if it was
+    suppressed. Raises a KeyError if there's no such template.
+
+       @param name - The log template identifier.
+       @param args - The values of the message variables."""
+    severity, text = self.registry.format(name, *args)
+    now = time.time()
+
+    with self._lock:
+      last = self._last_logged.get(text)
+      if last is not None and now - last < self.dedup_window:
+        self.counters["duplicates"] += 1
+        return False
+
+      recent = [logged for logged in self._recent.get(name, [])
+                if now - logged < self.rate_period]
+      if len(recent) >= self.rate_limit:
+        self._recent[name] = recent
+        self.counters["rate_limited"] += 1
+        return False
+
+      self._recent[name] = recent + [now]
+      self._last_logged[text] = now
+      self.counters["logged"] += 1
+
+      # Forget duplicates that have aged out, so that this doesn't grow
+      # without limit.
+      if len(self._last_logged) > 1000:
+        self._last_logged = dict((t, logged)
+                                 for t, logged in self._last_logged.items()
+                                 if now - logged < self.dedup_window)
+
+    _syslog(self.ident, severity, text)
+    return True
+
+
+if __name__ == "__main__":
+  if len(sys.argv) >= 3:
+    registry = get_registry()
 
+    if sys.argv[2] in registry:
+      # A single log is never suppressed.
+      EntLogger(sys.argv[1], registry).log(sys.argv[2], *sys.argv[3:])
@@ -8,49 +8,291 @@
 # Metaswitch Networks in a separate written agreement.
 
 import os
-from os.path import isfile, getsize, exists
+import re
+import stat
+import time
+import heapq
+import syslog
 import argparse
+import subprocess
 
-def get_logs(dir, prefix, suffix):
-    """Return a list of all files in dir which start with prefix or end with suffix"""
-    return [dir+'/'+i for i in os.listdir(dir)
-                if ((isfile(dir+'/'+i)) and (((prefix != "") and (i.startswith(prefix))) or ((suffix != "") and (i.endswith(suffix)))))]
+# scandir gets the file type from the directory listing where the filesystem
+# supports it, saving a stat per entry. It is built into Python 3.5 onwards,
+# and is available as a separate package before that.
+try:
+    from os import scandir
+except ImportError:
+    try:
+        from scandir import scandir
+    except ImportError:
+        scandir = None
+
+
+# Compressed logs keep their original name, with this suffix added.
+COMPRESSED_SUFFIX = ".gz"
+
+# By default, logs are compressed by up to COMPRESS_JOBS processes at once,
+# and no more are started once they have used COMPRESS_CPU_BUDGET seconds of
+# CPU time between them. The compression processes run at the lowest CPU and
+# I/O priorities, so that they don't compete with call processing. gzip is
+# forced to compress logs with other hard links, as the diags monitor holds
+# links to the logs in a dump until the dump is archived.
+COMPRESS_JOBS = 2
+COMPRESS_CPU_BUDGET = 60
+COMPRESS_COMMAND = ["ionice", "-c", "3", "nice", "-n", "19", "gzip", "-f"]
+
+# Logs are only compressed once they haven't been written for this long (in
+# seconds).
+COMPRESS_QUIET_PERIOD = 600
+
+
+def _matches(name, prefix, suffix, compressed=False):
+    # When logs are being compressed, a compressed log is still subject to
+    # the same limits.
+    if compressed and name.endswith(COMPRESSED_SUFFIX):
+        name = name[:-len(COMPRESSED_SUFFIX)]
+
+    return (((prefix != "") and (name.startswith(prefix))) or
+            ((suffix != "") and (name.endswith(suffix))))
+
+
+def get_logs(dir, prefix, suffix, compressed=False):
+    """Return a list of (path, size) for all files in dir which start with
+    prefix or end with suffix (or, if compressed is set, would do without
+    the compressed suffix). Each file is only stat'd once."""
+    logs = []
+
+    if scandir is not None:
+        for entry in scandir(dir):
+            if _matches(entry.name, prefix, suffix, compressed):
+                try:
+                    if entry.is_file():
+                        logs.append((entry.path, entry.stat().st_size))
+                except OSError:
+                    # The file has been deleted since the directory was read.
+                    pass
+    else:
+        for name in os.listdir(dir):
+            if _matches(name, prefix, suffix, compressed):
+                path = os.path.join(dir, name)
+                try:
+                    st = os.stat(path)
+                except OSError:
+                    continue
+                if stat.S_ISREG(st.st_mode):
+                    logs.append((path, st.st_size))
+
+    return logs
+
+
+def total(logs):
+    """Return the total filesize, in bytes, of all files in logs"""
+    return sum(size for _, size in logs)
+
+
+def select_for_deletion(logs, maxsize=0, count=0):
+    """Return the oldest logs which must be deleted so that their total size
+    is at most maxsize and there are at most count of them (either limit is
+    ignored if 0), oldest first.
+
+    This can only order files that have a datestamp in the name. It could use
+    the modification time, but running gather_diags could alter this.
+
+    Only the logs that are deleted are taken off the heap, so this is linear
+    in the number of logs when only a few need deleting, rather than sorting
+    all of them."""
+    size_to_delete = total(logs) - maxsize if maxsize != 0 else 0
+    count_to_delete = len(logs) - count if count != 0 else 0
+
+    if size_to_delete <= 0 and count_to_delete <= 0:
+        return []
+
+    heap = list(logs)
+    heapq.heapify(heap)
+    selected = []
+
+    while heap and (size_to_delete > 0 or count_to_delete > 0):
+        log = heapq.heappop(heap)
+        selected.append(log)
+        size_to_delete -= log[1]
+        count_to_delete -= 1
+
+    return selected
+
+
+def _stream(path):
+    # Logs written one after another by the same process have names that only
+    # differ in their datestamps or sequence numbers.
+    return re.sub(r"\d+", "", os.path.basename(path))
+
+
+def rotated_logs(logs, quiet_period=COMPRESS_QUIET_PERIOD):
+    """Return the logs that can be compressed, newest first. Those that
+    may still be being written are left alone: the newest log of each
+    stream, any log that is (or is the target of) a symbolic link, such as a
+    link to the current log, and any log written in the last quiet_period
+    seconds. So are logs that are already compressed, or have a compressed
+    copy already (which gzip won't overwrite)."""
+    linked = set()
+    uncompressed = []
+
+    for path, size in logs:
+        try:
+            st = os.lstat(path)
+        except OSError:
+            continue
+
+        if stat.S_ISLNK(st.st_mode):
+            linked.add(os.path.realpath(path))
+        elif not path.endswith(COMPRESSED_SUFFIX):
+            uncompressed.append((path, size, st.st_mtime))
+
+    newest = {}
+    for path, _, _ in uncompressed:
+        stream = _stream(path)
+        newest[stream] = max(newest.get(stream, path), path)
+
+    quiet_since = time.time() - quiet_period
+
+    return sorted([(path, size) for path, size, mtime in uncompressed
+                   if path != newest[_stream(path)] and
+                   mtime <= quiet_since and
+                   os.path.realpath(path) not in linked and
+                   not os.path.lexists(path + COMPRESSED_SUFFIX)],
+                  reverse=True)
+
+
+def compress_logs(logs, jobs=COMPRESS_JOBS, cpu_budget=COMPRESS_CPU_BUDGET):
+    """Compress logs, in order, replacing each with a compressed copy. Stops
+    starting new compressions once cpu_budget seconds of CPU time have been
+    used. Returns a map from the path of each log compressed to the (path,
+    size) of its compressed copy.
+
+    @param logs       - The (path, size) of each log to compress.
+    @param jobs       - The number of logs to compress at once.
+    @param cpu_budget - The CPU time (in seconds) to spend, or 0 for no
+      limit."""
+    def cpu_used():
+        times = os.times()
+        return times[2] + times[3]
+
+    start_cpu = cpu_used()
+    pending = list(logs)
+    running = []
+    compressed = {}
+
+    def finish(process, path):
+        if process.wait() != 0:
+            syslog.syslog(syslog.LOG_WARNING, "Failed to compress %s" % path)
+            return
+
+        try:
+            compressed[path] = (path + COMPRESSED_SUFFIX,
+                                os.stat(path + COMPRESSED_SUFFIX).st_size)
+        except OSError:
+            pass
+
+    while pending or running:
+        out_of_budget = cpu_budget != 0 and cpu_used() - start_cpu >= cpu_budget
+
+        if pending and len(running) < jobs and not out_of_budget:
+            path, _ = pending.pop(0)
+            running.append((subprocess.Popen(COMPRESS_COMMAND + [path]), path))
+        elif running:
+            finish(*running.pop(0))
+        else:
+            syslog.syslog(syslog.LOG_WARNING,
+                          "Not compressing %d logs, CPU time budget used up" %
+                          len(pending))
+            break
+
+    return compressed
+
+
+def cleanup(dir,
+            prefix="",
+            suffix="",
+            maxsize=0,
+            count=0,
+            dry_run=False,
+            compress=False,
+            jobs=COMPRESS_JOBS,
+            cpu_budget=COMPRESS_CPU_BUDGET,
+            quiet_period=COMPRESS_QUIET_PERIOD):
+    """Delete the oldest logs in dir until they are within maxsize and count.
+    Returns the list of (path, size) deleted (or, for a dry run, that would
+    have been).
+
+    If compress is set, rotated logs are compressed first, and logs are only
+    deleted if the compressed logs are still over the limits. (A dry run
+    doesn't compress anything, so reports what would be deleted without
+    compression.)"""
+    logs = get_logs(dir, prefix, suffix, compress)
+
+    if compress and not dry_run:
+        compressed = compress_logs(rotated_logs(logs, quiet_period),
+                                   jobs,
+                                   cpu_budget)
+        logs = [compressed.get(path, (path, size)) for path, size in logs]
+
+    selected = select_for_deletion(logs, maxsize, count)
+
+    if not dry_run:
+        for path, _ in selected:
+            try:
+                os.unlink(path)
+            except OSError:
+                # Another cleanup has got there first.
+                pass
+
+    return selected
+
+
+def parse_args(args=None):
+    parser = argparse.ArgumentParser(description= 'Delete the oldest files in \
+                                     DIRECTORY beginning with PREFIX and ending with \
+                                     SUFFIX (if set) until the total number is under \
+                                     COUNT and the total size is less than MAXSIZE.')
+
+    parser.add_argument('directory')
+    parser.add_argument('--maxsize', type=int, default=0)
+    parser.add_argument('--count', type=int, default=0)
+    parser.add_argument('--prefix', default="")
+    parser.add_argument('--suffix', default="")
+    parser.add_argument('--dry-run', action='store_true',
+                        help='Report the files that would be deleted, without \
+                              deleting them')
+    parser.add_argument('--compress', action='store_true',
+                        help='Compress rotated logs, and only delete logs if \
+                              they are still over the limits once compressed')
+    parser.add_argument('--compress-jobs', type=int, default=COMPRESS_JOBS,
+                        help='The number of logs to compress at once')
+    parser.add_argument('--compress-cpu-budget', type=float,
+                        default=COMPRESS_CPU_BUDGET,
+                        help='The CPU time (in seconds) to spend compressing \
+                              logs on each run, or 0 for no limit')
+    parser.add_argument('--compress-quiet-period', type=float,
+                        default=COMPRESS_QUIET_PERIOD,
+                        help='How long (in seconds) a log must not have been \
+                              written for before it is compressed')
+    return parser.parse_args(args)
 
-def total(logfiles):
-    """Return the total filesize, in bytes, of all files in logfiles"""
-    return sum([getsize(f) for f in logfiles])
 
 if __name__ == "__main__":
-        parser = argparse.ArgumentParser(description= 'Delete the oldest files in \
-                                         DIRECTORY beginning with PREFIX and ending with \
-                                         SUFFIX (if set) until the total number is under \
-                                         COUNT and the total size is less than MAXSIZE.')
-
-        parser.add_argument('directory')
-        parser.add_argument('--maxsize', type=int, default=0)
-        parser.add_argument('--count', type=int, default=0)
-        parser.add_argument('--prefix', default="")
-        parser.add_argument('--suffix', default="")
-        args = parser.parse_args()
-
-        logs = get_logs(args.directory, args.prefix, args.suffix)
-
-        if args.maxsize != 0:
-                size_to_delete = total(logs) - args.maxsize
-
-                # This can only sort files that have a datestamp in the name. This could
-                # check for modification time, but running gather_diags could alter
-                # this.
-                for logfile in sorted(logs):
-                    if (size_to_delete > 0):
-                        size_to_delete -= getsize(logfile)
-                        os.unlink(logfile)
-
-        if args.count != 0:
-                size_to_delete = len(logs) - args.count
-
-                # This can only sort files that have a datestamp in the name. This could
-                # check for modification time, but running gather_diags could alter
-                # this.
-                for logfile in sorted(logs)[:size_to_delete]:
-                    os.unlink(logfile)
+        args = parse_args()
+
+        deleted = cleanup(args.directory,
+                          args.prefix,
+                          args.suffix,
+                          args.maxsize,
+                          args.count,
+                          args.dry_run,
+                          args.compress,
+                          args.compress_jobs,
+                          args.compress_cpu_budget,
+                          args.compress_quiet_period)
+
+        if args.dry_run:
+                for path, size in deleted:
+                        print "Would delete %s (%d bytes)" % (path, size)
+                print "Would delete %d files, freeing %d bytes" % (len(deleted), total(deleted))
@@ -8,11 +8,27 @@
 # Otherwise no rights are granted except for those provided to you by
 # Metaswitch Networks in a separate written agreement.
 
+import os
 import sys
+import time
+import fnmatch
+import argparse
 import functools
-import pkg_resources
+import threading
+from multiprocessing.pool import ThreadPool
 
+import entry_points
 import check_config_utilities as utils
+import validators as vlds
+
+# The default number of checks to run in parallel. Most checks spend their
+# time waiting on DNS, so this can comfortably exceed the number of CPUs.
+DEFAULT_JOBS = 8
+
+# How long (in seconds) the results saved in a snapshot are reused for by
+# default. Results depend on DNS records as well as on the options, so a check
+# is rerun once its result is this old even if its options haven't changed.
+DEFAULT_SNAPSHOT_TTL = 3600
 
 
 def _check_config_option(option, value):
@@ -32,7 +48,12 @@ def _check_config_option(option, value):
         if option.validator:
 
             # If the option has a a validator, run it now.
-            code = max(code, option.validator(option.name, value))
+            try:
+                code = max(code, option.validator(option.name, value))
+            except utils.DNSBudgetExhausted:
+                utils.not_checked(option.name,
+                                  'ran out of time for DNS lookups')
+                code = max(code, utils.NOT_CHECKED)
 
     else:
 
@@ -49,40 +70,522 @@ def _check_config_option(option, value):
     return code
 
 
-def _check_config_options(options, get_option_value):
-    status = 0
+def _run_advanced_check(advanced_check):
+    try:
+        return advanced_check()
+    except utils.DNSBudgetExhausted:
+        utils.not_checked(getattr(advanced_check, '__name__', 'check'),
+                          'ran out of time for DNS lookups')
+        return utils.NOT_CHECKED
+
+
+# Names for the status codes, as used in JSON output.
+STATUS_NAMES = {utils.OK: 'OK',
+                utils.NOT_CHECKED: 'NOT_CHECKED',
+                utils.WARNING: 'WARNING',
+                utils.ERROR: 'ERROR'}
+
+
+class CheckResult(object):
+    """The result of a single check - either of an option, or an advanced
+    check"""
+
+    def __init__(self, name, validator, status, messages, wall_time, dns_time,
+                 depends_on=None, cached=False):
+        """@param name       - The name of the option, or of the advanced
+             check.
+           @param validator  - The name of the validator run (if any).
+           @param status     - The resulting status code.
+           @param messages   - The messages reported by the check, as a list
+             of (severity, option name, message) tuples.
+           @param wall_time  - The time (in seconds) that the check took.
+           @param dns_time   - The time (in seconds) spent on DNS lookups.
+           @param depends_on - The options the result depends on, as a
+             dictionary of option names to the values they had.
+           @param cached     - Whether the result came from a ResultCache,
+             rather than the check being run."""
+        self.name = name
+        self.validator = validator
+        self.status = status
+        self.messages = messages
+        self.wall_time = wall_time
+        self.dns_time = dns_time
+        self.depends_on = depends_on or {}
+        self.cached = cached
+
+    def from_cache(self):
+        """Return a copy of this result, marked as having come from a
+        cache"""
+        return CheckResult(self.name, self.validator, self.status,
+                           self.messages, self.wall_time, self.dns_time,
+                           self.depends_on, cached=True)
+
+    def to_dict(self):
+        """Return the result as a dictionary, suitable for writing as JSON"""
+        return {'name': self.name,
+                'validator': self.validator,
+                'status': STATUS_NAMES.get(self.status, self.status),
+                'messages': [{'severity': severity,
+                              'option': option,
+                              'message': message}
+                             for severity, option, message in self.messages],
+                'wall_time': round(self.wall_time, 6),
+                'dns_time': round(self.dns_time, 6),
+                'depends_on': self.depends_on,
+                'cached': self.cached}
+
+    @staticmethod
+    def from_dict(result):
+        """Create a CheckResult from a dictionary returned by to_dict"""
+        statuses = dict((name, status)
+                        for status, name in STATUS_NAMES.items())
+
+        return CheckResult(result['name'],
+                           result['validator'],
+                           statuses.get(result['status'], result['status']),
+                           [(message['severity'],
+                             message['option'],
+                             message['message'])
+                            for message in result['messages']],
+                           result['wall_time'],
+                           result['dns_time'],
+                           result['depends_on'],
+                           result['cached'])
+
+
+class ResultCache(object):
+    """A cache of CheckResults, so that checks need not be rerun when none of
+    the options they depend on have changed.
+
+    Results are kept for a limited time (as the DNS records that they
+    depend on may change), and are all discarded if the DNS environment
+    changes. Results of checks that ran out of time are not cached."""
+
+    def __init__(self, ttl):
+        """@param ttl - How long (in seconds) to keep results for, or None to
+             keep them until the options they depend on change."""
+        self.ttl = ttl
+        self.environment = None
+        self._results = {}
+        self._lock = threading.Lock()
+
+    def set_environment(self, environment):
+        """Set the DNS environment that checks are being run in (see
+        utils.dns_environment). If this has changed, all cached results are
+        discarded."""
+        with self._lock:
+            if environment != self.environment:
+                self._results.clear()
+                self.environment = environment
+
+    def clear(self):
+        """Discard all cached results"""
+        with self._lock:
+            self._results.clear()
+
+    def get(self, key, get_option_value, depends_on=None):
+        """Return the cached result for a check, or None if there isn't a
+        valid one.
+
+           @param key              - Identifies the check.
+           @param get_option_value - Function to get the current value of an
+             option.
+           @param depends_on       - The options that the check is now known
+             to depend on, if any. The result is only valid if it was
+             obtained with the same values for these options."""
+        with self._lock:
+            entry = self._results.get(key)
+
+        if entry is None:
+            return None
+
+        result, expiry = entry
+
+        if expiry is not None and expiry <= time.time():
+            return None
+
+        if any(get_option_value(name) != value
+               for name, value in result.depends_on.items()):
+            return None
+
+        # An option that the check depends on may have been newly set since
+        # the result was obtained.
+        if any(name not in result.depends_on
+               for name, value in (depends_on or {}).items()
+               if value is not None):
+            return None
+
+        return result.from_cache()
+
+    def put(self, key, result):
+        """Cache the result of a check"""
+        if result.status == utils.NOT_CHECKED:
+            return
+
+        expiry = None if self.ttl is None else time.time() + self.ttl
+
+        with self._lock:
+            self._results[key] = (result, expiry)
+
+    def save(self, path):
+        """Save the cached results to a file, so that a later run can use them
+        (see load)"""
+        import json
+
+        with self._lock:
+            entries = [{'key': list(key),
+                        'expiry': expiry,
+                        'result': result.to_dict()}
+                       for key, (result, expiry) in self._results.items()]
+
+        # Write to a temporary file first, so that the file is never left
+        # half-written.
+        temp_path = path + '.tmp'
+        with open(temp_path, 'w') as f:
+            json.dump({'environment': self.environment, 'results': entries},
+                      f)
+        os.rename(temp_path, path)
+
+    def load(self, path):
+        """Load results saved with save. Nothing is loaded if the file doesn't
+        exist or can't be read."""
+        import json
+
+        try:
+            with open(path) as f:
+                saved = json.load(f)
+
+            results = dict((tuple(entry['key']),
+                            (CheckResult.from_dict(entry['result']),
+                             entry['expiry']))
+                           for entry in saved['results'])
+        except (IOError, ValueError, KeyError, TypeError):
+            return
+
+        with self._lock:
+            self.environment = saved['environment']
+            self._results = results
+
+
+def _run_check(name, validator, check, context, budget, depends_on):
+    """Run a check, returning its CheckResult.
+
+       @param name       - The name of the option or advanced check.
+       @param validator  - The name of the validator the check runs (if any).
+       @param check      - The check to run. This takes no arguments and
+         returns a status code.
+       @param context    - The context of the thread that is running the
+         checks (see utils.thread_context).
+       @param budget     - The DNSBudget in use, if any. The budget is told
+         when the check finishes.
+       @param depends_on - The options that the check is known to depend on
+         (as a dictionary of names to values). Any options that the check
+         reads are added to these."""
+    with utils.thread_context(context), \
+            utils.capture_messages() as messages, \
+            utils.measure_dns_time() as dns_timer, \
+            utils.record_option_reads() as reads:
+        start = time.time()
+        try:
+            status = check()
+        finally:
+            if budget is not None:
+                budget.check_finished()
+
+    depends_on = dict(depends_on)
+    depends_on.update(reads)
+
+    return CheckResult(name,
+                       validator,
+                       status,
+                       messages,
+                       time.time() - start,
+                       dns_timer.seconds,
+                       depends_on)
+
 
-    # Check that each option is present (if mandatory) and correctly formatted
-    # (if it has a particular format we wish to check).
-    for option in options:
-        value = get_option_value(option.name)
-        code = _check_config_option(option, value)
+def _known_option_names(options):
+    """Return the names of all the options known about - those in the schema,
+    and any others that have been set."""
+    names = set(option.name for option in options)
+    names.update(utils.current_option_values() or os.environ)
+    return names
 
-        # A higher value indicates a worse error.
-        status = max(status, code)
-    return status
 
+def _declared_dependencies(patterns, option_names, get_option_value):
+    """Return the options matching the dependencies declared by a check (see
+    utils.depends_on), as a dictionary of names to their current values.
 
-def check_config(option_schema, get_option_value):
+       @param patterns         - The declared dependencies. These are option
+         names, which may include shell-style wildcards.
+       @param option_names     - The names of all the options known about.
+       @param get_option_value - Function to get the value of an option."""
+    names = set(pattern for pattern in patterns
+                if not any(c in pattern for c in '*?['))
+    names.update(name
+                 for name in option_names
+                 if any(fnmatch.fnmatchcase(name, pattern)
+                        for pattern in patterns))
+    return dict((name, get_option_value(name)) for name in names)
 
-    # Build up a list of checks to be performed. Each check should take no
-    # arguments and return a status code.
-    checks = []
-    checks += [functools.partial(_check_config_options,
-                                 option_schema.get_options(),
-                                 get_option_value)]
-    checks += [functools.partial(advanced_check)
-               for advanced_check in option_schema.get_advanced_checks()]
 
-    # Determine the resultant status code - since ERROR > WARNING > OK, take
-    # the maximum.
-    return max(check() for check in checks)
+def _run_checks(checks, jobs):
+    """Run a list of checks, returning a list of their CheckResults in the
+    same order.
+
+       @param checks - The checks to run. Each should take no arguments and
+         return a CheckResult.
+       @param jobs   - The maximum number of checks to run at once."""
+    if jobs <= 1 or len(checks) <= 1:
+        return [check() for check in checks]
+
+    # Validators that run in the signaling namespace are passed to a separate
+    # pool of threads that stay in that namespace.
+    pool = ThreadPool(min(jobs, len(checks)))
+
+    try:
+        with vlds.signaling_namespace_pool(jobs):
+            return pool.map(lambda check: check(), checks)
+    finally:
+        pool.close()
+        pool.join()
+
+
+def run_checks(option_schema,
+               get_option_value,
+               jobs=1,
+               dns_cache=None,
+               time_budget=None,
+               result_cache=None):
+    """Check the config against an option schema, returning a list of
+    CheckResults - one for each option, followed by one for each advanced
+    check. Messages are not written out, but are held in the results.
+
+       @param option_schema    - The option schema to check against.
+       @param get_option_value - Function to get the value of an option.
+       @param jobs             - The maximum number of checks to run at once.
+       @param dns_cache        - The DNSCache to use for DNS lookups. If not
+         supplied, a new cache is used for this run (unless there is one
+         in use already).
+       @param time_budget      - The time (in seconds) to allow for DNS
+         lookups. Options that can't be checked in this time are reported as
+         NOT_CHECKED. If not supplied, there is no limit.
+       @param result_cache     - The ResultCache to use, if any. Checks with
+         a valid cached result aren't run."""
+    with utils.dns_cache(dns_cache):
+
+        # Build up a list of checks to be performed. Each option is checked
+        # separately (so that options can be checked in parallel if jobs is
+        # more than one), and each check is independent of the others. Each
+        # check also comes with the options it is known to depend on.
+        options = option_schema.get_options()
+        advanced_checks = option_schema.get_advanced_checks()
+        option_names = _known_option_names(options)
+
+        checks = []
+        for option in options:
+            value = get_option_value(option.name)
+            depends_on = _declared_dependencies(option.depends_on,
+                                                option_names,
+                                                get_option_value)
+            depends_on[option.name] = value
+            checks.append((option.name,
+                           getattr(option.validator, '__name__', None),
+                           functools.partial(_check_config_option,
+                                             option,
+                                             value),
+                           depends_on))
+        checks += [(getattr(advanced_check, '__name__', None),
+                    None,
+                    functools.partial(_run_advanced_check, advanced_check),
+                    _declared_dependencies(getattr(advanced_check,
+                                                   'depends_on',
+                                                   ()),
+                                           option_names,
+                                           get_option_value))
+                   for advanced_check in advanced_checks]
+
+        # Use any cached results, and work out which checks still need to be
+        # run.
+        schema_name = getattr(option_schema, '__name__', repr(option_schema))
+        results = [None] * len(checks)
+        to_run = []
+
+        for index, (name, validator, _, depends_on) in enumerate(checks):
+            if result_cache is not None:
+                results[index] = result_cache.get(
+                    (schema_name, name, validator),
+                    get_option_value,
+                    depends_on)
+
+            if results[index] is None:
+                to_run.append(index)
+
+        budget = None
+        if time_budget is not None:
+            budget = utils.DNSBudget(time_budget, len(to_run), jobs)
+
+        context = utils.current_thread_context()
+
+        with utils.dns_budget(budget):
+            run_results = _run_checks(
+                [functools.partial(_run_check,
+                                   checks[index][0],
+                                   checks[index][1],
+                                   checks[index][2],
+                                   context,
+                                   budget,
+                                   checks[index][3])
+                 for index in to_run],
+                jobs)
+
+        for index, result in zip(to_run, run_results):
+            results[index] = result
+
+            if result_cache is not None:
+                result_cache.put((schema_name, result.name, result.validator),
+                                 result)
+
+        return results
+
+
+def worst_status(results):
+    """Return the worst status of a list of CheckResults. Since ERROR >
+    WARNING > NOT_CHECKED > OK, this is the maximum."""
+    return max([utils.OK] + [result.status for result in results])
+
+
+def write_text(results):
+    """Write out the messages from a list of CheckResults to stderr, in the
+    order the checks were made"""
+    for result in results:
+        utils.write_messages(result.messages)
+
+
+def write_timings(results):
+    """Write out how long each check took to stderr, slowest first"""
+    for result in sorted(results, key=lambda r: r.wall_time, reverse=True):
+        sys.stderr.write("{}{}: {:.3f}s ({:.3f}s DNS){}\n".format(
+            result.name,
+            " ({})".format(result.validator) if result.validator else "",
+            result.wall_time,
+            result.dns_time,
+            " (cached)" if result.cached else ""))
+
+
+def check_config(option_schema,
+                 get_option_value,
+                 jobs=1,
+                 dns_cache=None,
+                 time_budget=None):
+    """Check the config against an option schema, writing any messages to
+    stderr and returning the worst status code of any of the checks. The
+    parameters are as for run_checks."""
+    results = run_checks(option_schema,
+                         get_option_value,
+                         jobs,
+                         dns_cache,
+                         time_budget)
+    write_text(results)
+    return worst_status(results)
+
+
+def load_option_schemas():
+    """Load all the option schemas registered as 'option_schemas' entry
+    points"""
+    return [entry_point.load()
+            for entry_point
+            in entry_points.iter_entry_points('option_schemas')]
+
+
+def parse_args(args=None):
+    parser = argparse.ArgumentParser(
+        description='Validate the Clearwater configuration in the environment')
+    parser.add_argument('--jobs', '-j', type=int, default=DEFAULT_JOBS,
+                        help=('The maximum number of checks to run in '
+                              'parallel (default {})'.format(DEFAULT_JOBS)))
+    parser.add_argument('--dns-summary', action='store_true',
+                        help=('Report how many DNS lookups were made, and how '
+                              'many were answered from the cache'))
+    parser.add_argument('--dns-timings', action='store_true',
+                        help='Report how long each DNS lookup took')
+    parser.add_argument('--time-budget', type=float, default=None,
+                        help=('The maximum time in seconds to spend on DNS '
+                              'lookups. Options that could not be checked in '
+                              'this time are reported as not checked'))
+    parser.add_argument('--timings', action='store_true',
+                        help='Report how long each check took')
+    parser.add_argument('--json', action='store_true',
+                        help=('Write the results of each check to stdout as '
+                              'JSON, rather than writing messages to stderr'))
+    parser.add_argument('--snapshot', metavar='FILE', default=None,
+                        help=('Only rerun the checks affected by options that '
+                              'have changed since the config saved in FILE '
+                              'was validated, and save the results to FILE'))
+    parser.add_argument('--snapshot-ttl', type=float,
+                        default=DEFAULT_SNAPSHOT_TTL,
+                        help=('How long (in seconds) to reuse the results '
+                              'saved in the snapshot for (default {})'.format(
+                                  DEFAULT_SNAPSHOT_TTL)))
+    return parser.parse_args(args)
 
 
 if __name__ == '__main__':
-    option_schemas = [entry_point.load()
-                      for entry_point
-                      in pkg_resources.iter_entry_points('option_schemas')]
+    args = parse_args()
+
+    option_schemas = load_option_schemas()
+
+    # Share one DNS cache between all the schemas, so that each distinct
+    # lookup is only made once. The time budget covers all the schemas, so
+    # each schema gets whatever time is left.
+    dns_cache = utils.DNSCache()
+
+    # In snapshot mode, results from earlier runs are reused for any check
+    # whose options haven't changed since, until they expire.
+    result_cache = None
+    if args.snapshot:
+        result_cache = ResultCache(ttl=args.snapshot_ttl)
+        result_cache.load(args.snapshot)
+        result_cache.set_environment(utils.dns_environment())
+
+    end = None if args.time_budget is None else time.time() + args.time_budget
+    results = []
+
+    for option_schema in option_schemas:
+        time_budget = None if end is None else max(0, end - time.time())
+        results += run_checks(option_schema,
+                              utils.get_option_value,
+                              args.jobs,
+                              dns_cache,
+                              time_budget,
+                              result_cache)
+
+    if result_cache is not None:
+        result_cache.save(args.snapshot)
+
+    status = worst_status(results)
+
+    if args.json:
+        import json
+        json.dump({'status': STATUS_NAMES[status],
+                   'checks': [result.to_dict() for result in results],
+                   'dns': {'lookups': dns_cache.misses,
+                           'cached': dns_cache.hits}},
+                  sys.stdout,
+                  indent=2,
+                  sort_keys=True)
+        sys.stdout.write("\n")
+    else:
+        write_text(results)
+
+    if args.timings:
+        write_timings(results)
+
+    if args.dns_timings:
+        for line in dns_cache.timings_report():
+            sys.stderr.write(line + "\n")
+
+    if args.dns_summary:
+        sys.stderr.write(dns_cache.summary() + "\n")
 
-    sys.exit(max(check_config(option_schema, utils.get_option_value)
-             for option_schema in option_schemas))
+    sys.exit(status)
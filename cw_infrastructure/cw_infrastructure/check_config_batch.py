@@ -0,0 +1,228 @@
+#
+# @file check_config_batch.py
+#
+# Copyright (C) Metaswitch Networks 2018
+# If license terms are provided to you in a COPYING file in the root directory
+# of the source code repository by which you are accessing this code, then
+# the license outlined in that COPYING file applies to your use.
+# Otherwise no rights are granted except for those provided to you by
+# Metaswitch Networks in a separate written agreement.
+
+# Check the config of many nodes in one process. The option schemas are loaded
+# once, DNS lookups are shared between all the nodes, and the nodes are checked
+# in parallel.
+#
+# The configs to check are supplied either as a JSON object mapping node names
+# to objects of option names and values, or as config files (in the same
+# format as /etc/clearwater/shared_config) with one file per node. The results
+# are written to stdout as JSON.
+
+import sys
+import json
+import argparse
+import functools
+import threading
+from multiprocessing.pool import ThreadPool
+
+import check_config
+import check_config_utilities as utils
+import config_files
+
+# The default number of nodes to check in parallel.
+DEFAULT_JOBS = 16
+
+
+class CachedSchema(object):
+    """Wrapper for an option schema that only builds the options and advanced
+    checks once for each distinct set of option values that they depend on."""
+
+    def __init__(self, option_schema):
+        self._option_schema = option_schema
+        self._cache = {'get_options': [], 'get_advanced_checks': []}
+        self._lock = threading.Lock()
+
+    def get_options(self):
+        return self._get('get_options')
+
+    def get_advanced_checks(self):
+        return self._get('get_advanced_checks')
+
+    def _get(self, method):
+        # Each cache entry records the option values that were read while it
+        # was built. The entry can be reused if those options still have the
+        # same values.
+        with self._lock:
+            entries = list(self._cache[method])
+
+        for reads, result in entries:
+            if all(utils.get_option_value(name) == value
+                   for name, value in reads.items()):
+                return result
+
+        with utils.record_option_reads() as reads:
+            result = getattr(self._option_schema, method)()
+
+        with self._lock:
+            self._cache[method].append((reads, result))
+
+        return result
+
+
+def _error_result(messages):
+    """Return the result of a node that couldn't be checked.
+
+       @param messages - The errors, as a list of (option name, message)
+         pairs. The option name is None for errors affecting the whole
+         config."""
+    return {'status': utils.ERROR,
+            'messages': [{'severity': 'ERROR',
+                          'option': option,
+                          'message': message}
+                         for option, message in messages],
+            'checks': []}
+
+
+def config_errors(values):
+    """Return the reasons that a node's config can't be checked, as a list of
+    (option name, message) pairs. The config must be a dictionary of option
+    names to string values, as the validators only handle strings."""
+    if not isinstance(values, dict):
+        return [(None, 'config must be an object of option names to values')]
+
+    return [(name, 'value must be a string, not {}'.format(
+                json.dumps(value)))
+            for name, value in sorted(values.items())
+            if not isinstance(value, basestring)]
+
+
+def check_node(option_schemas, values, jobs=1):
+    """Check the config of a single node against all the option schemas.
+    Returns a dictionary holding the resulting status code, any messages and
+    the results of the individual checks (see check_config.CheckResult). If
+    the node can't be checked, the status is ERROR and the messages say
+    why.
+
+    The config belongs to another node, so any checks that have to run in
+    its signaling namespace are reported as NOT_CHECKED.
+
+       @param option_schemas - The option schemas to check against.
+       @param values         - A dictionary of the node's option values.
+       @param jobs           - The maximum number of checks to run at
+         once."""
+    errors = config_errors(values)
+    if errors:
+        return _error_result(errors)
+
+    results = []
+
+    try:
+        with utils.option_values(values), utils.remote_config():
+            for option_schema in option_schemas:
+                results += check_config.run_checks(option_schema,
+                                                   utils.get_option_value,
+                                                   jobs)
+    except Exception as e:
+        return _error_result([(None, 'checking the config failed: {}'.format(
+            e))])
+
+    checks = [result.to_dict() for result in results]
+
+    return {'status': check_config.worst_status(results),
+            'messages': [message
+                         for check in checks
+                         for message in check['messages']],
+            'checks': checks}
+
+
+def check_nodes(option_schemas, configs, jobs=DEFAULT_JOBS):
+    """Check the config of many nodes. Nodes with identical config are only
+    checked once, and all nodes share the same DNS cache. Returns a dictionary
+    of node names to results (as returned by check_node).
+
+       @param option_schemas - The option schemas to check against.
+       @param configs        - A dictionary of node names to dictionaries of
+         their option values.
+       @param jobs           - The maximum number of checks to run at once.
+         These are shared between the nodes being checked in parallel."""
+    option_schemas = [CachedSchema(option_schema)
+                      for option_schema in option_schemas]
+    node_results = {}
+
+    # Group the nodes by their config, so each distinct config is checked
+    # once. Nodes whose config can't be checked are reported straight away.
+    nodes_by_config = {}
+    for node, values in configs.items():
+        errors = config_errors(values)
+        if errors:
+            node_results[node] = _error_result(errors)
+        else:
+            key = frozenset(values.items())
+            nodes_by_config.setdefault(key, []).append(node)
+
+    distinct_configs = [dict(key) for key in nodes_by_config]
+
+    # Check as many nodes at once as possible, and share out any jobs left
+    # over for running each node's checks in parallel.
+    node_jobs = max(1, min(jobs, len(distinct_configs)))
+    check = functools.partial(check_node,
+                              option_schemas,
+                              jobs=max(1, jobs // node_jobs))
+
+    with utils.dns_cache():
+        if node_jobs <= 1:
+            results = [check(values) for values in distinct_configs]
+        else:
+            pool = ThreadPool(node_jobs)
+            try:
+                results = pool.map(check, distinct_configs)
+            finally:
+                pool.close()
+                pool.join()
+
+    for nodes, result in zip(nodes_by_config.values(), results):
+        for node in nodes:
+            node_results[node] = result
+    return node_results
+
+
+def read_config_file(filename):
+    """Read the option values from a config file (see
+    config_files.read_config_file)"""
+    return config_files.read_config_file(filename)
+
+
+def parse_args(args=None):
+    parser = argparse.ArgumentParser(
+        description='Validate the Clearwater configuration of many nodes')
+    parser.add_argument('config_files', nargs='*', metavar='config_file',
+                        help=('A file holding the config of one node. The '
+                              'node is named after the file'))
+    parser.add_argument('--json', type=argparse.FileType('r'),
+                        help=('A file holding a JSON object of node names to '
+                              'objects of option names and values (or - for '
+                              'stdin)'))
+    parser.add_argument('--jobs', '-j', type=int, default=DEFAULT_JOBS,
+                        help=('The maximum number of checks to run in '
+                              'parallel, shared between the nodes being '
+                              'checked (default {})'.format(DEFAULT_JOBS)))
+    return parser.parse_args(args)
+
+
+if __name__ == '__main__':
+    args = parse_args()
+
+    configs = {}
+    if args.json:
+        configs.update(json.load(args.json))
+    for filename in args.config_files:
+        configs[filename] = read_config_file(filename)
+
+    results = check_nodes(check_config.load_option_schemas(),
+                          configs,
+                          args.jobs)
+
+    json.dump(results, sys.stdout, indent=2, sort_keys=True)
+    sys.stdout.write("\n")
+
+    sys.exit(max([utils.OK] + [result['status']
+                               for result in results.values()]))
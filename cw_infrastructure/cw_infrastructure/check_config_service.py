@@ -0,0 +1,286 @@
+#
+# @file check_config_service.py
+#
+# Copyright (C) Metaswitch Networks 2018
+# If license terms are provided to you in a COPYING file in the root directory
+# of the source code repository by which you are accessing this code, then
+# the license outlined in that COPYING file applies to your use.
+# Otherwise no rights are granted except for those provided to you by
+# Metaswitch Networks in a separate written agreement.
+
+# A long-running config checking service, reachable over a Unix socket.
+#
+# The service loads the option schemas once, and keeps the DNS cache and the
+# results of previous checks. A check is only rerun if one of the options it
+# depends on has changed, its previous result is older than the TTL, or the
+# local DNS configuration has changed.
+#
+# The service is run by the clearwater-check-config init script (under
+# monit), as:
+#
+#   python -m cw_infrastructure.check_config_service serve
+#
+# clearwater-check-config (see check_node_config) uses the service to check
+# the option values. The config in the environment can also be checked with:
+#
+#   python -m cw_infrastructure.check_config_service check
+#
+# which behaves like python -m cw_infrastructure.check_config. If the
+# service isn't running, or can't answer, the checks are run in the client
+# instead.
+#
+# The option schemas come from the packages installed on the node, so the
+# service exits (to be restarted by monit) once any of them is installed,
+# upgraded or removed.
+#
+# Requests and responses are single lines of JSON. A request is an object
+# holding the option values to check ("options"), and optionally whether to
+# ignore cached results ("refresh") and the time to allow for DNS lookups
+# ("time_budget"). The response holds the worst status
+# ("status") and the result of each check ("checks", see
+# CheckResult.to_dict).
+
+import os
+import re
+import sys
+import json
+import socket
+import argparse
+import threading
+import SocketServer
+
+import check_config
+import check_config_utilities as utils
+import entry_points
+
+DEFAULT_SOCKET = '/var/run/clearwater/check_config.sock'
+
+# How long (in seconds) to keep the results of checks for by default.
+DEFAULT_TTL = 300
+
+
+class CheckConfigService(object):
+    """Checks config against the option schemas, keeping the results of
+    previous checks"""
+
+    def __init__(self, option_schemas, ttl=DEFAULT_TTL,
+                 jobs=check_config.DEFAULT_JOBS):
+        self.option_schemas = option_schemas
+        self.jobs = jobs
+        self.result_cache = check_config.ResultCache(ttl)
+        self.dns_cache = utils.DNSCache()
+        self._stamp = entry_points.distributions_stamp()
+
+        # Checks are run one request at a time, as the pools and caches they
+        # use are shared by all threads.
+        self._lock = threading.Lock()
+
+    def is_stale(self):
+        """Whether any package has been installed, upgraded or removed since
+        the service started, in which case its option schemas may be out of
+        date"""
+        return entry_points.distributions_stamp() != self._stamp
+
+    def check(self, values, refresh=False, time_budget=None):
+        """Check a set of option values. Returns a list of CheckResults.
+
+           @param values      - A dictionary of option names to values.
+           @param refresh     - If True, cached results are not used.
+           @param time_budget - The time (in seconds) to allow for DNS
+             lookups, if limited."""
+        with self._lock:
+            environment = utils.dns_environment()
+
+            if refresh or environment != self.result_cache.environment:
+                self.dns_cache = utils.DNSCache()
+                self.result_cache.clear()
+            else:
+                self.dns_cache.prune()
+
+            self.result_cache.set_environment(environment)
+
+            results = []
+            with utils.option_values(values):
+                for option_schema in self.option_schemas:
+                    results += check_config.run_checks(
+                        option_schema,
+                        utils.get_option_value,
+                        self.jobs,
+                        self.dns_cache,
+                        time_budget,
+                        self.result_cache)
+            return results
+
+    def handle_request(self, request):
+        """Handle a request, returning the response"""
+        results = self.check(request.get('options', {}),
+                             request.get('refresh', False),
+                             request.get('time_budget'))
+        status = check_config.worst_status(results)
+        return {'status': status,
+                'checks': [result.to_dict() for result in results]}
+
+
+class _RequestHandler(SocketServer.StreamRequestHandler):
+
+    def handle(self):
+        if self.server.service.is_stale():
+            # Leave the client to run the checks itself while the service is
+            # restarted.
+            self.wfile.write(json.dumps({'error': 'restarting'}) + "\n")
+            threading.Thread(target=self.server.shutdown).start()
+            return
+
+        try:
+            request = json.loads(self.rfile.readline())
+            response = self.server.service.handle_request(request)
+        except Exception as e:
+            response = {'error': str(e)}
+
+        self.wfile.write(json.dumps(response) + "\n")
+
+
+class _Server(SocketServer.ThreadingMixIn, SocketServer.UnixStreamServer):
+    daemon_threads = True
+
+
+def make_server(service, socket_path=DEFAULT_SOCKET):
+    """Create a server for the service, listening on a Unix socket. Call
+    serve_forever() on the server to handle requests."""
+    if os.path.exists(socket_path):
+        os.unlink(socket_path)
+
+    # Only root may use the socket, as the service runs checks in the
+    # signaling namespace.
+    old_umask = os.umask(0o177)
+    try:
+        server = _Server(socket_path, _RequestHandler)
+    finally:
+        os.umask(old_umask)
+
+    server.service = service
+    return server
+
+
+def request_check(values, socket_path=DEFAULT_SOCKET, refresh=False,
+                  timeout=None, time_budget=None):
+    """Ask the service to check a set of option values. Returns the response
+    (see the top of this file).
+
+       @param values      - A dictionary of option names to values.
+       @param socket_path - The socket the service is listening on.
+       @param refresh     - If True, the service doesn't use cached results.
+       @param timeout     - How long to wait for the response, in seconds.
+       @param time_budget - The time (in seconds) to allow for DNS lookups,
+         if limited."""
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    sock.settimeout(timeout)
+
+    try:
+        sock.connect(socket_path)
+        f = sock.makefile('rw')
+        f.write(json.dumps({'options': values,
+                            'refresh': refresh,
+                            'time_budget': time_budget}) + "\n")
+        f.flush()
+        response = json.loads(f.readline())
+    finally:
+        sock.close()
+
+    if 'error' in response:
+        raise RuntimeError(response['error'])
+
+    return response
+
+
+def check_values(values,
+                 socket_path=DEFAULT_SOCKET,
+                 refresh=False,
+                 jobs=check_config.DEFAULT_JOBS,
+                 time_budget=None):
+    """Check a set of option values, returning a list of CheckResults. The
+    checks are made by the service if it is running, and in this process
+    otherwise.
+
+       @param values      - A dictionary of option names to values.
+       @param socket_path - The socket the service is listening on.
+       @param refresh     - If True, the service doesn't use cached results.
+       @param jobs        - The maximum number of checks to run at once, if
+         they are run in this process.
+       @param time_budget - The time (in seconds) to allow for DNS lookups,
+         if limited."""
+    try:
+        response = request_check(values,
+                                 socket_path,
+                                 refresh,
+                                 time_budget=time_budget)
+        return [check_config.CheckResult.from_dict(check)
+                for check in response['checks']]
+    except (socket.error, RuntimeError, ValueError):
+        pass
+
+    results = []
+    dns_cache = utils.DNSCache()
+
+    with utils.option_values(values):
+        for option_schema in check_config.load_option_schemas():
+            results += check_config.run_checks(option_schema,
+                                               utils.get_option_value,
+                                               jobs,
+                                               dns_cache,
+                                               time_budget)
+    return results
+
+
+def check_environment(socket_path=DEFAULT_SOCKET, refresh=False):
+    """Check the config in the environment, writing any messages to stderr
+    and returning the worst status (see check_values).
+
+       @param socket_path - The socket the service is listening on.
+       @param refresh     - If True, the service doesn't use cached results."""
+    results = check_values(environment_options(), socket_path, refresh)
+    check_config.write_text(results)
+    return check_config.worst_status(results)
+
+
+def environment_options():
+    """Return the config options in the environment. Like
+    clearwater-show-config, this assumes that any environment variable in
+    lower-case snake-case is a config option."""
+    return dict((name, value) for name, value in os.environ.items()
+                if re.match(r"^[a-z_]+$", name))
+
+
+def parse_args(args=None):
+    parser = argparse.ArgumentParser(
+        description='Long-running service for validating Clearwater config')
+    parser.add_argument('--socket', default=DEFAULT_SOCKET,
+                        help='The Unix socket to use')
+    subparsers = parser.add_subparsers(dest='command')
+
+    serve_parser = subparsers.add_parser('serve', help='Run the service')
+    serve_parser.add_argument('--ttl', type=float, default=DEFAULT_TTL,
+                              help=('How long (in seconds) to keep the '
+                                    'results of checks for'))
+    serve_parser.add_argument('--jobs', '-j', type=int,
+                              default=check_config.DEFAULT_JOBS,
+                              help='The maximum number of checks to run in '
+                                   'parallel')
+
+    check_parser = subparsers.add_parser(
+        'check', help='Check the config in the environment using the service')
+    check_parser.add_argument('--refresh', action='store_true',
+                              help='Rerun every check')
+    return parser.parse_args(args)
+
+
+if __name__ == '__main__':
+    args = parse_args()
+
+    if args.command == 'serve':
+        service = CheckConfigService(check_config.load_option_schemas(),
+                                     args.ttl,
+                                     args.jobs)
+        make_server(service, args.socket).serve_forever()
+    else:
+        sys.exit(check_environment(args.socket, args.refresh))
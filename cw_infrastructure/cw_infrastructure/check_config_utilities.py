@@ -12,17 +12,125 @@ import os
 import sys
 import socket
 import re
-import dns.resolver
+import math
+import hashlib
+import time
+import threading
+from contextlib import contextmanager
 
 # Statuses
 
 ERROR = 5
 WARNING = 4
+NOT_CHECKED = 3
 OK = 0
 
+# How long (in seconds) to remember that a DNS lookup failed.
+NEGATIVE_DNS_TTL = 60
+
+# timeout is the time spent waiting for each DNS server.
+# lifetime is the time spent waiting for a response overall.
+# By setting timeout to 2 and lifetime to 4, we allow time for us to
+# check at least 2 of our DNS servers before we give up.
+DNS_TIMEOUT = 2.0
+DNS_LIFETIME = 4.0
+
+# Per-thread state. This holds the option values being checked (if they
+# don't come from the environment), whether they are another node's config,
+# the list that error and warning messages are captured into (if any), the
+# network namespace that DNS lookups are made in, the DNS servers that lookups
+# should be sent to (if they should not go to the system default servers) and
+# this thread's resolvers.
+_thread_state = threading.local()
+
+# The cache of DNS lookup results and the time budget for DNS lookups in use
+# (if any). These are shared by all threads.
+_dns_cache = None
+_dns_budget = None
+
+
+class DNSBudgetExhausted(Exception):
+    """Raised when a DNS lookup can't be made (or was cut short) because the
+    time budget for DNS lookups has run out."""
+    pass
+
 
 def get_option_value(option_name):
-    return os.environ.get(option_name)
+    values = getattr(_thread_state, 'option_values', None)
+
+    if values is None:
+        value = os.environ.get(option_name)
+    else:
+        value = values.get(option_name)
+
+    reads = getattr(_thread_state, 'option_reads', None)
+    if reads is not None:
+        reads[option_name] = value
+
+    return value
+
+
+def current_option_values():
+    """Return the option values set by option_values for this thread, or None
+    if options are being read from the environment."""
+    return getattr(_thread_state, 'option_values', None)
+
+
+@contextmanager
+def option_values(values):
+    """Read option values from the given dictionary, rather than from the
+    environment, on this thread for the duration of the context.
+
+       @param values - A dictionary of option names to values, or None to
+         read values from the environment."""
+    previous = current_option_values()
+    _thread_state.option_values = values
+
+    try:
+        yield
+    finally:
+        _thread_state.option_values = previous
+
+
+def checking_remote_config():
+    """Whether the option values being checked on this thread are another
+    node's config (see remote_config)."""
+    return getattr(_thread_state, 'remote_config', False)
+
+
+@contextmanager
+def remote_config():
+    """Treat the option values being checked on this thread as another
+    node's config for the duration of the context. The network namespaces
+    named in the config only exist on that node, so checks that would run in
+    them are reported as not checked."""
+    previous = checking_remote_config()
+    _thread_state.remote_config = True
+
+    try:
+        yield
+    finally:
+        _thread_state.remote_config = previous
+
+
+@contextmanager
+def record_option_reads():
+    """Record the options read with get_option_value on this thread for the
+    duration of the context. Yields a dictionary of the options read to the
+    values they had."""
+    previous = getattr(_thread_state, 'option_reads', None)
+    _thread_state.option_reads = {}
+
+    try:
+        yield _thread_state.option_reads
+    finally:
+        reads = _thread_state.option_reads
+        _thread_state.option_reads = previous
+
+        # Options read within the context were also read in any enclosing
+        # context.
+        if previous is not None:
+            previous.update(reads)
 
 
 def error(option_name, message):
@@ -30,7 +138,7 @@ def error(option_name, message):
 
        @param option_name - The name of the option the error relates to.
        @param message     - A description of the problem"""
-    sys.stderr.write("ERROR: {}: {}\n".format(option_name, message))
+    _report("ERROR", option_name, message)
 
 
 def warning(option_name, message):
@@ -38,7 +146,104 @@ def warning(option_name, message):
 
        @param option_name - The name of the option the warning relates to.
        @param message     - A description of the problem"""
-    sys.stderr.write("WARNING: {}: {}\n".format(option_name, message))
+    _report("WARNING", option_name, message)
+
+
+def not_checked(option_name, message):
+    """Utility method to report that an option could not be checked.
+
+       @param option_name - The name of the option that wasn't checked.
+       @param message     - Why the option wasn't checked"""
+    _report("NOT CHECKED", option_name, message)
+
+
+def _report(level, option_name, message):
+    """Write a message to stderr, or to the capture list for this thread if
+    one has been set up by capture_messages."""
+    messages = getattr(_thread_state, 'messages', None)
+
+    if messages is not None:
+        messages.append((level, option_name, message))
+    else:
+        sys.stderr.write("{}: {}: {}\n".format(level, option_name, message))
+
+
+@contextmanager
+def capture_messages():
+    """Capture the error and warning messages written by this thread, rather
+    than writing them straight to stderr. Yields the list that the messages
+    are appended to, which can later be written out with write_messages."""
+    previous = getattr(_thread_state, 'messages', None)
+    _thread_state.messages = []
+
+    try:
+        yield _thread_state.messages
+    finally:
+        _thread_state.messages = previous
+
+
+def write_messages(messages):
+    """Write out a list of messages captured by capture_messages, in order."""
+    for level, option_name, message in messages:
+        _report(level, option_name, message)
+
+
+class DNSTimer(object):
+    """Accumulates the time spent on DNS lookups"""
+
+    def __init__(self):
+        self.seconds = 0.0
+
+
+@contextmanager
+def measure_dns_time():
+    """Measure the time spent on DNS lookups by this thread for the duration
+    of the context. Yields a DNSTimer holding the time spent."""
+    previous = getattr(_thread_state, 'dns_timer', None)
+    _thread_state.dns_timer = DNSTimer()
+
+    try:
+        yield _thread_state.dns_timer
+    finally:
+        _thread_state.dns_timer = previous
+
+
+# The parts of the per-thread state that are passed on when work is handed
+# from one thread to another. The network namespace isn't passed on, as the
+# other thread won't be in the namespace.
+_CONTEXT_ATTRIBUTES = ('option_values',
+                       'remote_config',
+                       'option_reads',
+                       'messages',
+                       'dns_timer',
+                       'nameservers')
+
+
+def current_thread_context():
+    """Return the state of this thread that should be passed on to any
+    thread that does work on its behalf (see thread_context)."""
+    return dict((attribute, getattr(_thread_state, attribute, None))
+                for attribute in _CONTEXT_ATTRIBUTES)
+
+
+@contextmanager
+def thread_context(context):
+    """Take on the state of another thread for the duration of the context,
+    so that options are read and recorded, messages are reported, DNS lookups
+    are made and DNS time is measured as if on that thread. The other thread
+    should not use its state until the context ends.
+
+       @param context - The state, as returned by current_thread_context."""
+    previous = current_thread_context()
+
+    for attribute, value in context.items():
+        setattr(_thread_state, attribute, value)
+
+    try:
+        yield
+    finally:
+        for attribute, value in previous.items():
+            setattr(_thread_state, attribute, value)
 
 
 def ip_version(value):
@@ -108,20 +313,293 @@ def is_srv_resolvable(srv):
 def is_domain_resolvable(name, rrtype):
     """Check whether the given domain has any records of the given type"""
 
+    cache = _dns_cache
+    start = time.time()
+
     try:
-        resolver = dns.resolver.get_default_resolver()
-
-        # timeout is the time spent waiting for each DNS server.
-        # lifetime is the time spent waiting for a response overall.
-        # By setting timeout to 2 and lifetime to 4, we allow time for us to
-        # check at least 2 of our DNS servers before we give up.
-        resolver.timeout = 2.0
-        resolver.lifetime = 4.0
+        if cache is None:
+            return _query(name, rrtype)[0]
+
+        key = (name.lower(),
+               rrtype,
+               current_dns_namespace(),
+               getattr(_thread_state, 'nameservers', None))
+        return cache.lookup(key, lambda: _query(name, rrtype))
+
+    finally:
+        timer = getattr(_thread_state, 'dns_timer', None)
+        if timer is not None:
+            timer.seconds += time.time() - start
+
+
+def _query(name, rrtype):
+    """Look up the records of the given type for the given domain. Returns
+    whether there are any, and the time (as returned by time.time()) after
+    which the result should no longer be relied upon."""
+
+    # dnspython is only imported when a lookup is actually made, as many runs
+    # don't need it.
+    import dns.exception
+
+    budget = _dns_budget
+    lifetime = DNS_LIFETIME
+
+    if budget is not None:
+        lifetime = budget.lookup_lifetime()
+
+    try:
+        resolver = _get_resolver(lifetime)
         answers = resolver.query(name, rrtype)
-        return len(answers) != 0
+        return len(answers) != 0, answers.expiration
+
+    except dns.exception.Timeout:
+        if lifetime < DNS_LIFETIME:
+            # The lookup may have succeeded if we'd given it longer.
+            raise DNSBudgetExhausted()
+        return False, time.time() + NEGATIVE_DNS_TTL
 
     except Exception:
-        return False
+        return False, time.time() + NEGATIVE_DNS_TTL
+
+
+class DNSBudget(object):
+    """A time budget for all the DNS lookups made by a set of checks.
+
+    The time remaining is shared out between the checks that haven't
+    finished yet, so that a few unresolvable names can't use up all the time
+    and leave no time for the remaining checks."""
+
+    def __init__(self, seconds, checks, parallelism=1):
+        """@param seconds     - The total time budget.
+           @param checks      - The number of checks that will be made.
+           @param parallelism - How many of the checks run at once."""
+        self._end = time.time() + seconds
+        self._pending = checks
+        self._parallelism = max(1, parallelism)
+        self._lock = threading.Lock()
+
+    def check_finished(self):
+        """Record that one of the checks has finished"""
+        with self._lock:
+            self._pending = max(0, self._pending - 1)
+
+    def lookup_lifetime(self):
+        """Return how long the next DNS lookup may take. Raises
+        DNSBudgetExhausted if there is no time left."""
+        remaining = self._end - time.time()
+
+        if remaining <= 0:
+            raise DNSBudgetExhausted()
+
+        with self._lock:
+            rounds = math.ceil(float(max(1, self._pending)) /
+                               self._parallelism)
+
+        return min(DNS_LIFETIME, remaining / rounds)
+
+
+class DNSCache(object):
+    """A cache of the results of DNS lookups, shared between threads.
+
+    Results are kept until the TTL of the records expires, and failed lookups
+    are remembered for NEGATIVE_DNS_TTL seconds. If several threads look up
+    the same key at once, only one query is made and the others wait for its
+    result."""
+
+    def __init__(self):
+        self.hits = 0
+        self.misses = 0
+        self.timings = []
+        self._results = {}
+        self._pending = {}
+        self._lock = threading.Lock()
+
+    def lookup(self, key, query):
+        """Get the cached result for the given key, or call query to get it.
+
+           @param key   - The key to cache the result under.
+           @param query - A function taking no arguments that returns the
+             result and the time at which it expires."""
+        with self._lock:
+            while True:
+                if key in self._results:
+                    result, expiration = self._results[key]
+                    if expiration > time.time():
+                        self.hits += 1
+                        return result
+                    del self._results[key]
+
+                if key not in self._pending:
+                    break
+
+                # Another thread is looking this key up already. Wait for it
+                # to finish, then check again.
+                pending = self._pending[key]
+                self._lock.release()
+                try:
+                    pending.wait()
+                finally:
+                    self._lock.acquire()
+
+            self.misses += 1
+            pending = self._pending[key] = threading.Event()
+
+        try:
+            start = time.time()
+            result, expiration = query()
+            with self._lock:
+                self._results[key] = (result, expiration)
+                self.timings.append((key, time.time() - start, result))
+        finally:
+            with self._lock:
+                del self._pending[key]
+            pending.set()
+
+        return result
+
+    def prune(self):
+        """Forget the results that have expired, and the timings of the
+        lookups made so far. A cache that is kept for a long time should be
+        pruned regularly, so that it doesn't grow without limit."""
+        now = time.time()
+
+        with self._lock:
+            self._results = dict((key, entry)
+                                 for key, entry in self._results.items()
+                                 if entry[1] > now)
+            self.timings = []
+
+    def summary(self):
+        """Return a one-line description of how well the cache has done"""
+        return "{} DNS lookups made, {} answered from the cache".format(
+            self.misses, self.hits)
+
+    def timings_report(self):
+        """Return a line per DNS lookup made, saying how long it took"""
+        line = "DNS lookup of {} {} took {:.3f}s ({})"
+        return [line.format(key[0],
+                            key[1],
+                            duration,
+                            "resolved" if result else "not resolved")
+                for key, duration, result in self.timings]
+
+
+@contextmanager
+def dns_cache(cache=None):
+    """Cache the results of DNS lookups, from all threads, for the duration
+    of the context. Yields the cache in use.
+
+       @param cache - The DNSCache to use. If not supplied, a new cache is
+         created (unless there is already one in use, which is used
+         instead)."""
+    global _dns_cache
+    previous = _dns_cache
+
+    if cache is None:
+        cache = previous or DNSCache()
+    _dns_cache = cache
+
+    try:
+        yield cache
+    finally:
+        _dns_cache = previous
+
+
+def dns_environment():
+    """Return a digest of the local DNS configuration, which changes if the
+    DNS servers, search domains or static host entries change."""
+    digest = hashlib.sha1()
+
+    for filename in ('/etc/resolv.conf', '/etc/hosts'):
+        try:
+            with open(filename, 'rb') as f:
+                digest.update(f.read())
+        except IOError:
+            pass
+        digest.update(b'\0')
+
+    return digest.hexdigest()
+
+
+def current_dns_namespace():
+    """Return the network namespace recorded by dns_namespace for this thread,
+    or None if there isn't one."""
+    return getattr(_thread_state, 'namespace', None)
+
+
+@contextmanager
+def dns_budget(budget):
+    """Limit the time spent on DNS lookups, from all threads, for the
+    duration of the context.
+
+       @param budget - The DNSBudget to use, or None for no limit."""
+    global _dns_budget
+    previous = _dns_budget
+    _dns_budget = budget
+
+    try:
+        yield budget
+    finally:
+        _dns_budget = previous
+
+
+@contextmanager
+def dns_namespace(namespace):
+    """Record that DNS lookups made by this thread for the duration of the
+    context are made in the given network namespace. This does not enter the
+    namespace - it just keeps cached DNS results for different namespaces
+    apart.
+
+       @param namespace - The name of the network namespace."""
+    previous = getattr(_thread_state, 'namespace', None)
+    _thread_state.namespace = namespace
+
+    try:
+        yield
+    finally:
+        _thread_state.namespace = previous
+
+
+@contextmanager
+def dns_servers(nameservers, port=53):
+    """Send the DNS lookups made by this thread to the given servers (rather
+    than to the system default servers) for the duration of the context.
+
+       @param nameservers - A list of DNS server IP addresses.
+       @param port        - The port the DNS servers listen on."""
+    previous = getattr(_thread_state, 'nameservers', None)
+    _thread_state.nameservers = (tuple(nameservers), port)
+
+    try:
+        yield
+    finally:
+        _thread_state.nameservers = previous
+
+
+def _get_resolver(lifetime=DNS_LIFETIME):
+    """Get the resolver to use for DNS lookups made by this thread. Each
+    thread has its own resolvers, so their timeouts can be set safely.
+
+       @param lifetime - The time to allow for the lookup."""
+    nameservers = getattr(_thread_state, 'nameservers', None)
+    resolvers = getattr(_thread_state, 'resolvers', None)
+
+    if resolvers is None:
+        resolvers = _thread_state.resolvers = {}
+
+    resolver = resolvers.get(nameservers)
+
+    if resolver is None:
+        import dns.resolver
+        resolver = dns.resolver.Resolver()
+        if nameservers:
+            resolver.nameservers = list(nameservers[0])
+            resolver.port = nameservers[1]
+        resolvers[nameservers] = resolver
+
+    resolver.timeout = min(DNS_TIMEOUT, lifetime)
+    resolver.lifetime = lifetime
+    return resolver
 
 
 def number_present(*args):
@@ -135,6 +613,20 @@ def number_present(*args):
     return config
 
 
+def depends_on(*option_names):
+    """Decorator declaring the options that an advanced check depends on, so
+    that the check is rerun whenever any of them change. Names may include
+    shell-style wildcards, such as '*_uri'.
+
+    Options that the check reads are also tracked as it runs, but declaring
+    them means the check is still rerun when, for example, an option it
+    didn't read last time is newly set."""
+    def decorator(function):
+        function.depends_on = option_names
+        return function
+    return decorator
+
+
 class Option(object):
     """Description of a config option"""
 
@@ -143,19 +635,22 @@ class Option(object):
     OPTIONAL = 2
     DEPRECATED = 3
 
-    def __init__(self, name, type=MANDATORY, validator=None):
+    def __init__(self, name, type=MANDATORY, validator=None, depends_on=()):
         """Create a new config option
 
-           @param name      - The name of the option.
-           @param type      - Is this option mandatory, suggested, or optional
-           @param validator - If supplied this must be a callable object that
+           @param name       - The name of the option.
+           @param type       - Is this option mandatory, suggested, or optional
+           @param validator  - If supplied this must be a callable object that
              checks the option's value. If the check fails this function must
              print an error to stderr and return False. Otherwise it must
              return True.
+           @param depends_on - The names of any other options that affect how
+             this option is checked (see depends_on below).
         """
         self.name = name
         self.type = type
         self.validator = validator
+        self.depends_on = tuple(depends_on)
 
     def mandatory(self):
         return self.type == Option.MANDATORY
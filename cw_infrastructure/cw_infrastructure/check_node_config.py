@@ -0,0 +1,174 @@
+#
+# @file check_node_config.py
+#
+# Copyright (C) Metaswitch Networks 2018
+# If license terms are provided to you in a COPYING file in the root directory
+# of the source code repository by which you are accessing this code, then
+# the license outlined in that COPYING file applies to your use.
+# Otherwise no rights are granted except for those provided to you by
+# Metaswitch Networks in a separate written agreement.
+
+# Check the config of this node, as clearwater-check-config does. This checks
+# that the config files exist and are syntactically valid, that options
+# specific to this node aren't in shared config, and then checks the option
+# values against the option schemas. Everything is done in one process,
+# apart from checking the option values, which is done by the config check
+# service (see check_config_service) if it is running.
+
+import os
+import sys
+import argparse
+
+import check_config
+import check_config_service
+import check_config_utilities as utils
+import config_files
+
+CONFIG_DIR = '/etc/clearwater'
+
+# Options that are specific to each node, so must not be in shared config.
+LOCAL_OPTIONS = ['local_ip',
+                 'public_ip',
+                 'public_hostname',
+                 'node_idx',
+                 'etcd_cluster',
+                 'etcd_cluster_key']
+
+
+def _error(message):
+    sys.stderr.write("ERROR: {}\n".format(message))
+
+
+def check_option_locations(shared_values, shared_config):
+    """Check that no options specific to this node are in shared config,
+    writing an error for any that are. Returns True if none are.
+
+       @param shared_values - The values set by the shared config file.
+       @param shared_config - The name of the shared config file."""
+    ok = True
+
+    for name in LOCAL_OPTIONS:
+        if shared_values.get(name):
+            _error("{} should not be placed in {}".format(name,
+                                                          shared_config))
+            ok = False
+
+    return ok
+
+
+def check_node_config(config_dir=CONFIG_DIR,
+                      shared_config=None,
+                      jobs=check_config.DEFAULT_JOBS,
+                      time_budget=None,
+                      socket_path=check_config_service.DEFAULT_SOCKET):
+    """Check the config of this node, writing any problems to stderr. Returns
+    0 if the config is valid (though there may be warnings), and 1 if not.
+
+       @param config_dir    - The directory holding the config files.
+       @param shared_config - The shared config file to check, if not the one
+         in config_dir.
+       @param jobs          - The maximum number of checks to run at once.
+       @param time_budget   - The time (in seconds) to allow for DNS lookups,
+         if limited.
+       @param socket_path   - The socket the config check service is
+         listening on."""
+    local_config = os.path.join(config_dir, 'local_config')
+    user_settings = os.path.join(config_dir, 'user_settings')
+    clearwater_config = os.path.join(config_dir, 'config')
+    shared_config = shared_config or os.path.join(config_dir, 'shared_config')
+
+    rc = 0
+
+    # Check the files are present (if required) and are syntactically
+    # correct. The files are read in the same order that they're sourced in,
+    # so that later files override earlier ones.
+    values = {}
+    shared_values = {}
+
+    for filename, mandatory in ((shared_config, True),
+                                (local_config, True),
+                                (user_settings, False)):
+        if not os.path.exists(filename):
+            if mandatory:
+                _error("{} does not exist".format(filename))
+                rc = 1
+            continue
+
+        try:
+            values = config_files.read_config_file(filename, values)
+        except config_files.ConfigFileError as e:
+            _error(str(e))
+            rc = 1
+            continue
+
+        if filename == shared_config:
+            shared_values = values
+
+    if not os.path.exists(clearwater_config):
+        _error("{} does not exist".format(clearwater_config))
+        rc = 1
+    else:
+        try:
+            config_files.check_syntax(clearwater_config)
+        except config_files.ConfigFileError as e:
+            _error(str(e))
+            rc = 1
+
+    # If any of the files are invalid there isn't much point in continuing.
+    if rc != 0:
+        return rc
+
+    # Check that the config options are in the correct files.
+    if not check_option_locations(shared_values, shared_config):
+        rc = 1
+
+    # Check that the config is semantically correct (e.g. required options are
+    # present, they are correctly formatted, etc). Warnings about suggested
+    # options don't fail the check.
+    results = check_config_service.check_values(values,
+                                                socket_path,
+                                                jobs=jobs,
+                                                time_budget=time_budget)
+    check_config.write_text(results)
+
+    if check_config.worst_status(results) not in (utils.OK, utils.WARNING):
+        rc = 1
+
+    return rc
+
+
+def parse_args(args=None):
+    parser = argparse.ArgumentParser(
+        description='Validate the Clearwater config files of this node')
+    parser.add_argument('shared_config', nargs='?', default=None,
+                        help=('The shared config file to check (default '
+                              'shared_config in the config directory)'))
+    parser.add_argument('--config-dir', default=CONFIG_DIR,
+                        help='The directory holding the config files')
+    parser.add_argument('--jobs', '-j', type=int,
+                        default=check_config.DEFAULT_JOBS,
+                        help='The maximum number of checks to run in parallel')
+    parser.add_argument('--time-budget', type=float, default=None,
+                        help=('The maximum time in seconds to spend on DNS '
+                              'lookups'))
+    parser.add_argument('--socket',
+                        default=check_config_service.DEFAULT_SOCKET,
+                        help=('The socket the config check service is '
+                              'listening on'))
+    return parser.parse_args(args)
+
+
+if __name__ == '__main__':
+    args = parse_args()
+
+    rc = check_node_config(args.config_dir,
+                           args.shared_config,
+                           args.jobs,
+                           args.time_budget,
+                           args.socket)
+
+    # Print out a soothing message to the user if all the checks passed.
+    if rc == 0:
+        print "All config checks passed"
+
+    sys.exit(rc)
@@ -61,7 +61,8 @@ class ClearwaterOptions:
             Option('snmp_ip',
                    Option.SUGGESTED,
                    vlds.ip_or_domain_name_opt_port_list_validator),
-            Option('sas_server', Option.OPTIONAL, sas_server_validator),
+            Option('sas_server', Option.OPTIONAL, sas_server_validator,
+                   depends_on=['sas_use_signaling_interface']),
             Option('sas_use_signaling_interface',
                    Option.OPTIONAL,
                    vlds.yes_no_validator),
@@ -89,6 +90,19 @@ class ClearwaterOptions:
             Option('xdms_hostname', Option.OPTIONAL,
                    vlds.run_in_sig_ns(vlds.ip_or_domain_name_with_port_validator)),
 
+            Option('diags_collector_concurrency', Option.OPTIONAL,
+                   vlds.create_integer_range_validator(min_value=1)),
+            Option('diags_collector_timeout', Option.OPTIONAL,
+                   vlds.create_integer_range_validator(min_value=1)),
+            Option('diags_max_disk_usage_mb', Option.OPTIONAL,
+                   vlds.create_integer_range_validator(min_value=1)),
+            Option('diags_close_wait_timeout', Option.OPTIONAL,
+                   vlds.create_integer_range_validator(min_value=1)),
+            Option('diags_archive_codec', Option.OPTIONAL,
+                   vlds.create_choice_validator(['gzip', 'xz', 'zstd'])),
+            Option('diags_archive_threads', Option.OPTIONAL,
+                   vlds.create_integer_range_validator(min_value=1)),
+
             Option('alias_list', Option.DEPRECATED),
             Option('always_serve_remote_aliases',
                    Option.OPTIONAL,
@@ -102,7 +116,8 @@ class ClearwaterOptions:
                 Option(
                     'cassandra_hostname',
                     Option.MANDATORY,
-                    vlds.run_in_sig_ns(vlds.ip_or_domain_name_validator))
+                    vlds.run_in_sig_ns(vlds.ip_or_domain_name_validator),
+                    depends_on=['hs_provisioning_hostname'])
             )
         return options
 
@@ -116,6 +131,7 @@ class ClearwaterOptions:
         return advanced_checks
 
     @staticmethod
+    @utils.depends_on('hss_realm', 'hss_hostname', 'hs_provisioning_hostname')
     def validate_hss_config():
         """
         Require that the site is either configured with a HSS, or HS Prov.
@@ -143,6 +159,7 @@ class ClearwaterOptions:
         return utils.OK
 
     @staticmethod
+    @utils.depends_on('etcd_proxy', 'etcd_cluster')
     def validate_etcd_config():
         """Require that exactly one of etcd_proxy or etcd_cluster is set"""
         etcd_config = utils.number_present('etcd_proxy',
@@ -161,6 +178,7 @@ class ClearwaterOptions:
         return utils.OK
 
     @staticmethod
+    @utils.depends_on('sprout_hostname', '*_uri')
     def validate_sprout_hostname():
         """Check that the default URIs based on the Sprout hostname are valid"""
 
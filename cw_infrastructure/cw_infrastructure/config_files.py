@@ -0,0 +1,277 @@
+#
+# @file config_files.py
+#
+# Copyright (C) Metaswitch Networks 2018
+# If license terms are provided to you in a COPYING file in the root directory
+# of the source code repository by which you are accessing this code, then
+# the license outlined in that COPYING file applies to your use.
+# Otherwise no rights are granted except for those provided to you by
+# Metaswitch Networks in a separate written agreement.
+
+# Reading of Clearwater config files (such as /etc/clearwater/shared_config).
+#
+# These files are bash scripts, but are almost always just a list of variable
+# assignments. Files like that are parsed here directly, which is much quicker
+# than sourcing them in bash. Anything else (for example a file using command
+# substitution, or an if statement) is handed to bash, so the result is always
+# the same as sourcing the file.
+
+import os
+import re
+import subprocess
+
+_NAME = re.compile(r"[A-Za-z_][A-Za-z0-9_]*")
+
+# Characters that end an unquoted word.
+_WORD_END = " \t\n;"
+
+# Unquoted characters that need more of the shell than is implemented here.
+_UNSUPPORTED = "`()<>|&"
+
+# Variables that bash sets for itself, rather than being read from the file.
+_BASH_VARIABLES = frozenset(['_', 'PWD', 'OLDPWD', 'SHLVL'])
+
+
+class ConfigFileError(Exception):
+    """A config file is missing, or isn't syntactically valid"""
+    pass
+
+
+class _UnsupportedSyntax(Exception):
+    """A config file uses shell features that can't be parsed directly"""
+    pass
+
+
+class _Parser(object):
+    """Parser for a file of shell variable assignments"""
+
+    def __init__(self, text, values):
+        """@param text   - The text of the file.
+           @param values - The variables set so far, which the file may refer
+             to. Assignments made by the file are added to this."""
+        self.text = text
+        self.pos = 0
+        self.values = values
+
+    def peek(self):
+        return self.text[self.pos:self.pos + 1]
+
+    def parse(self):
+        while self.pos < len(self.text):
+            c = self.peek()
+
+            if c in " \t\n;":
+                self.pos += 1
+            elif c == "#":
+                end = self.text.find("\n", self.pos)
+                self.pos = len(self.text) if end == -1 else end
+            else:
+                self.parse_statement()
+
+        return self.values
+
+    def parse_statement(self):
+        # Each statement is an assignment, optionally exported (which makes no
+        # difference here, as every variable is exported when config is
+        # sourced).
+        match = _NAME.match(self.text, self.pos)
+
+        if match and match.group() == "export":
+            self.pos = match.end()
+            self.skip_blanks()
+            match = _NAME.match(self.text, self.pos)
+
+            # 'export name' just exports an existing variable.
+            if match and self.text[match.end():match.end() + 1] in _WORD_END:
+                self.pos = match.end()
+                return
+
+        if not match or self.text[match.end():match.end() + 1] != "=":
+            raise _UnsupportedSyntax()
+
+        self.pos = match.end() + 1
+        self.values[match.group()] = self.parse_word()
+
+        # Anything else on the line, other than a comment or a further
+        # assignment, would be a command.
+        self.skip_blanks()
+
+    def skip_blanks(self):
+        while self.peek() in (" ", "\t"):
+            self.pos += 1
+
+    def parse_word(self):
+        word = []
+
+        while self.pos < len(self.text):
+            c = self.peek()
+
+            if c in _WORD_END:
+                break
+            elif c in _UNSUPPORTED or (c == "~" and not word):
+                raise _UnsupportedSyntax()
+            elif c == "\\":
+                escaped = self.text[self.pos + 1:self.pos + 2]
+                if not escaped:
+                    raise _UnsupportedSyntax()
+                if escaped != "\n":
+                    word.append(escaped)
+                self.pos += 2
+            elif c == "'":
+                end = self.text.find("'", self.pos + 1)
+                if end == -1:
+                    raise _UnsupportedSyntax()
+                word.append(self.text[self.pos + 1:end])
+                self.pos = end + 1
+            elif c == '"':
+                self.pos += 1
+                word.append(self.parse_double_quoted())
+            elif c == "$":
+                word.append(self.parse_expansion())
+            else:
+                word.append(c)
+                self.pos += 1
+
+        return "".join(word)
+
+    def parse_double_quoted(self):
+        word = []
+
+        while True:
+            c = self.peek()
+
+            if not c or c == "`":
+                raise _UnsupportedSyntax()
+            elif c == '"':
+                self.pos += 1
+                return "".join(word)
+            elif c == "\\":
+                escaped = self.text[self.pos + 1:self.pos + 2]
+                if escaped in ('$', '`', '"', '\\'):
+                    word.append(escaped)
+                elif escaped != "\n":
+                    word.append(c + escaped)
+                self.pos += 2
+            elif c == "$":
+                word.append(self.parse_expansion())
+            else:
+                word.append(c)
+                self.pos += 1
+
+    def parse_expansion(self):
+        # Only $name and ${name} are supported.
+        self.pos += 1
+        braced = self.peek() == "{"
+        if braced:
+            self.pos += 1
+
+        match = _NAME.match(self.text, self.pos)
+
+        if not match:
+            if braced or self.peek() not in ("", " ", "\t", "\n", '"'):
+                raise _UnsupportedSyntax()
+
+            # A lone $ is just a dollar sign.
+            return "$"
+
+        self.pos = match.end()
+
+        if braced:
+            if self.peek() != "}":
+                raise _UnsupportedSyntax()
+            self.pos += 1
+
+        name = match.group()
+        value = self.values.get(name, os.environ.get(name))
+        return value or ""
+
+
+def _source_with_bash(filename, values):
+    """Source a config file in bash, returning the resulting variables"""
+    env = dict(os.environ)
+    env.update(values)
+
+    process = subprocess.Popen(
+        ["bash", "-c", 'bash -n "$1" && set -a && . "$1" && env -0',
+         "bash", filename],
+        stdout=subprocess.PIPE,
+        stderr=subprocess.PIPE,
+        env=env)
+    output, errors = process.communicate()
+
+    if process.returncode != 0:
+        raise ConfigFileError(
+            "{} is not syntactically valid: {}".format(filename,
+                                                       errors.strip()))
+
+    result = dict(values)
+
+    for variable in output.split("\0"):
+        name, _, value = variable.partition("=")
+
+        if (re.match(r"^[A-Za-z_][A-Za-z0-9_]*$", name) and
+                name not in _BASH_VARIABLES and
+                (name in values or os.environ.get(name) != value)):
+            result[name] = value
+
+    return result
+
+
+def check_syntax(filename):
+    """Check that a config file is syntactically valid, raising a
+    ConfigFileError if not"""
+    try:
+        with open(filename) as f:
+            _Parser(f.read(), {}).parse()
+        return
+    except IOError as e:
+        raise ConfigFileError("{} could not be read: {}".format(filename,
+                                                                e.strerror))
+    except _UnsupportedSyntax:
+        pass
+
+    process = subprocess.Popen(["bash", "-n", filename],
+                               stderr=subprocess.PIPE)
+    _, errors = process.communicate()
+
+    if process.returncode != 0:
+        raise ConfigFileError(
+            "{} is not syntactically valid: {}".format(filename,
+                                                       errors.strip()))
+
+
+def read_config_file(filename, values=None):
+    """Read a config file, returning the variables set once it has been
+    sourced. Raises a ConfigFileError if the file can't be read or isn't
+    syntactically valid.
+
+       @param filename - The config file to read.
+       @param values   - The variables set by any config files read
+         previously, as a dictionary of names to values. These are included
+         in the result, unless the file overrides them."""
+    values = dict(values or {})
+
+    try:
+        with open(filename) as f:
+            text = f.read()
+    except IOError as e:
+        raise ConfigFileError("{} could not be read: {}".format(filename,
+                                                                e.strerror))
+
+    try:
+        return _Parser(text, dict(values)).parse()
+    except _UnsupportedSyntax:
+        return _source_with_bash(filename, values)
+
+
+def read_config_files(filenames):
+    """Read a list of config files in turn, so that each may override the
+    values set by the ones before, returning the variables set. Files that
+    don't exist are skipped."""
+    values = {}
+
+    for filename in filenames:
+        if os.path.exists(filename):
+            values = read_config_file(filename, values)
+
+    return values
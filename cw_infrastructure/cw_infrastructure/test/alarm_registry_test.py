@@ -0,0 +1,113 @@
+# @file alarm_registry_test.py
+#
+# Copyright (C) Metaswitch Networks 2018
+# If license terms are provided to you in a COPYING file in the root directory
+# of the source code repository by which you are accessing this code, then
+# the license outlined in that COPYING file applies to your use.
+# Otherwise no rights are granted except for those provided to you by
+# Metaswitch Networks in a separate written agreement.
+
+import os
+import json
+import time
+import shutil
+import tempfile
+import unittest
+import mock
+
+from cw_infrastructure.test.scripts import load_script
+
+alarm_registry = load_script('clearwater-infrastructure', 'alarm_registry')
+
+
+class TestAlarmRegistry(unittest.TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.dir)
+        self.alarms_dir = os.path.join(self.dir, 'alarms')
+        os.mkdir(self.alarms_dir)
+        self.cache_file = os.path.join(self.dir, 'alarm_index')
+
+    def registry(self):
+        return alarm_registry.AlarmRegistry(self.alarms_dir, self.cache_file)
+
+    def install(self, filename, index, name, severities):
+        with open(os.path.join(self.alarms_dir, filename), 'w') as f:
+            json.dump({'alarms': [{'index': index,
+                                   'name': name,
+                                   'levels': [{'severity': severity}
+                                              for severity in severities]}]},
+                      f)
+
+        # Definitions are installed some time after the registry is first
+        # used.
+        stamp = time.time() + 10
+        os.utime(self.alarms_dir, (stamp, stamp))
+
+    # Test that alarm identifiers are looked up by index and severity, and
+    # that only the levels defined are known
+    def test_lookup(self):
+        self.install('memcached_alarms.json', 3500, 'MEMCACHED_PROCESS_FAIL',
+                     ['CLEARED', 'CRITICAL'])
+        registry = self.registry()
+
+        self.assertEqual(registry.lookup('3500.3'),
+                         ('MEMCACHED_PROCESS_FAIL', 'CRITICAL'))
+        self.assertEqual(registry.describe('3500.1'),
+                         '3500.1 (MEMCACHED_PROCESS_FAIL, CLEARED)')
+        self.assertIsNone(registry.lookup('3500.4'))
+        self.assertIsNone(registry.lookup('bad'))
+        self.assertEqual(registry.describe('3500.4'), '3500.4')
+
+    # Test that only defined alarms pass the check, and that files that
+    # aren't alarm definitions are ignored
+    def test_check(self):
+        self.install('memcached_alarms.json', 3500, 'MEMCACHED_PROCESS_FAIL',
+                     ['CRITICAL'])
+        self.install('other.json', 3600, 'OTHER', ['CRITICAL'])
+        registry = self.registry()
+
+        registry.check('3500.3')
+        self.assertRaises(alarm_registry.UnknownAlarmError,
+                          registry.check, '3500.1')
+        self.assertRaises(alarm_registry.UnknownAlarmError,
+                          registry.check, '3600.3')
+
+    # Test that every alarm is accepted if none are defined
+    def test_none_defined(self):
+        self.registry().check('3500.3')
+
+    # Test that invalid definitions are skipped
+    @mock.patch('syslog.syslog')
+    def test_invalid(self, mock_syslog):
+        self.install('memcached_alarms.json', 3500, 'MEMCACHED_PROCESS_FAIL',
+                     ['CRITICAL'])
+        with open(os.path.join(self.alarms_dir, 'bad_alarms.json'), 'w') as f:
+            f.write('{')
+
+        self.assertEqual(self.registry().index(),
+                         {(3500, 3): ('MEMCACHED_PROCESS_FAIL', 'CRITICAL')})
+        self.assertTrue(mock_syslog.called)
+
+    # Test that the index is read from the cache file, rather than being
+    # built again, while the definitions are unchanged
+    def test_cached(self):
+        self.install('memcached_alarms.json', 3500, 'MEMCACHED_PROCESS_FAIL',
+                     ['CRITICAL'])
+        index = self.registry().index()
+
+        with mock.patch.object(alarm_registry.AlarmRegistry, '_build') as b:
+            self.assertEqual(self.registry().index(), index)
+            self.assertFalse(b.called)
+
+    # Test that a registry in use picks up definitions installed later
+    def test_reload(self):
+        self.install('memcached_alarms.json', 3500, 'MEMCACHED_PROCESS_FAIL',
+                     ['CRITICAL'])
+        registry = self.registry()
+        registry.check('3500.3')
+
+        self.install('sprout_alarms.json', 1000, 'SPROUT_PROCESS_FAIL',
+                     ['CRITICAL'])
+        registry.check('1000.3')
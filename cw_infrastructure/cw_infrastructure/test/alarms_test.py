@@ -0,0 +1,375 @@
+# @file alarms_test.py
+#
+# Copyright (C) Metaswitch Networks 2018
+# If license terms are provided to you in a COPYING file in the root directory
+# of the source code repository by which you are accessing this code, then
+# the license outlined in that COPYING file applies to your use.
+# Otherwise no rights are granted except for those provided to you by
+# Metaswitch Networks in a separate written agreement.
+
+import os
+import time
+import fcntl
+import shutil
+import tempfile
+import threading
+import unittest
+import mock
+import zmq
+
+from cw_infrastructure.test.scripts import load_script
+
+alarms = load_script('clearwater-infrastructure', 'alarms')
+
+
+class TestAlarmState(unittest.TestCase):
+
+    def setUp(self):
+        self.client = alarms.AlarmClient(state=alarms.AlarmState())
+        self.addCleanup(self.client.close)
+
+        patcher = mock.patch.object(self.client, '_send', return_value='ok')
+        self.mock_send = patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def issue(self, issuer, identifier):
+        return self.client.request(['issue-alarm', issuer, identifier])
+
+    # Test that a repeat of the last request for an alarm isn't sent
+    def test_repeat_suppressed(self):
+        self.assertEqual(self.issue('monit', '1000.3'), 'ok')
+        self.assertEqual(self.issue('monit', '1000.3'), 'suppressed')
+
+        self.assertEqual(self.mock_send.call_count, 1)
+        self.assertEqual(self.client.counters['suppressed'], 1)
+
+    # Test that a change of severity is always sent
+    def test_change_sent(self):
+        self.issue('monit', '1000.3')
+        self.issue('monit', '1000.1')
+        self.issue('monit', '1000.3')
+
+        self.assertEqual(self.mock_send.call_count, 3)
+
+    # Test that a request from another issuer ends the suppression, as it may
+    # have been preceded by requests this client doesn't know about
+    def test_other_issuer(self):
+        self.issue('monit', '1000.3')
+        self.issue('sprout', '1000.3')
+        self.issue('monit', '1000.3')
+
+        self.assertEqual(self.mock_send.call_count, 3)
+
+    # Test that repeats are sent again once the window has passed
+    def test_window_expiry(self):
+        self.client.state.window = 0
+        self.issue('monit', '1000.3')
+        self.issue('monit', '1000.3')
+
+        self.assertEqual(self.mock_send.call_count, 2)
+
+    # Test that a request the agent didn't answer isn't treated as issued
+    def test_unanswered(self):
+        self.mock_send.return_value = None
+        self.issue('monit', '1000.3')
+        self.mock_send.return_value = 'ok'
+
+        self.assertEqual(self.issue('monit', '1000.3'), 'ok')
+        self.assertEqual(self.mock_send.call_count, 2)
+
+    # Test that failing to record a request doesn't fail it, so that a
+    # spooled request isn't sent again
+    @mock.patch('syslog.syslog')
+    def test_record_fails(self, mock_syslog):
+        with mock.patch.object(self.client.state, 'record',
+                               side_effect=IOError('disk full')):
+            self.assertEqual(self.issue('monit', '1000.3'), 'ok')
+
+
+class TestAlarmClient(unittest.TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.dir)
+        self.address = 'ipc://' + os.path.join(self.dir, 'alarms')
+
+    def agent(self, replies):
+        # Answers the given number of requests, returning what it received.
+        context = zmq.Context()
+        socket = context.socket(zmq.REP)
+        socket.bind(self.address)
+        received = []
+
+        def serve():
+            for _ in range(replies):
+                received.append(socket.recv_multipart())
+                socket.send('ok')
+            socket.close()
+            context.term()
+
+        thread = threading.Thread(target=serve)
+        thread.daemon = True
+        thread.start()
+        self.addCleanup(thread.join, 5)
+        return received
+
+    # Test that a request is sent to the agent, and its reply returned
+    def test_request(self):
+        received = self.agent(2)
+        client = alarms.AlarmClient(self.address)
+
+        self.assertEqual(client.request(['issue-alarm', 'monit', '1000.3']),
+                         'ok')
+        self.assertEqual(client.request(['sync-alarms']), 'ok')
+        client.close()
+
+        self.assertEqual(received, [['issue-alarm', 'monit', '1000.3'],
+                                    ['sync-alarms']])
+        self.assertEqual(client.counters['sent'], 2)
+
+    # Test that a request the agent doesn't answer returns None, and that
+    # the client can still make requests afterwards
+    @mock.patch('syslog.syslog')
+    def test_unanswered(self, mock_syslog):
+        client = alarms.AlarmClient(self.address, timeout_ms=50)
+
+        self.assertIsNone(client.request(['sync-alarms']))
+        self.assertEqual(client.counters['dropped'], 1)
+
+        self.agent(1)
+        self.assertEqual(client.request(['sync-alarms']), 'ok')
+        client.close()
+
+
+class TestSendQueue(unittest.TestCase):
+
+    def setUp(self):
+        self.client = alarms.AlarmClient()
+        self.sent = []
+        self.release = threading.Event()
+        self.release.set()
+
+        def send(request):
+            self.release.wait()
+            self.sent.append(request)
+            return 'ok'
+
+        patcher = mock.patch.object(self.client, '_send', side_effect=send)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    # Test that queued requests are sent in order by the background thread,
+    # and their callbacks called with the replies
+    def test_send_nowait(self):
+        replies = []
+        for index in ('1000', '1001'):
+            self.client.send_nowait(['issue-alarm', 'monit', index + '.3'],
+                                    replies.append)
+        self.client.flush()
+
+        self.assertEqual(self.sent, [['issue-alarm', 'monit', '1000.3'],
+                                     ['issue-alarm', 'monit', '1001.3']])
+        self.assertEqual(replies, ['ok', 'ok'])
+        self.client.close()
+
+    # Test that, of a burst of requests for the same alarm, only the last is
+    # sent (in place of the first), and every callback is called
+    def test_burst_coalesced(self):
+        replies = []
+
+        # Hold the background thread up on the first request while the burst
+        # is queued.
+        self.release.clear()
+        self.client.send_nowait(['sync-alarms'])
+        self.client.send_nowait(['issue-alarm', 'monit', '1000.3'],
+                                replies.append)
+        self.client.send_nowait(['issue-alarm', 'monit', '1001.3'])
+        self.client.send_nowait(['issue-alarm', 'monit', '1000.1'],
+                                replies.append)
+        self.release.set()
+        self.client.flush()
+
+        self.assertEqual(self.sent, [['sync-alarms'],
+                                     ['issue-alarm', 'monit', '1000.1'],
+                                     ['issue-alarm', 'monit', '1001.3']])
+        self.assertEqual(replies, ['ok', 'ok'])
+        self.assertEqual(self.client.counters['coalesced'], 1)
+        self.client.close()
+
+    # Test that closing the client sends any requests still queued
+    def test_close(self):
+        self.release.clear()
+        self.client.send_nowait(['sync-alarms'])
+        self.release.set()
+        self.client.close()
+
+        self.assertEqual(self.sent, [['sync-alarms']])
+
+    # Test that a request that fails doesn't stop the thread, and its
+    # callback is told
+    @mock.patch('syslog.syslog')
+    def test_request_fails(self, mock_syslog):
+        replies = []
+        self.client._send.side_effect = [zmq.ZMQError(), 'ok']
+        self.client.send_nowait(['sync-alarms'], replies.append)
+        self.client.send_nowait(['issue-alarm', 'monit', '1000.3'],
+                                replies.append)
+        self.client.close()
+
+        self.assertEqual(replies, [None, 'ok'])
+
+
+class TestGetClient(unittest.TestCase):
+
+    def setUp(self):
+        patcher = mock.patch.object(alarms, '_client', None)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+        patcher = mock.patch('atexit.register')
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    # Test that a process shares one client, but a forked child gets its own
+    @mock.patch('os.getpid', return_value=100)
+    def test_shared(self, mock_getpid):
+        client = alarms.get_client()
+        self.addCleanup(client.close)
+        self.assertIs(alarms.get_client(), client)
+
+        mock_getpid.return_value = 101
+        child_client = alarms.get_client()
+        self.addCleanup(child_client.close)
+        self.assertIsNot(child_client, client)
+
+
+class TestAlarmSpool(unittest.TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.dir)
+        self.spool = alarms.AlarmSpool(os.path.join(self.dir, 'alarm_spool'))
+        self.sent = []
+
+    def send(self, request):
+        self.sent.append(request)
+        return 'ok'
+
+    # Test that spooled requests are sent in order, with only the last
+    # request for each alarm sent (in place of the first)
+    def test_coalesced(self):
+        self.spool.append(['issue-alarm', 'monit', '1000.3'])
+        self.spool.append(['sync-alarms'])
+        self.spool.append(['issue-alarm', 'monit', '1000.1'])
+
+        self.assertEqual(self.spool.flush(self.send), 2)
+        self.assertEqual(self.sent, [['issue-alarm', 'monit', '1000.1'],
+                                     ['sync-alarms']])
+        self.assertFalse(self.spool.pending())
+
+    # Test that an unanswered request, and those after it, stay in the spool
+    # to be sent by the next flush
+    def test_unanswered(self):
+        self.spool.append(['issue-alarm', 'monit', '1000.3'])
+        self.spool.append(['issue-alarm', 'monit', '1001.3'])
+        self.spool.append(['issue-alarm', 'monit', '1002.3'])
+
+        replies = iter(['ok', None])
+        self.assertEqual(self.spool.flush(lambda request: next(replies)), 1)
+        self.assertTrue(self.spool.pending())
+
+        self.assertEqual(self.spool.flush(self.send), 2)
+        self.assertEqual(self.sent, [['issue-alarm', 'monit', '1001.3'],
+                                     ['issue-alarm', 'monit', '1002.3']])
+        self.assertFalse(self.spool.pending())
+
+    # Test that a request that can't be sent is discarded, rather than being
+    # retried forever
+    @mock.patch('syslog.syslog')
+    def test_send_fails(self, mock_syslog):
+        def send(request):
+            if request[2] == '1000.3':
+                raise ValueError('unknown alarm')
+            return self.send(request)
+
+        self.spool.append(['issue-alarm', 'monit', '1000.3'])
+        self.spool.append(['issue-alarm', 'monit', '1001.3'])
+
+        self.assertEqual(self.spool.flush(send), 2)
+        self.assertEqual(self.sent, [['issue-alarm', 'monit', '1001.3']])
+        self.assertFalse(self.spool.pending())
+
+    # Test that only one process flushes the spool at a time
+    def test_already_flushing(self):
+        self.spool.append(['sync-alarms'])
+
+        with open(self.spool.path + '.flush', 'a') as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            self.assertIsNone(self.spool.flush(self.send))
+
+        self.assertEqual(self.sent, [])
+        self.assertTrue(self.spool.pending())
+
+
+class TestSpoolFlusher(unittest.TestCase):
+
+    def setUp(self):
+        self.spool = mock.Mock(spec=alarms.AlarmSpool)
+        self.client = alarms.AlarmClient(spool=self.spool)
+
+    # Test that the background thread doesn't flush an empty spool
+    def test_empty(self):
+        self.spool.pending.return_value = False
+        self.client.send_spooled(['sync-alarms'])
+        self.client.close()
+
+        self.assertFalse(self.spool.flush.called)
+
+    # Test that the background thread retries while there are requests in the
+    # spool, and stops once they have all been sent
+    @mock.patch.object(alarms, 'SPOOL_RETRY_INTERVAL', 0.01)
+    def test_retry(self):
+        # The spool is emptied by the second flush.
+        flushed = threading.Event()
+
+        def flush(send):
+            if self.spool.flush.call_count == 2:
+                self.spool.pending.return_value = False
+                flushed.set()
+
+        self.spool.pending.return_value = True
+        self.spool.flush.side_effect = flush
+        self.client.send_spooled(['sync-alarms'])
+        self.assertTrue(flushed.wait(5))
+
+        # Leave time for several more retries, were there any.
+        time.sleep(0.1)
+        self.client.close()
+        self.assertEqual(self.spool.flush.call_count, 2)
+
+
+class TestSendRequest(unittest.TestCase):
+
+    def setUp(self):
+        patcher = mock.patch.object(alarms, 'get_client', autospec=True)
+        self.mock_client = patcher.start().return_value
+        self.addCleanup(patcher.stop)
+        self.mock_client.spool.path = os.path.join(tempfile.gettempdir(),
+                                                   'alarm_spool')
+
+    # Test that requests are spooled
+    def test_spooled(self):
+        alarms.sendrequest(['sync-alarms'])
+        self.mock_client.send_spooled.assert_called_once_with(['sync-alarms'])
+        self.assertFalse(self.mock_client.request.called)
+
+    # Test that a request that can't be spooled is sent directly
+    @mock.patch('syslog.syslog')
+    def test_spool_fails(self, mock_syslog):
+        self.mock_client.send_spooled.side_effect = IOError('disk full')
+        alarms.sendrequest(['sync-alarms'])
+        self.mock_client.request.assert_called_once_with(['sync-alarms'])
+
+
+if __name__ == '__main__':
+    unittest.main()
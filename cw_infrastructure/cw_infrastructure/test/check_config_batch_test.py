@@ -0,0 +1,220 @@
+# @file check_config_batch_test.py
+#
+# Copyright (C) Metaswitch Networks 2018
+# If license terms are provided to you in a COPYING file in the root directory
+# of the source code repository by which you are accessing this code, then
+# the license outlined in that COPYING file applies to your use.
+# Otherwise no rights are granted except for those provided to you by
+# Metaswitch Networks in a separate written agreement.
+
+import os
+import shutil
+import tempfile
+import unittest
+import mock
+
+from cw_infrastructure import check_config_utilities as utils
+from cw_infrastructure import check_config_batch
+from cw_infrastructure import validators as vlds
+
+
+def _integer_validator(name, value):
+    if not value.isdigit():
+        utils.error(name, 'not an integer')
+        return utils.ERROR
+    return utils.OK
+
+
+class TestOptionSchema(object):
+    """Schema whose options depend on the value of the 'mode' option"""
+
+    get_options_calls = 0
+
+    @staticmethod
+    def get_options():
+        TestOptionSchema.get_options_calls += 1
+        options = [utils.Option('count', utils.Option.MANDATORY,
+                                _integer_validator)]
+
+        if utils.get_option_value('mode') == 'strict':
+            options.append(utils.Option('limit', utils.Option.MANDATORY))
+
+        return options
+
+    @staticmethod
+    def get_advanced_checks():
+        return []
+
+
+@vlds.run_in_sig_ns
+def _signaling_validator(name, value):
+    return utils.OK
+
+
+class TestSignalingSchema(object):
+    """Schema with an option checked in the signaling namespace"""
+
+    @staticmethod
+    def get_options():
+        return [utils.Option('sas_server', utils.Option.MANDATORY,
+                             _signaling_validator),
+                utils.Option('count', utils.Option.MANDATORY,
+                             _integer_validator)]
+
+    @staticmethod
+    def get_advanced_checks():
+        return []
+
+
+class TestCheckNodes(unittest.TestCase):
+
+    def setUp(self):
+        TestOptionSchema.get_options_calls = 0
+
+    # Test that each node gets its own results
+    def test_results(self):
+        results = check_config_batch.check_nodes(
+            [TestOptionSchema],
+            {'good': {'count': '1'},
+             'bad': {'count': 'x'},
+             'strict': {'count': '1', 'mode': 'strict'}},
+            jobs=2)
+
+        self.assertEqual(results['good']['status'], utils.OK)
+        self.assertEqual(results['good']['messages'], [])
+        self.assertEqual(results['bad']['status'], utils.ERROR)
+        self.assertEqual(results['bad']['messages'],
+                         [{'severity': 'ERROR',
+                           'option': 'count',
+                           'message': 'not an integer'}])
+        self.assertEqual([check['name'] for check in results['bad']['checks']],
+                         ['count'])
+        self.assertEqual(results['strict']['status'], utils.ERROR)
+        self.assertEqual(results['strict']['messages'][0]['option'], 'limit')
+
+    # Test that options are only built once for each distinct value of the
+    # options they depend on, and that identical configs are only checked
+    # once
+    def test_schema_cached(self):
+        validator = mock.Mock(return_value=utils.OK)
+
+        with mock.patch.object(check_config_batch.check_config,
+                               '_check_config_option',
+                               autospec=True) as mock_check:
+            mock_check.side_effect = lambda option, value: validator(value)
+            check_config_batch.check_nodes(
+                [TestOptionSchema],
+                {'node1': {'count': '1'},
+                 'node2': {'count': '2'},
+                 'node3': {'count': '2'},
+                 'node4': {'count': '3', 'mode': 'strict'}},
+                jobs=1)
+
+        self.assertEqual(TestOptionSchema.get_options_calls, 2)
+        self.assertEqual(validator.call_count, 4)
+
+    # Test that a node with a signaling namespace is checked without entering
+    # the namespace, which only exists on the node itself
+    @mock.patch.object(vlds, '_enter_namespace', autospec=True)
+    def test_signaling_namespace(self, mock_enter):
+        results = check_config_batch.check_nodes(
+            [TestSignalingSchema],
+            {'multi': {'sas_server': 'sas.example.com',
+                       'count': '1',
+                       'signaling_namespace': 'sig'},
+             'single': {'sas_server': 'sas.example.com', 'count': '1'}},
+            jobs=4)
+
+        self.assertFalse(mock_enter.called)
+        self.assertEqual(results['multi']['status'], utils.NOT_CHECKED)
+        self.assertEqual(
+            [(check['name'], check['status'])
+             for check in results['multi']['checks']],
+            [('sas_server', 'NOT_CHECKED'), ('count', 'OK')])
+        self.assertEqual(results['single']['status'], utils.OK)
+
+    # Test that a node whose checks fail is reported as an error, without
+    # affecting the other nodes
+    def test_check_fails(self):
+        def validator(name, value):
+            if value == 'fail':
+                raise IOError('No such file or directory')
+            return utils.OK
+
+        class FailingSchema(TestOptionSchema):
+            @staticmethod
+            def get_options():
+                return [utils.Option('count', utils.Option.MANDATORY,
+                                     validator)]
+
+        results = check_config_batch.check_nodes(
+            [FailingSchema],
+            {'good': {'count': '1'},
+             'bad': {'count': 'fail'}},
+            jobs=2)
+
+        self.assertEqual(results['good']['status'], utils.OK)
+        self.assertEqual(results['bad']['status'], utils.ERROR)
+        self.assertEqual(results['bad']['messages'],
+                         [{'severity': 'ERROR',
+                           'option': None,
+                           'message': 'checking the config failed: '
+                                      'No such file or directory'}])
+
+    # Test that configs that aren't objects of strings are reported, rather
+    # than being passed to the validators
+    def test_malformed_config(self):
+        results = check_config_batch.check_nodes(
+            [TestOptionSchema],
+            {'good': {'count': '1'},
+             'list': ['count'],
+             'number': {'count': 1, 'mode': [1]}})
+
+        self.assertEqual(results['good']['status'], utils.OK)
+        self.assertEqual(results['list']['status'], utils.ERROR)
+        self.assertEqual(results['list']['messages'][0]['option'], None)
+        self.assertEqual(
+            [(message['option'], message['message'])
+             for message in results['number']['messages']],
+            [('count', 'value must be a string, not 1'),
+             ('mode', 'value must be a string, not [1]')])
+
+    # Test that jobs left over once each node has a thread are used to run
+    # each node's checks in parallel
+    @mock.patch.object(check_config_batch.check_config, 'run_checks',
+                       autospec=True, return_value=[])
+    def test_jobs(self, mock_run_checks):
+        check_config_batch.check_nodes([TestOptionSchema],
+                                       {'node1': {'count': '1'},
+                                        'node2': {'count': '2'}},
+                                       jobs=8)
+
+        self.assertEqual([args[2] for args, _ in
+                          mock_run_checks.call_args_list],
+                         [4, 4])
+
+
+class TestReadConfigFile(unittest.TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.dir)
+
+    # Test that assignments are read, and comments and quotes are handled
+    def test_read(self):
+        filename = os.path.join(self.dir, 'shared_config')
+        with open(filename, 'w') as f:
+            f.write("# Deployment config\n"
+                    "home_domain=example.com\n"
+                    "\n"
+                    "sprout_hostname=\"sprout.example.com\"  # Sprout\n"
+                    "scscf_uri='sip:scscf.example.com;transport=TCP'\n")
+
+        self.assertEqual(check_config_batch.read_config_file(filename),
+                         {'home_domain': 'example.com',
+                          'sprout_hostname': 'sprout.example.com',
+                          'scscf_uri': 'sip:scscf.example.com;transport=TCP'})
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,145 @@
+# @file check_config_benchmark.py
+#
+# Copyright (C) Metaswitch Networks 2018
+# If license terms are provided to you in a COPYING file in the root directory
+# of the source code repository by which you are accessing this code, then
+# the license outlined in that COPYING file applies to your use.
+# Otherwise no rights are granted except for those provided to you by
+# Metaswitch Networks in a separate written agreement.
+
+# Benchmark checking the Clearwater config against a stub DNS server, to
+# measure how long a check takes under healthy, slow and broken DNS without
+# needing a network. Run with:
+#
+#   python -m cw_infrastructure.test.check_config_benchmark
+#
+# For each scenario this reports the wall time of the check, the number of
+# DNS queries that reached the server, and the median and tail latencies of
+# the lookups made.
+
+import sys
+import time
+import argparse
+
+from cw_infrastructure import check_config
+from cw_infrastructure import check_config_utilities as utils
+from cw_infrastructure.clearwater_options import ClearwaterOptions
+from cw_infrastructure.test.stub_dns_server import StubDNSServer
+
+DOMAIN = 'example.test'
+
+CONFIG = {
+    'local_ip': '10.0.0.10',
+    'public_ip': '10.0.0.10',
+    'public_hostname': 'node1.' + DOMAIN,
+    'home_domain': DOMAIN,
+    'sprout_hostname': 'sprout.' + DOMAIN,
+    'hs_hostname': 'hs.' + DOMAIN + ':8888',
+    'sprout_hostname_mgmt': 'sprout-mgmt.' + DOMAIN + ':9886',
+    'hs_hostname_mgmt': 'hs-mgmt.' + DOMAIN + ':8886',
+    'etcd_cluster': '10.0.0.10,10.0.0.11',
+    'hss_realm': 'hss.' + DOMAIN,
+    'hss_hostname': 'hss1.' + DOMAIN,
+    'snmp_ip': 'snmp.' + DOMAIN,
+    'sas_server': 'sas.' + DOMAIN,
+    'enum_server': 'enum.' + DOMAIN,
+    'billing_realm': 'billing.' + DOMAIN,
+    'ralf_hostname': 'ralf.' + DOMAIN + ':10888',
+    'chronos_hostname': 'chronos.' + DOMAIN,
+    'xdms_hostname': 'xdms.' + DOMAIN + ':7888',
+}
+
+A_RECORDS = ['sprout', 'hs', 'sprout-mgmt', 'hs-mgmt', 'hss1', 'snmp', 'sas',
+             'enum', 'ralf', 'chronos', 'xdms']
+SRV_RECORDS = ['_sip._tcp.scscf.sprout',
+               '_sip._tcp.bgcf.sprout',
+               '_sip._tcp.icscf.sprout',
+               '_diameter._tcp.hss',
+               '_diameter._tcp.billing']
+
+# The scenarios to run. Each is a tuple of name, delay for every response,
+# names that never get a response, number of parallel checks and time budget.
+SCENARIOS = [
+    ('healthy, serial', 0.005, [], 1, None),
+    ('healthy, parallel', 0.005, [], 8, None),
+    ('slow, serial', 0.2, [], 1, None),
+    ('slow, parallel', 0.2, [], 8, None),
+    ('broken, parallel', 0.005, ['xdms', 'billing'], 8, None),
+    ('broken, parallel, 3s budget', 0.005, ['xdms', 'billing'], 8, 3.0),
+]
+
+
+def percentile(values, fraction):
+    """Return the given percentile (as a fraction) of a list of values"""
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[min(len(values) - 1, int(fraction * len(values)))]
+
+
+def run_scenario(delay, broken, jobs, time_budget):
+    """Run a check against a stub DNS server set up for the scenario. Returns
+    the wall time, number of queries made and list of lookup latencies."""
+    server = StubDNSServer()
+    server.default_delay = delay
+
+    for name in A_RECORDS:
+        server.add_record('{}.{}'.format(name, DOMAIN), 'A', '10.0.1.1')
+    for name in SRV_RECORDS:
+        server.add_record('{}.{}'.format(name, DOMAIN), 'SRV',
+                          '0 0 5060 sprout.{}.'.format(DOMAIN))
+    for name in broken:
+        server.add_timeout('{}.{}'.format(name, DOMAIN))
+        server.add_timeout('_diameter._tcp.{}.{}'.format(name, DOMAIN))
+
+    dns_cache = utils.DNSCache()
+
+    with server, \
+            utils.option_values(CONFIG), \
+            utils.dns_servers(['127.0.0.1'], server.port):
+        start = time.time()
+        check_config.run_checks(ClearwaterOptions,
+                                utils.get_option_value,
+                                jobs,
+                                dns_cache,
+                                time_budget)
+        wall_time = time.time() - start
+
+    return (wall_time,
+            server.queries,
+            [duration for _, duration, _ in dns_cache.timings])
+
+
+def main(args=None):
+    parser = argparse.ArgumentParser(
+        description='Benchmark checking config against a stub DNS server')
+    parser.add_argument('--repeat', type=int, default=3,
+                        help='The number of times to run each scenario')
+    args = parser.parse_args(args)
+
+    sys.stdout.write("{:<30} {:>8} {:>8} {:>8} {:>8}\n".format(
+        "Scenario", "Wall(s)", "Queries", "p50(ms)", "p99(ms)"))
+
+    for name, delay, broken, jobs, time_budget in SCENARIOS:
+        wall_times = []
+        queries = 0
+        latencies = []
+
+        for _ in range(args.repeat):
+            wall_time, queries, run_latencies = run_scenario(delay,
+                                                             broken,
+                                                             jobs,
+                                                             time_budget)
+            wall_times.append(wall_time)
+            latencies += run_latencies
+
+        sys.stdout.write("{:<30} {:>8.3f} {:>8} {:>8.1f} {:>8.1f}\n".format(
+            name,
+            percentile(wall_times, 0.5),
+            queries,
+            percentile(latencies, 0.5) * 1000,
+            percentile(latencies, 0.99) * 1000))
+
+
+if __name__ == '__main__':
+    main()
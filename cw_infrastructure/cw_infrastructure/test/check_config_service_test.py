@@ -0,0 +1,176 @@
+# @file check_config_service_test.py
+#
+# Copyright (C) Metaswitch Networks 2018
+# If license terms are provided to you in a COPYING file in the root directory
+# of the source code repository by which you are accessing this code, then
+# the license outlined in that COPYING file applies to your use.
+# Otherwise no rights are granted except for those provided to you by
+# Metaswitch Networks in a separate written agreement.
+
+import os
+import shutil
+import tempfile
+import threading
+import unittest
+import mock
+
+from cw_infrastructure import check_config_utilities as utils
+from cw_infrastructure import check_config
+from cw_infrastructure import check_config_service
+
+
+class TestOptionSchema(object):
+    """Schema with one option, whose validator also depends on another
+    option"""
+
+    validator_calls = 0
+
+    @staticmethod
+    def hostname_validator(name, value):
+        TestOptionSchema.validator_calls += 1
+        if utils.get_option_value('strict') == 'Y' and '.' not in value:
+            utils.error(name, 'not fully qualified')
+            return utils.ERROR
+        return utils.OK
+
+    @staticmethod
+    def get_options():
+        return [utils.Option('hostname', utils.Option.MANDATORY,
+                             TestOptionSchema.hostname_validator)]
+
+    @staticmethod
+    def get_advanced_checks():
+        return []
+
+
+class TestResultCache(unittest.TestCase):
+
+    def setUp(self):
+        TestOptionSchema.validator_calls = 0
+        self.cache = check_config.ResultCache(ttl=300)
+
+    def run_checks(self, values):
+        with utils.option_values(values):
+            return check_config.run_checks(TestOptionSchema,
+                                           utils.get_option_value,
+                                           result_cache=self.cache)
+
+    # Test that unchanged options aren't checked again
+    def test_cached(self):
+        first = self.run_checks({'hostname': 'sprout'})
+        second = self.run_checks({'hostname': 'sprout', 'unrelated': '1'})
+
+        self.assertEqual(TestOptionSchema.validator_calls, 1)
+        self.assertFalse(first[0].cached)
+        self.assertTrue(second[0].cached)
+        self.assertEqual(second[0].status, utils.OK)
+
+    # Test that a check is rerun if its option changes, or if another option
+    # that it read changes
+    def test_invalidated(self):
+        self.run_checks({'hostname': 'sprout'})
+        self.run_checks({'hostname': 'sprout2'})
+        results = self.run_checks({'hostname': 'sprout2', 'strict': 'Y'})
+
+        self.assertEqual(TestOptionSchema.validator_calls, 3)
+        self.assertEqual(results[0].status, utils.ERROR)
+        self.assertEqual(results[0].depends_on,
+                         {'hostname': 'sprout2', 'strict': 'Y'})
+
+    # Test that results expire after the TTL
+    def test_ttl(self):
+        self.cache.ttl = 0
+        self.run_checks({'hostname': 'sprout'})
+        self.run_checks({'hostname': 'sprout'})
+        self.assertEqual(TestOptionSchema.validator_calls, 2)
+
+    # Test that results are discarded if the DNS environment changes
+    def test_environment(self):
+        self.cache.set_environment('before')
+        self.run_checks({'hostname': 'sprout'})
+        self.cache.set_environment('after')
+        self.run_checks({'hostname': 'sprout'})
+        self.assertEqual(TestOptionSchema.validator_calls, 2)
+
+
+class TestService(unittest.TestCase):
+
+    def setUp(self):
+        TestOptionSchema.validator_calls = 0
+        self.dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.dir)
+        self.socket_path = os.path.join(self.dir, 'check_config.sock')
+
+        service = check_config_service.CheckConfigService([TestOptionSchema],
+                                                          jobs=1)
+        self.server = check_config_service.make_server(service,
+                                                       self.socket_path)
+        self.thread = threading.Thread(target=self.server.serve_forever)
+        self.thread.daemon = True
+        self.thread.start()
+        self.addCleanup(self.server.server_close)
+        self.addCleanup(self.server.shutdown)
+
+    def request(self, values, refresh=False):
+        return check_config_service.request_check(values,
+                                                  self.socket_path,
+                                                  refresh,
+                                                  timeout=10)
+
+    # Test that the service checks config, and reuses results for unchanged
+    # options unless asked to refresh
+    @mock.patch('cw_infrastructure.check_config_utilities.dns_environment',
+                autospec=True, return_value='environment')
+    def test_request(self, mock_dns_environment):
+        first = self.request({'hostname': 'sprout', 'strict': 'Y'})
+        second = self.request({'hostname': 'sprout', 'strict': 'Y'})
+        third = self.request({'hostname': 'sprout', 'strict': 'Y'},
+                             refresh=True)
+
+        self.assertEqual(first['status'], utils.ERROR)
+        self.assertEqual(first['checks'][0]['messages'],
+                         [{'severity': 'ERROR',
+                           'option': 'hostname',
+                           'message': 'not fully qualified'}])
+        self.assertEqual([r['checks'][0]['cached']
+                          for r in (first, second, third)],
+                         [False, True, False])
+        self.assertEqual(TestOptionSchema.validator_calls, 2)
+
+    # Test that the checks are run in the client if the service isn't
+    # running
+    @mock.patch('cw_infrastructure.check_config.load_option_schemas',
+                autospec=True, return_value=[TestOptionSchema])
+    @mock.patch.dict('os.environ', {'hostname': 'sprout', 'strict': 'Y'})
+    def test_service_not_running(self, mock_load_option_schemas):
+        self.server.shutdown()
+        self.server.server_close()
+        os.unlink(self.socket_path)
+
+        with mock.patch('sys.stderr'):
+            status = check_config_service.check_environment(self.socket_path)
+
+        self.assertEqual(status, utils.ERROR)
+        self.assertEqual(TestOptionSchema.validator_calls, 1)
+
+    # Test that the service stops (to be restarted with the new option
+    # schemas) once the installed packages have changed, and that the client
+    # runs the checks itself meanwhile
+    @mock.patch('cw_infrastructure.check_config.load_option_schemas',
+                autospec=True, return_value=[TestOptionSchema])
+    @mock.patch('cw_infrastructure.entry_points.distributions_stamp',
+                autospec=True, return_value=[('new-1.0.dist-info', 0)])
+    def test_packages_changed(self, mock_stamp, mock_load_option_schemas):
+        results = check_config_service.check_values({'hostname': 'sprout'},
+                                                    self.socket_path,
+                                                    jobs=1)
+
+        self.assertEqual(results[0].status, utils.OK)
+        self.assertTrue(mock_load_option_schemas.called)
+
+        self.thread.join(10)
+        self.assertFalse(self.thread.is_alive())
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -7,8 +7,13 @@
 # Otherwise no rights are granted except for those provided to you by
 # Metaswitch Networks in a separate written agreement.
 
+import os
+import shutil
+import tempfile
 import unittest
+import time
 import mock
+import StringIO
 import hypothesis
 import hypothesis.strategies as st
 
@@ -148,6 +153,225 @@ class TestCheckConfig(unittest.TestCase):
 
         self.run_check_config(return_value)
 
+    # Test that running checks in parallel gives the same status code and
+    # writes the same messages, in the same order, as running them serially.
+    def test_parallel_matches_serial(self):
+        def make_validator(delay, code):
+            def validator(name, value):
+                time.sleep(delay)
+                if code == utils.ERROR:
+                    utils.error(name, 'bad value')
+                elif code == utils.WARNING:
+                    utils.warning(name, 'dubious value')
+                return code
+            return validator
+
+        # Earlier options take longer to validate, so finish last when run in
+        # parallel.
+        codes = [utils.WARNING, utils.OK, utils.ERROR, utils.WARNING]
+        for ii, code in enumerate(codes):
+            option_name = 'option_{}'.format(ii)
+            self.add_option(utils.Option(option_name,
+                                         utils.Option.MANDATORY,
+                                         make_validator(0.05 * (4 - ii),
+                                                        code)))
+            self.add_value(option_name, 'value')
+        self.set_advanced_check(lambda: utils.OK)
+
+        outputs = []
+        for jobs in (1, 4):
+            with mock.patch('sys.stderr', new_callable=StringIO.StringIO) as err:
+                status = check_config.check_config(self.option_schema,
+                                                   self.values.get_value,
+                                                   jobs=jobs)
+            self.assertEqual(utils.ERROR, status)
+            outputs.append(err.getvalue())
+
+        self.assertEqual(outputs[0], outputs[1])
+        self.assertEqual(['WARNING: option_0',
+                          'ERROR: option_2',
+                          'WARNING: option_3'],
+                         [line.rsplit(':', 1)[0]
+                          for line in outputs[1].splitlines()])
+
+    # Test that options and advanced checks that run out of time for DNS
+    # lookups are reported as not checked
+    @mock.patch('cw_infrastructure.check_config_utilities.not_checked',
+                autospec=True)
+    def test_not_checked(self, mock_not_checked):
+        mock_validator = mock.Mock()
+        mock_validator.side_effect = utils.DNSBudgetExhausted()
+
+        option_name = 'slow_option'
+        self.add_option(utils.Option(option_name,
+                                     utils.Option.MANDATORY,
+                                     mock_validator))
+        self.add_value(option_name, 'value')
+
+        def slow_check():
+            raise utils.DNSBudgetExhausted()
+        self.set_advanced_check(slow_check)
+
+        self.run_check_config(utils.NOT_CHECKED)
+        mock_not_checked.assert_has_calls([mock.call(option_name, mock.ANY),
+                                           mock.call('slow_check', mock.ANY)])
+
+    # Test that run_checks returns a result for each option and advanced
+    # check, including the messages reported and the time spent on DNS
+    @mock.patch('cw_infrastructure.check_config_utilities._query',
+                autospec=True)
+    def test_run_checks_results(self, mock_query):
+        def slow_query(name, rrtype):
+            time.sleep(0.05)
+            return False, time.time() + 60
+        mock_query.side_effect = slow_query
+
+        def hostname_validator(name, value):
+            if not utils.is_resolvable_domain_name(value):
+                utils.error(name, 'not resolvable')
+                return utils.ERROR
+            return utils.OK
+
+        self.add_option(utils.Option('hostname',
+                                     utils.Option.MANDATORY,
+                                     hostname_validator))
+        self.add_value('hostname', 'example.com')
+
+        def site_check():
+            return utils.OK
+        self.set_advanced_check(site_check)
+
+        results = check_config.run_checks(self.option_schema,
+                                          self.values.get_value)
+
+        self.assertEqual([(r.name, r.validator, r.status) for r in results],
+                         [('hostname', 'hostname_validator', utils.ERROR),
+                          ('site_check', None, utils.OK)])
+        self.assertEqual(results[0].messages,
+                         [('ERROR', 'hostname', 'not resolvable')])
+        self.assertGreaterEqual(results[0].dns_time, 0.1)
+        self.assertGreaterEqual(results[0].wall_time, results[0].dns_time)
+        self.assertEqual(results[1].dns_time, 0)
+
+        result = results[0].to_dict()
+        self.assertEqual(result['status'], 'ERROR')
+        self.assertEqual(result['messages'],
+                         [{'severity': 'ERROR',
+                           'option': 'hostname',
+                           'message': 'not resolvable'}])
+        self.assertEqual(check_config.worst_status(results), utils.ERROR)
+
+    # Test that a schema with no options or checks is OK
+    def test_empty_schema(self):
+        self.run_check_config(utils.OK)
+
+
+class TestIncrementalChecks(unittest.TestCase):
+
+    def setUp(self):
+        self.calls = []
+        self.cache = check_config.ResultCache(ttl=None)
+
+        @utils.depends_on('sprout_hostname', '*_uri')
+        def check_uris():
+            self.calls.append('check_uris')
+            return utils.OK
+
+        def validator(name, value):
+            self.calls.append(name)
+            return utils.OK
+
+        self.option_schema = TestCheckConfig.TestOptionSchema()
+        self.option_schema.options = [
+            utils.Option('sprout_hostname', utils.Option.MANDATORY, validator),
+            utils.Option('scscf_uri', utils.Option.OPTIONAL, validator),
+            utils.Option('sas_server', utils.Option.OPTIONAL, validator,
+                         depends_on=['sas_use_signaling_interface'])]
+        self.option_schema.advanced_checks = [check_uris]
+
+    def run_checks(self, values):
+        self.calls = []
+        with utils.option_values(values):
+            return check_config.run_checks(self.option_schema,
+                                           utils.get_option_value,
+                                           result_cache=self.cache)
+
+    # Test that only the checks affected by a change are rerun
+    def test_rerun_affected(self):
+        values = {'sprout_hostname': 'sprout', 'sas_server': 'sas'}
+        self.run_checks(values)
+        self.assertEqual(self.calls,
+                         ['sprout_hostname', 'sas_server', 'check_uris'])
+
+        self.run_checks(values)
+        self.assertEqual(self.calls, [])
+
+        values['sas_use_signaling_interface'] = 'Y'
+        self.run_checks(values)
+        self.assertEqual(self.calls, ['sas_server'])
+
+        values['scscf_uri'] = 'sip:scscf.sprout'
+        self.run_checks(values)
+        self.assertEqual(self.calls, ['scscf_uri', 'check_uris'])
+
+    # Test that a check is rerun if an option matching a declared dependency
+    # is newly set, even if it isn't in the schema
+    def test_new_dependency(self):
+        self.run_checks({'sprout_hostname': 'sprout'})
+        self.run_checks({'sprout_hostname': 'sprout',
+                         'mmtel_uri': 'sip:mmtel.sprout'})
+        self.assertEqual(self.calls, ['check_uris'])
+
+    # Test that results can be saved and used by a later run
+    def test_snapshot(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        path = os.path.join(directory, 'snapshot')
+
+        self.cache.set_environment('environment')
+        first = self.run_checks({'sprout_hostname': 'sprout'})
+        self.cache.save(path)
+
+        self.cache = check_config.ResultCache(ttl=None)
+        self.cache.load(path)
+        self.cache.set_environment('environment')
+        second = self.run_checks({'sprout_hostname': 'sprout'})
+
+        self.assertEqual(self.calls, [])
+        self.assertEqual([result.to_dict() for result in first],
+                         [dict(result.to_dict(), cached=False)
+                          for result in second])
+
+    # Test that saved results expire after the TTL, so that checks depending
+    # on DNS records are eventually rerun
+    @mock.patch('time.time', autospec=True)
+    def test_snapshot_expiry(self, mock_time):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        path = os.path.join(directory, 'snapshot')
+        values = {'sprout_hostname': 'sprout'}
+
+        mock_time.return_value = 1000.0
+        self.cache = check_config.ResultCache(ttl=60)
+        self.run_checks(values)
+        self.cache.save(path)
+
+        mock_time.return_value = 1059.0
+        self.cache = check_config.ResultCache(ttl=60)
+        self.cache.load(path)
+        self.run_checks(values)
+        self.assertEqual(self.calls, [])
+
+        mock_time.return_value = 1060.0
+        self.run_checks(values)
+        self.assertEqual(self.calls, ['sprout_hostname', 'check_uris'])
+
+    # Test that a missing snapshot is ignored
+    def test_missing_snapshot(self):
+        self.cache.load('/nonexistent/snapshot')
+        self.run_checks({'sprout_hostname': 'sprout'})
+        self.assertIn('check_uris', self.calls)
+
 
 if __name__ == '__main__':
     unittest.main()
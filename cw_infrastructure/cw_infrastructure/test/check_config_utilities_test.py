@@ -0,0 +1,207 @@
+# @file check_config_utilities_test.py
+#
+# Copyright (C) Metaswitch Networks 2018
+# If license terms are provided to you in a COPYING file in the root directory
+# of the source code repository by which you are accessing this code, then
+# the license outlined in that COPYING file applies to your use.
+# Otherwise no rights are granted except for those provided to you by
+# Metaswitch Networks in a separate written agreement.
+
+import unittest
+import threading
+import time
+import mock
+import dns.exception
+
+from cw_infrastructure import check_config_utilities as utils
+from cw_infrastructure.test.stub_dns_server import StubDNSServer
+
+
+class TestDNSCache(unittest.TestCase):
+
+    def setUp(self):
+        patcher = mock.patch('cw_infrastructure.check_config_utilities._query',
+                             autospec=True)
+        self.mock_query = patcher.start()
+        self.addCleanup(patcher.stop)
+        self.mock_query.return_value = (True, time.time() + 300)
+
+    # Test that repeated lookups of the same record are only queried once
+    def test_repeat_lookup(self):
+        with utils.dns_cache() as cache:
+            for _ in range(3):
+                self.assertTrue(utils.is_resolvable_domain_name('example.com'))
+
+        self.mock_query.assert_called_once_with('example.com', 'A')
+        self.assertEqual((cache.misses, cache.hits), (1, 2))
+
+    # Test that failed lookups are cached too
+    def test_negative_lookup(self):
+        self.mock_query.return_value = (False, time.time() + 300)
+
+        with utils.dns_cache():
+            self.assertFalse(utils.is_srv_resolvable('_sip._tcp.example.com'))
+            self.assertFalse(utils.is_srv_resolvable('_sip._tcp.example.com'))
+
+        self.assertEqual(self.mock_query.call_count, 1)
+
+    # Test that results are not used once they have expired
+    def test_expiry(self):
+        self.mock_query.return_value = (True, time.time() - 1)
+
+        with utils.dns_cache():
+            utils.is_naptr_resolvable('example.com')
+            utils.is_naptr_resolvable('example.com')
+
+        self.assertEqual(self.mock_query.call_count, 2)
+
+    # Test that pruning forgets expired results and past timings, but keeps
+    # results that are still valid
+    def test_prune(self):
+        cache = utils.DNSCache()
+        cache.lookup('live', lambda: (True, time.time() + 300))
+        cache.lookup('expired', lambda: (True, time.time() - 1))
+
+        cache.prune()
+
+        self.assertEqual(cache.timings, [])
+        self.assertEqual(sorted(cache._results), ['live'])
+        self.assertTrue(cache.lookup('live', self.fail))
+
+    # Test that lookups in different namespaces, or from different DNS
+    # servers, are cached separately
+    def test_key_includes_namespace_and_servers(self):
+        with utils.dns_cache() as cache:
+            utils.is_domain_resolvable('example.com', 'A')
+
+            with utils.dns_namespace('signaling'):
+                utils.is_domain_resolvable('example.com', 'A')
+
+                with utils.dns_servers(['1.2.3.4']):
+                    utils.is_domain_resolvable('example.com', 'A')
+
+            utils.is_domain_resolvable('EXAMPLE.com', 'A')
+
+        self.assertEqual((cache.misses, cache.hits), (3, 1))
+
+    # Test that concurrent lookups of the same record only make one query
+    def test_concurrent_lookup(self):
+        def slow_query(name, rrtype):
+            time.sleep(0.1)
+            return True, time.time() + 300
+        self.mock_query.side_effect = slow_query
+
+        with utils.dns_cache():
+            threads = [threading.Thread(
+                           target=utils.is_domain_resolvable,
+                           args=('example.com', 'A')) for _ in range(5)]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+
+        self.assertEqual(self.mock_query.call_count, 1)
+
+    # Test that lookups are not cached outside of a dns_cache context
+    def test_no_cache(self):
+        utils.is_domain_resolvable('example.com', 'A')
+        utils.is_domain_resolvable('example.com', 'A')
+        self.assertEqual(self.mock_query.call_count, 2)
+
+
+class TestDNSBudget(unittest.TestCase):
+
+    # Test that the remaining time is shared between the pending checks
+    def test_share(self):
+        budget = utils.DNSBudget(4.0, 4)
+        self.assertAlmostEqual(budget.lookup_lifetime(), 1.0, places=1)
+
+        budget.check_finished()
+        budget.check_finished()
+        self.assertAlmostEqual(budget.lookup_lifetime(), 2.0, places=1)
+
+    # Test that checks running in parallel each get a larger share
+    def test_share_parallel(self):
+        budget = utils.DNSBudget(4.0, 4, parallelism=2)
+        self.assertAlmostEqual(budget.lookup_lifetime(), 2.0, places=1)
+
+    # Test that a lookup never gets longer than the usual DNS lifetime
+    def test_share_capped(self):
+        budget = utils.DNSBudget(60.0, 1)
+        self.assertEqual(budget.lookup_lifetime(), utils.DNS_LIFETIME)
+
+    # Test that lookups fail once the budget is used up
+    def test_exhausted(self):
+        budget = utils.DNSBudget(0, 1)
+        self.assertRaises(utils.DNSBudgetExhausted, budget.lookup_lifetime)
+
+    # Test that a lookup that times out after being cut short by the budget is
+    # not treated as unresolvable
+    @mock.patch('cw_infrastructure.check_config_utilities._get_resolver',
+                autospec=True)
+    def test_timeout_cut_short(self, mock_get_resolver):
+        mock_get_resolver.return_value.query.side_effect = \
+            dns.exception.Timeout()
+
+        with utils.dns_budget(utils.DNSBudget(1.0, 1)):
+            self.assertRaises(utils.DNSBudgetExhausted,
+                              utils.is_domain_resolvable, 'example.com', 'A')
+
+        # Without a budget, the same timeout means unresolvable.
+        self.assertFalse(utils.is_domain_resolvable('example.com', 'A'))
+
+
+class TestStubDNS(unittest.TestCase):
+    """Tests that make real DNS lookups, against a local stub server"""
+
+    def setUp(self):
+        self.server = StubDNSServer()
+        self.server.add_record('sprout.example.test', 'A', '10.0.0.1')
+        self.server.add_record('hs.example.test', 'AAAA', '2001:db8::1')
+        self.server.add_record('_sip._tcp.example.test', 'SRV',
+                               '0 0 5054 sprout.example.test.')
+        self.server.add_record('example.test', 'NAPTR',
+                               '0 0 "s" "SIP+D2T" "" _sip._tcp.example.test.')
+        self.server.add_timeout('broken.example.test')
+        self.server.start()
+        self.addCleanup(self.server.stop)
+
+    def dns_servers(self):
+        return utils.dns_servers(['127.0.0.1'], self.server.port)
+
+    # Test that each record type is resolved
+    def test_resolve(self):
+        with self.dns_servers():
+            self.assertTrue(utils.is_resolvable_domain_name(
+                'sprout.example.test'))
+            self.assertTrue(utils.is_resolvable_domain_name('hs.example.test'))
+            self.assertTrue(utils.is_srv_resolvable('_sip._tcp.example.test'))
+            self.assertTrue(utils.is_naptr_resolvable('example.test'))
+
+            self.assertFalse(utils.is_srv_resolvable('example.test'))
+            self.assertFalse(utils.is_resolvable_domain_name(
+                'missing.example.test'))
+
+    # Test that the cache means repeated lookups only reach the server once
+    def test_cached(self):
+        with self.dns_servers(), utils.dns_cache():
+            for _ in range(3):
+                utils.is_domain_resolvable('sprout.example.test', 'A')
+
+        self.assertEqual(self.server.queries, 1)
+
+    # Test that a lookup that gets no response is cut short by the budget
+    def test_timeout_budget(self):
+        start = time.time()
+
+        with self.dns_servers(), utils.dns_budget(utils.DNSBudget(0.5, 1)):
+            self.assertRaises(utils.DNSBudgetExhausted,
+                              utils.is_domain_resolvable,
+                              'broken.example.test',
+                              'A')
+
+        self.assertLess(time.time() - start, 1.5)
+
+
+if __name__ == '__main__':
+    unittest.main()
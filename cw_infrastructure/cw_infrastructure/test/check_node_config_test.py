@@ -0,0 +1,132 @@
+# @file check_node_config_test.py
+#
+# Copyright (C) Metaswitch Networks 2018
+# If license terms are provided to you in a COPYING file in the root directory
+# of the source code repository by which you are accessing this code, then
+# the license outlined in that COPYING file applies to your use.
+# Otherwise no rights are granted except for those provided to you by
+# Metaswitch Networks in a separate written agreement.
+
+import os
+import shutil
+import tempfile
+import unittest
+import mock
+import StringIO
+
+from cw_infrastructure import check_config_utilities as utils
+from cw_infrastructure import check_node_config
+
+
+class TestOptionSchema(object):
+
+    @staticmethod
+    def get_options():
+        return [utils.Option('local_ip', utils.Option.MANDATORY),
+                utils.Option('home_domain', utils.Option.MANDATORY),
+                utils.Option('snmp_ip', utils.Option.SUGGESTED)]
+
+    @staticmethod
+    def get_advanced_checks():
+        return []
+
+
+@mock.patch('cw_infrastructure.check_config.load_option_schemas',
+            autospec=True,
+            return_value=[TestOptionSchema])
+@mock.patch('sys.stderr', new_callable=StringIO.StringIO)
+class TestCheckNodeConfig(unittest.TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.dir)
+
+        self.write_file('config',
+                        ". /etc/clearwater/shared_config\n"
+                        ". /etc/clearwater/local_config\n")
+        self.write_file('shared_config', "home_domain=example.com\n")
+        self.write_file('local_config', "local_ip=10.0.0.1\n")
+
+    def write_file(self, name, contents):
+        with open(os.path.join(self.dir, name), 'w') as f:
+            f.write(contents)
+
+    def check(self):
+        return check_node_config.check_node_config(
+            self.dir,
+            jobs=1,
+            socket_path=os.path.join(self.dir, 'check_config.sock'))
+
+    # Test that valid config passes, even with warnings
+    def test_valid(self, mock_stderr, mock_load):
+        self.assertEqual(self.check(), 0)
+        self.assertEqual(mock_stderr.getvalue(),
+                         "WARNING: snmp_ip: option is recommended but not "
+                         "configured\n")
+
+    # Test that user settings override local config
+    def test_layering(self, mock_stderr, mock_load):
+        self.write_file('local_config', "")
+        self.write_file('user_settings', "local_ip=10.0.0.2\n")
+        self.assertEqual(self.check(), 0)
+
+    # Test that missing or invalid files fail the check before any options
+    # are checked
+    def test_invalid_files(self, mock_stderr, mock_load):
+        os.unlink(os.path.join(self.dir, 'local_config'))
+        self.write_file('config', "if true; then\n")
+
+        self.assertEqual(self.check(), 1)
+        self.assertIn("local_config does not exist", mock_stderr.getvalue())
+        self.assertIn("config is not syntactically valid",
+                      mock_stderr.getvalue())
+        self.assertFalse(mock_load.called)
+
+    # Test that local options in shared config are reported
+    def test_local_option_in_shared_config(self, mock_stderr, mock_load):
+        self.write_file('shared_config',
+                        "home_domain=example.com\n"
+                        "node_idx=1\n")
+
+        self.assertEqual(self.check(), 1)
+        self.assertIn(
+            "ERROR: node_idx should not be placed in {}\n".format(
+                os.path.join(self.dir, 'shared_config')),
+            mock_stderr.getvalue())
+
+    # Test that errors from the option schemas fail the check
+    def test_schema_error(self, mock_stderr, mock_load):
+        self.write_file('shared_config', "")
+        self.assertEqual(self.check(), 1)
+        self.assertIn("ERROR: home_domain: option is mandatory but not present",
+                      mock_stderr.getvalue())
+
+    # Test that the option values are checked by the config check service if
+    # it is running
+    @mock.patch('cw_infrastructure.check_config_service.request_check',
+                autospec=True)
+    def test_service(self, mock_request_check, mock_stderr, mock_load):
+        mock_request_check.return_value = {
+            'status': utils.ERROR,
+            'checks': [{'name': 'home_domain',
+                        'validator': None,
+                        'status': 'ERROR',
+                        'messages': [{'severity': 'ERROR',
+                                      'option': 'home_domain',
+                                      'message': 'not valid'}],
+                        'wall_time': 0.0,
+                        'dns_time': 0.0,
+                        'depends_on': {'home_domain': 'example.com'},
+                        'cached': True}]}
+
+        self.assertEqual(self.check(), 1)
+        self.assertEqual(mock_stderr.getvalue(),
+                         "ERROR: home_domain: not valid\n")
+        self.assertEqual(mock_request_check.call_args[0][0],
+                         {'home_domain': 'example.com',
+                          'local_ip': '10.0.0.1'})
+        self.assertFalse(mock_load.called)
+
+
+if __name__ == '__main__':
+    unittest.main()
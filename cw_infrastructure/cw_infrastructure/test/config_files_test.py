@@ -0,0 +1,106 @@
+# @file config_files_test.py
+#
+# Copyright (C) Metaswitch Networks 2018
+# If license terms are provided to you in a COPYING file in the root directory
+# of the source code repository by which you are accessing this code, then
+# the license outlined in that COPYING file applies to your use.
+# Otherwise no rights are granted except for those provided to you by
+# Metaswitch Networks in a separate written agreement.
+
+import os
+import shutil
+import tempfile
+import unittest
+import mock
+
+from cw_infrastructure import config_files
+
+
+class TestConfigFiles(unittest.TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.dir)
+
+    def write_file(self, name, contents):
+        filename = os.path.join(self.dir, name)
+        with open(filename, 'w') as f:
+            f.write(contents)
+        return filename
+
+    # Test that plain assignments are parsed without running bash
+    @mock.patch('subprocess.Popen', autospec=True)
+    def test_parse(self, mock_popen):
+        filename = self.write_file(
+            'shared_config',
+            "# Deployment config\n"
+            "home_domain=example.com\n"
+            "export sprout_hostname=\"sprout.$home_domain\"  # Sprout\n"
+            "scscf_uri=\"sip:scscf.${home_domain};transport=TCP\"\n"
+            "a=1; b=with\\ space c=\"quoted \\\"$a\\\"\"\n"
+            "d='$a' e=\n"
+            "export d\n")
+
+        self.assertEqual(config_files.read_config_file(filename),
+                         {'home_domain': 'example.com',
+                          'sprout_hostname': 'sprout.example.com',
+                          'scscf_uri': 'sip:scscf.example.com;transport=TCP',
+                          'a': '1',
+                          'b': 'with space',
+                          'c': 'quoted "1"',
+                          'd': '$a',
+                          'e': ''})
+        self.assertFalse(mock_popen.called)
+
+    # Test that later files override earlier ones, and can refer to their
+    # values
+    def test_layering(self):
+        shared = self.write_file('shared_config',
+                                 "home_domain=example.com\n"
+                                 "sprout_hostname=sprout.example.com\n")
+        local = self.write_file('local_config',
+                                "sprout_hostname=scscf.$home_domain\n")
+        missing = os.path.join(self.dir, 'user_settings')
+
+        self.assertEqual(
+            config_files.read_config_files([shared, local, missing]),
+            {'home_domain': 'example.com',
+             'sprout_hostname': 'scscf.example.com'})
+
+    # Test that files needing more of the shell are sourced in bash
+    def test_bash_fallback(self):
+        filename = self.write_file('local_config',
+                                   "if [ -n \"$home_domain\" ]; then\n"
+                                   "  public_hostname=node1.$home_domain\n"
+                                   "fi\n"
+                                   "node_idx=$((1 + 1))\n")
+
+        self.assertEqual(
+            config_files.read_config_file(filename,
+                                          {'home_domain': 'example.com'}),
+            {'home_domain': 'example.com',
+             'public_hostname': 'node1.example.com',
+             'node_idx': '2'})
+
+    # Test that syntax errors are reported
+    def test_syntax_error(self):
+        filename = self.write_file('local_config',
+                                   "local_ip=1.2.3.4\n"
+                                   "if [ -n \"$local_ip\" ]; then\n")
+
+        self.assertRaises(config_files.ConfigFileError,
+                          config_files.read_config_file,
+                          filename)
+        self.assertRaises(config_files.ConfigFileError,
+                          config_files.check_syntax,
+                          filename)
+
+    # Test that a missing file is reported
+    def test_missing(self):
+        self.assertRaises(config_files.ConfigFileError,
+                          config_files.read_config_file,
+                          os.path.join(self.dir, 'missing'))
+
+
+if __name__ == '__main__':
+    unittest.main()
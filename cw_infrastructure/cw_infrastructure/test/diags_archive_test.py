@@ -0,0 +1,163 @@
+# @file diags_archive_test.py
+#
+# Copyright (C) Metaswitch Networks 2018
+# If license terms are provided to you in a COPYING file in the root directory
+# of the source code repository by which you are accessing this code, then
+# the license outlined in that COPYING file applies to your use.
+# Otherwise no rights are granted except for those provided to you by
+# Metaswitch Networks in a separate written agreement.
+
+import os
+import shutil
+import tarfile
+import tempfile
+import unittest
+import mock
+from StringIO import StringIO
+
+from cw_infrastructure.test.scripts import load_script
+
+diags_archive = load_script('clearwater-diags-monitor', 'diags_archive')
+
+
+class TestPaddedFile(unittest.TestCase):
+
+    # Test that a file that's truncated while it's read is padded out to the
+    # size it had when it was added
+    def test_truncated(self):
+        padded = diags_archive._PaddedFile(StringIO('abc'), 6)
+
+        self.assertEqual(padded.read(4), 'abc\0')
+        self.assertEqual(padded.read(4), '\0\0')
+        self.assertEqual(padded.read(4), '')
+
+    # Test that a file that grows while it's read is cut off at that size
+    def test_grown(self):
+        padded = diags_archive._PaddedFile(StringIO('abcdef'), 3)
+
+        self.assertEqual(padded.read(10), 'abc')
+        self.assertEqual(padded.read(10), '')
+
+
+class TestWriteArchive(unittest.TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.dir)
+
+        self.dump_dir = self.make_dir('dump', {'info.txt': 'info'})
+        self.logs = self.make_dir('logs', {'sprout.log': 'log'})
+        self.core = self.make_file('core.sprout', 'core')
+        self.output = os.path.join(self.dir, 'dump.tar.gz')
+
+        self.sources = [('add', 'dump/root/logs', self.logs),
+                        ('move', 'dump/core.sprout', self.core)]
+
+    def make_file(self, name, contents):
+        path = os.path.join(self.dir, name)
+        with open(path, 'w') as f:
+            f.write(contents)
+        return path
+
+    def make_dir(self, name, files):
+        os.mkdir(os.path.join(self.dir, name))
+        for filename, contents in files.items():
+            self.make_file(os.path.join(name, filename), contents)
+        return os.path.join(self.dir, name)
+
+    def archived(self):
+        with tarfile.open(self.output) as archive:
+            return dict((member.name, archive.extractfile(member).read())
+                        for member in archive.getmembers()
+                        if member.isfile())
+
+    # Test that the dump directory and the sources are archived, and moved
+    # sources deleted
+    def test_archive(self):
+        errors = diags_archive.write_archive(self.output,
+                                             self.dump_dir,
+                                             'dump',
+                                             self.sources)
+
+        self.assertEqual(errors, [])
+        self.assertEqual(self.archived(),
+                         {'dump/info.txt': 'info',
+                          'dump/root/logs/sprout.log': 'log',
+                          'dump/core.sprout': 'core'})
+        self.assertTrue(os.path.exists(self.logs))
+        self.assertFalse(os.path.exists(self.core))
+
+    # Test that a missing source is reported, and the rest still archived
+    def test_missing_source(self):
+        missing = os.path.join(self.dir, 'missing')
+        self.sources.append(('add', 'dump/missing', missing))
+
+        errors = diags_archive.write_archive(self.output,
+                                             self.dump_dir,
+                                             'dump',
+                                             self.sources)
+
+        self.assertEqual(errors, ['%s: not present' % missing])
+        self.assertIn('dump/core.sprout', self.archived())
+
+    # Test that if the compressor fails, an error is raised and moved sources
+    # are kept
+    @mock.patch.object(diags_archive, 'compressor_command',
+                       return_value=['false'])
+    def test_compressor_fails(self, mock_command):
+        self.assertRaises(EnvironmentError,
+                          diags_archive.write_archive,
+                          self.output,
+                          self.dump_dir,
+                          'dump',
+                          self.sources)
+        self.assertTrue(os.path.exists(self.core))
+
+    # Test that an error is raised if there's no compressor at all
+    @mock.patch.object(diags_archive, 'find_executable', return_value=None)
+    def test_no_compressor(self, mock_find):
+        self.assertRaises(EnvironmentError,
+                          diags_archive.write_archive,
+                          self.output,
+                          self.dump_dir,
+                          'dump',
+                          self.sources)
+        self.assertTrue(os.path.exists(self.core))
+
+
+class TestInstalledCodec(unittest.TestCase):
+
+    def setUp(self):
+        patcher = mock.patch.object(diags_archive, 'find_executable')
+        self.mock_find = patcher.start()
+        self.addCleanup(patcher.stop)
+        self.installed = set()
+        self.mock_find.side_effect = lambda name: name in self.installed
+
+    # Test that an installed codec is used
+    def test_installed(self):
+        self.installed.update(['xz', 'gzip'])
+        self.assertEqual(diags_archive.installed_codec('xz'), 'xz')
+        self.assertEqual(diags_archive.compressor_command('xz', 4),
+                         ['xz', '-c', '-T', '4'])
+
+    # Test that gzip is used in place of a codec that isn't installed
+    def test_fallback(self):
+        self.installed.update(['gzip'])
+        self.assertEqual(diags_archive.installed_codec('zstd'), 'gzip')
+        self.assertEqual(diags_archive.compressor_command('zstd', 4),
+                         ['gzip', '-c'])
+
+    # Test that pigz is preferred to gzip
+    def test_preference(self):
+        self.installed.update(['pigz', 'gzip'])
+        self.assertEqual(diags_archive.compressor_command('gzip', 4),
+                         ['pigz', '-c', '-p', '4'])
+
+    # Test that there's no command if nothing is installed
+    def test_nothing_installed(self):
+        self.assertIsNone(diags_archive.compressor_command('xz', 4))
+
+
+if __name__ == '__main__':
+    unittest.main()
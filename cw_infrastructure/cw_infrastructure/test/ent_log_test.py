@@ -0,0 +1,126 @@
+# @file ent_log_test.py
+#
+# Copyright (C) Metaswitch Networks 2018
+# If license terms are provided to you in a COPYING file in the root directory
+# of the source code repository by which you are accessing this code, then
+# the license outlined in that COPYING file applies to your use.
+# Otherwise no rights are granted except for those provided to you by
+# Metaswitch Networks in a separate written agreement.
+
+import os
+import syslog
+import unittest
+import mock
+
+from cw_infrastructure.test.scripts import load_script, REPO_DIR
+
+ent_log = load_script('clearwater-infrastructure', 'ent_log')
+
+TEMPLATES = {
+    'CL_NS_MISMATCH': (6001,
+                       syslog.LOG_ERR,
+                       'Namespace (%s) does not exist.',
+                       'Cause.',
+                       'Effect.',
+                       'Action.'),
+    'CL_DISK_FULL': (6002,
+                     syslog.LOG_WARNING,
+                     'Disk 100% full.',
+                     'Disk usage at 100%.',
+                     'Logs (%s) are lost.',
+                     'Free 10% of the disk.')}
+
+
+class TestTemplateRegistry(unittest.TestCase):
+
+    def setUp(self):
+        self.registry = ent_log.TemplateRegistry(TEMPLATES)
+
+    # Test that the message variables are filled in
+    def test_format(self):
+        self.assertEqual(self.registry.format('CL_NS_MISMATCH', 'signaling'),
+                         (syslog.LOG_ERR,
+                          '6001 - Description: Namespace (signaling) does not '
+                          'exist. @@Cause: Cause. @@Effect: Effect. '
+                          '@@Action: Action.'))
+
+    # Test that, with no variables supplied, the message is used as it is
+    def test_no_variables(self):
+        self.assertEqual(self.registry.format('CL_NS_MISMATCH'),
+                         (syslog.LOG_ERR,
+                          '6001 - Description: Namespace (%s) does not '
+                          'exist. @@Cause: Cause. @@Effect: Effect. '
+                          '@@Action: Action.'))
+
+    # Test that % signs outside the message are left alone
+    def test_percent_signs(self):
+        self.assertEqual(self.registry.format('CL_DISK_FULL'),
+                         (syslog.LOG_WARNING,
+                          '6002 - Description: Disk 100% full. @@Cause: Disk '
+                          'usage at 100%. @@Effect: Logs (%s) are lost. '
+                          '@@Action: Free 10% of the disk.'))
+
+    # Test that the installed templates load
+    def test_installed_templates(self):
+        directory = os.path.join(REPO_DIR,
+                                 'clearwater-infrastructure',
+                                 'usr', 'share', 'clearwater',
+                                 'infrastructure', 'ent_logs')
+        registry = ent_log.TemplateRegistry(
+            ent_log.load_templates(directory))
+
+        self.assertIn('CL_SIG_NS_MISMATCH', registry)
+        self.assertEqual(registry.format('CL_SIG_NS_MISMATCH', 'sig')[0],
+                         syslog.LOG_ERR)
+
+
+@mock.patch.object(ent_log, '_syslog', autospec=True)
+@mock.patch('time.time', return_value=1000.0)
+class TestEntLogger(unittest.TestCase):
+
+    def setUp(self):
+        self.logger = ent_log.EntLogger('test',
+                                        ent_log.TemplateRegistry(TEMPLATES),
+                                        rate_limit=3,
+                                        rate_period=60,
+                                        dedup_window=10)
+
+    # Test that logs are issued with the logger's ident
+    def test_log(self, mock_time, mock_syslog):
+        self.assertTrue(self.logger.log('CL_NS_MISMATCH', 'signaling'))
+        mock_syslog.assert_called_once_with(
+            'test',
+            syslog.LOG_ERR,
+            self.logger.registry.format('CL_NS_MISMATCH', 'signaling')[1])
+        self.assertEqual(self.logger.counters['logged'], 1)
+
+    # Test that a log identical to a recent one is suppressed, until the
+    # dedup window has passed
+    def test_duplicates(self, mock_time, mock_syslog):
+        self.assertTrue(self.logger.log('CL_NS_MISMATCH', 'signaling'))
+        self.assertFalse(self.logger.log('CL_NS_MISMATCH', 'signaling'))
+        self.assertTrue(self.logger.log('CL_NS_MISMATCH', 'other'))
+
+        mock_time.return_value += 10
+        self.assertTrue(self.logger.log('CL_NS_MISMATCH', 'signaling'))
+
+        self.assertEqual(mock_syslog.call_count, 3)
+        self.assertEqual(self.logger.counters['duplicates'], 1)
+
+    # Test that each template is logged at most rate_limit times in any
+    # rate_period
+    def test_rate_limit(self, mock_time, mock_syslog):
+        for namespace in ('a', 'b', 'c', 'd'):
+            self.logger.log('CL_NS_MISMATCH', namespace)
+        self.assertTrue(self.logger.log('CL_DISK_FULL'))
+
+        mock_time.return_value += 60
+        self.assertTrue(self.logger.log('CL_NS_MISMATCH', 'e'))
+
+        self.assertEqual(mock_syslog.call_count, 5)
+        self.assertEqual(self.logger.counters['rate_limited'], 1)
+
+    # Test that unknown templates are rejected
+    def test_unknown(self, mock_time, mock_syslog):
+        self.assertRaises(KeyError, self.logger.log, 'CL_UNKNOWN')
+        self.assertFalse(mock_syslog.called)
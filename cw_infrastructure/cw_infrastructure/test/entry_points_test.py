@@ -0,0 +1,90 @@
+# @file entry_points_test.py
+#
+# Copyright (C) Metaswitch Networks 2018
+# If license terms are provided to you in a COPYING file in the root directory
+# of the source code repository by which you are accessing this code, then
+# the license outlined in that COPYING file applies to your use.
+# Otherwise no rights are granted except for those provided to you by
+# Metaswitch Networks in a separate written agreement.
+
+import os
+import sys
+import shutil
+import tempfile
+import unittest
+import mock
+import pkg_resources
+
+from cw_infrastructure import entry_points
+
+
+class TestIterEntryPoints(unittest.TestCase):
+
+    def setUp(self):
+        self.dirs = [tempfile.mkdtemp(), tempfile.mkdtemp()]
+        for path in self.dirs:
+            self.addCleanup(shutil.rmtree, path)
+
+        patcher = mock.patch.object(sys, 'path', list(self.dirs))
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def add_distribution(self, path, name, contents):
+        metadata_dir = os.path.join(path, name)
+        os.mkdir(metadata_dir)
+        with open(os.path.join(metadata_dir, 'entry_points.txt'), 'w') as f:
+            f.write(contents)
+
+    # Test that entry points in the requested group are found and loaded
+    def test_load(self):
+        self.add_distribution(self.dirs[0], 'first-1.0.dist-info',
+                              "[console_scripts]\n"
+                              "tool = first.cli:main\n"
+                              "\n"
+                              "[option_schemas]\n"
+                              "paths = os.path:join\n")
+        self.add_distribution(self.dirs[1], 'second.egg-info',
+                              "[option_schemas]\n"
+                              "extra = os:path.split [extra]\n")
+
+        found = entry_points.iter_entry_points('option_schemas')
+
+        self.assertEqual([e.name for e in found], ['paths', 'extra'])
+        self.assertIs(found[0].load(), os.path.join)
+        self.assertIs(found[1].load(), os.path.split)
+
+    # Test that only the first copy of a distribution on sys.path is used
+    def test_duplicate_distribution(self):
+        self.add_distribution(self.dirs[0], 'first-2.0.dist-info',
+                              "[option_schemas]\nnew = os:sep\n")
+        self.add_distribution(self.dirs[1], 'first-1.0.dist-info',
+                              "[option_schemas]\nold = os:sep\n")
+
+        self.assertEqual([e.name for e in
+                          entry_points.iter_entry_points('option_schemas')],
+                         ['new'])
+
+    # Test that pkg_resources is used if no entry points are found
+    @mock.patch.object(pkg_resources, 'iter_entry_points', autospec=True)
+    def test_fallback(self, mock_iter_entry_points):
+        mock_iter_entry_points.return_value = iter(['fallback'])
+        self.assertEqual(entry_points.iter_entry_points('option_schemas'),
+                         ['fallback'])
+
+    # Test that the stamp changes when a distribution is installed or
+    # removed
+    def test_distributions_stamp(self):
+        self.add_distribution(self.dirs[0], 'first-1.0.dist-info', "")
+        before = entry_points.distributions_stamp()
+        self.assertEqual(entry_points.distributions_stamp(), before)
+
+        self.add_distribution(self.dirs[1], 'second-1.0.dist-info', "")
+        installed = entry_points.distributions_stamp()
+        self.assertNotEqual(installed, before)
+
+        shutil.rmtree(os.path.join(self.dirs[1], 'second-1.0.dist-info'))
+        self.assertEqual(entry_points.distributions_stamp(), before)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,120 @@
+# @file log_cleanup_test.py
+#
+# Copyright (C) Metaswitch Networks 2018
+# If license terms are provided to you in a COPYING file in the root directory
+# of the source code repository by which you are accessing this code, then
+# the license outlined in that COPYING file applies to your use.
+# Otherwise no rights are granted except for those provided to you by
+# Metaswitch Networks in a separate written agreement.
+
+import os
+import time
+import shutil
+import tempfile
+import unittest
+import mock
+
+from cw_infrastructure.test.scripts import load_script
+
+log_cleanup = load_script('clearwater-log-cleanup', 'log_cleanup')
+
+
+class TestLogCleanup(unittest.TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.dir)
+
+    def write(self, name, size=1000, age=3600):
+        path = os.path.join(self.dir, name)
+        with open(path, 'w') as f:
+            f.write('x' * size)
+
+        mtime = time.time() - age
+        os.utime(path, (mtime, mtime))
+        return path
+
+    def names(self, logs):
+        return [os.path.basename(path) for path, _ in logs]
+
+    def rotated(self, **kwargs):
+        return self.names(log_cleanup.rotated_logs(
+            log_cleanup.get_logs(self.dir, '', '.txt', compressed=True),
+            **kwargs))
+
+    # Test that the oldest logs are deleted until the limits are met
+    def test_cleanup(self):
+        for hour in range(5):
+            self.write('log_2018100412%02d.txt' % hour)
+        self.write('other.log')
+
+        deleted = log_cleanup.cleanup(self.dir, 'log_', '', maxsize=3000)
+
+        self.assertEqual(self.names(deleted), ['log_201810041200.txt',
+                                               'log_201810041201.txt'])
+        self.assertEqual(sorted(os.listdir(self.dir)),
+                         ['log_201810041202.txt',
+                          'log_201810041203.txt',
+                          'log_201810041204.txt',
+                          'other.log'])
+
+    # Test that compressed logs are only included when compressing
+    def test_compressed_suffix(self):
+        self.write('log_1.txt')
+        self.write('log_0.txt.gz')
+
+        self.assertEqual(
+            self.names(log_cleanup.get_logs(self.dir, '', '.txt')),
+            ['log_1.txt'])
+        self.assertEqual(
+            sorted(self.names(log_cleanup.get_logs(self.dir, '', '.txt',
+                                                   compressed=True))),
+            ['log_0.txt.gz', 'log_1.txt'])
+
+    # Test that the newest log of each stream isn't compressed
+    def test_rotated_per_stream(self):
+        self.write('log_20181004T110000Z.txt')
+        self.write('log_20181004T120000Z.txt')
+        self.write('access_20181004T110000Z.txt')
+        self.write('access_20181004T120000Z.txt')
+        self.write('access_current.txt')
+
+        self.assertEqual(self.rotated(), ['log_20181004T110000Z.txt',
+                                          'access_20181004T110000Z.txt'])
+
+    # Test that symbolic links, and the logs they point to, aren't compressed
+    def test_rotated_symlinks(self):
+        self.write('log_20181003.txt')
+        self.write('log_20181004.txt')
+        self.write('log_20181005.txt')
+        os.symlink('log_20181004.txt',
+                   os.path.join(self.dir, 'log_current.txt'))
+
+        self.assertEqual(self.rotated(), ['log_20181003.txt'])
+
+    # Test that logs written recently, and logs that already have a
+    # compressed copy, aren't compressed
+    def test_rotated_quiet_and_compressed(self):
+        self.write('log_1.txt', age=0)
+        self.write('log_2.txt')
+        self.write('log_3.txt')
+        self.write('log_3.txt.gz')
+        self.write('log_4.txt')
+        self.write('log_5.txt')
+
+        self.assertEqual(self.rotated(), ['log_4.txt', 'log_2.txt'])
+        self.assertEqual(self.rotated(quiet_period=0),
+                         ['log_4.txt', 'log_2.txt', 'log_1.txt'])
+
+    # Test that rotated logs are compressed before deciding what to delete
+    @mock.patch('syslog.syslog')
+    def test_cleanup_compress(self, mock_syslog):
+        for hour in range(3):
+            self.write('log_%02d.txt' % hour, size=100000)
+
+        deleted = log_cleanup.cleanup(self.dir, '', '.txt',
+                                      maxsize=110000, compress=True)
+
+        self.assertEqual(deleted, [])
+        self.assertEqual(sorted(os.listdir(self.dir)),
+                         ['log_00.txt.gz', 'log_01.txt.gz', 'log_02.txt'])
@@ -0,0 +1,35 @@
+# @file scripts.py
+#
+# Copyright (C) Metaswitch Networks 2018
+# If license terms are provided to you in a COPYING file in the root directory
+# of the source code repository by which you are accessing this code, then
+# the license outlined in that COPYING file applies to your use.
+# Otherwise no rights are granted except for those provided to you by
+# Metaswitch Networks in a separate written agreement.
+
+# Imports the Python scripts installed (in /usr/share/clearwater/bin) by the
+# other packages in this repository, so that they can be tested here.
+
+import os
+import sys
+import importlib
+
+REPO_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                        "..", "..", "..")
+
+
+def load_script(package, name):
+    """Import a script installed by a package, returning the module.
+
+       @param package - The package that installs the script.
+       @param name    - The name of the script, without the .py suffix."""
+    directory = os.path.normpath(os.path.join(REPO_DIR,
+                                              package,
+                                              "usr", "share", "clearwater",
+                                              "bin"))
+
+    # The scripts import each other as top-level modules.
+    if directory not in sys.path:
+        sys.path.insert(0, directory)
+
+    return importlib.import_module(name)
@@ -0,0 +1,98 @@
+# @file startup_benchmark.py
+#
+# Copyright (C) Metaswitch Networks 2018
+# If license terms are provided to you in a COPYING file in the root directory
+# of the source code repository by which you are accessing this code, then
+# the license outlined in that COPYING file applies to your use.
+# Otherwise no rights are granted except for those provided to you by
+# Metaswitch Networks in a separate written agreement.
+
+# Measure the startup cost of checking config, by timing fresh interpreters
+# that load the option schemas in different ways. Run with:
+#
+#   python -m cw_infrastructure.test.startup_benchmark
+#
+# This reports the median time for each way of starting up, and which of the
+# heavyweight modules (pkg_resources, dnspython and nsenter) each one ends up
+# importing. The config only sets options that can be checked without DNS,
+# though some advanced checks still make DNS lookups.
+
+import os
+import sys
+import time
+import argparse
+import subprocess
+
+# Options that can be checked without any DNS lookups.
+CONFIG = {
+    'local_ip': '10.0.0.10',
+    'public_ip': '10.0.0.10',
+    'home_domain': 'example.test',
+    'etcd_cluster': '10.0.0.10',
+}
+
+HEAVY_MODULES = ['pkg_resources', 'dns.resolver', 'nsenter']
+
+REPORT_MODULES = (
+    "import sys; "
+    "sys.stderr.write(','.join(m for m in {!r} if m in sys.modules))"
+).format(HEAVY_MODULES)
+
+# The ways of starting up to compare. Each is a name and a Python script.
+SCENARIOS = [
+    ('interpreter only',
+     "pass"),
+    ('pkg_resources entry points',
+     "import pkg_resources\n"
+     "from cw_infrastructure import check_config\n"
+     "schemas = [e.load() for e in "
+     "pkg_resources.iter_entry_points('option_schemas')]\n"
+     "[check_config.run_checks(s, check_config.utils.get_option_value) "
+     "for s in schemas]"),
+    ('lightweight entry points',
+     "from cw_infrastructure import check_config\n"
+     "schemas = check_config.load_option_schemas()\n"
+     "[check_config.run_checks(s, check_config.utils.get_option_value) "
+     "for s in schemas]"),
+]
+
+
+def time_script(script):
+    """Run a script in a fresh interpreter. Returns the time taken and the
+    heavyweight modules it imported."""
+    env = dict(os.environ)
+    env.update(CONFIG)
+
+    start = time.time()
+    process = subprocess.Popen([sys.executable, '-c',
+                                script + "\n" + REPORT_MODULES],
+                               env=env,
+                               stderr=subprocess.PIPE)
+    _, modules = process.communicate()
+    return time.time() - start, modules.strip()
+
+
+def main(args=None):
+    parser = argparse.ArgumentParser(
+        description='Measure the startup cost of checking config')
+    parser.add_argument('--repeat', type=int, default=10,
+                        help='The number of times to run each scenario')
+    args = parser.parse_args(args)
+
+    sys.stdout.write("{:<30} {:>12}  {}\n".format("Scenario",
+                                                  "Median(ms)",
+                                                  "Heavy modules imported"))
+
+    for name, script in SCENARIOS:
+        times = []
+        for _ in range(args.repeat):
+            duration, modules = time_script(script)
+            times.append(duration)
+
+        times.sort()
+        sys.stdout.write("{:<30} {:>12.1f}  {}\n".format(
+            name, times[len(times) // 2] * 1000, modules or "none"))
+
+
+if __name__ == '__main__':
+    main()
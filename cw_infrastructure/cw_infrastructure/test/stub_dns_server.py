@@ -0,0 +1,140 @@
+# @file stub_dns_server.py
+#
+# Copyright (C) Metaswitch Networks 2018
+# If license terms are provided to you in a COPYING file in the root directory
+# of the source code repository by which you are accessing this code, then
+# the license outlined in that COPYING file applies to your use.
+# Otherwise no rights are granted except for those provided to you by
+# Metaswitch Networks in a separate written agreement.
+
+# A stub DNS server, run in-process on localhost, for testing and benchmarking
+# the validators against a real resolver without needing a network. Records
+# are configured up front, and responses can be delayed or dropped entirely to
+# simulate slow or broken DNS.
+
+import socket
+import threading
+
+import dns.message
+import dns.rcode
+import dns.rdatatype
+import dns.rrset
+
+
+class StubDNSServer(object):
+    """A stub DNS server listening for UDP queries on localhost.
+
+    Names with no records of any type get NXDOMAIN. Names with records, but
+    not of the type asked for, get an empty answer."""
+
+    def __init__(self, address='127.0.0.1', port=0):
+        """@param address - The address to listen on.
+           @param port    - The port to listen on. If 0, a free port is
+             chosen (see the port attribute)."""
+        self.address = address
+        self.port = port
+        self.default_delay = 0.0
+        self.queries = 0
+        self._records = {}
+        self._delays = {}
+        self._timeouts = set()
+        self._lock = threading.Lock()
+        self._socket = None
+        self._thread = None
+
+    def add_record(self, name, rrtype, rdata, ttl=300):
+        """Add a record to the server.
+
+           @param name   - The domain name.
+           @param rrtype - The record type, e.g. 'A' or 'SRV'.
+           @param rdata  - The record data, in zone file format.
+           @param ttl    - The TTL of the record."""
+        key = (name.lower().rstrip('.'), rrtype.upper())
+        self._records.setdefault(key, ([], ttl))[0].append(rdata)
+
+    def set_delay(self, name, seconds):
+        """Delay the responses to queries for the given name"""
+        self._delays[name.lower().rstrip('.')] = seconds
+
+    def add_timeout(self, name):
+        """Never respond to queries for the given name"""
+        self._timeouts.add(name.lower().rstrip('.'))
+
+    def start(self):
+        self._socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self._socket.bind((self.address, self.port))
+
+        # Wake up regularly to check whether the server has been stopped.
+        self._socket.settimeout(0.1)
+        self.port = self._socket.getsockname()[1]
+        self._thread = threading.Thread(target=self._serve)
+        self._thread.daemon = True
+        self._thread.start()
+
+    def stop(self):
+        sock = self._socket
+        self._socket = None
+        self._thread.join()
+        sock.close()
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, *args):
+        self.stop()
+
+    def _serve(self):
+        sock = self._socket
+
+        while self._socket is not None:
+            try:
+                wire, peer = sock.recvfrom(65535)
+            except socket.timeout:
+                continue
+
+            with self._lock:
+                self.queries += 1
+
+            try:
+                query = dns.message.from_wire(wire)
+            except Exception:
+                continue
+
+            name = query.question[0].name.to_text(omit_final_dot=True).lower()
+
+            if name in self._timeouts:
+                continue
+
+            response = self._respond(query, name).to_wire()
+            delay = self._delays.get(name, self.default_delay)
+
+            if delay:
+                timer = threading.Timer(delay, self._send, (response, peer))
+                timer.daemon = True
+                timer.start()
+            else:
+                self._send(response, peer)
+
+    def _respond(self, query, name):
+        question = query.question[0]
+        rrtype = dns.rdatatype.to_text(question.rdtype)
+        response = dns.message.make_response(query)
+
+        if (name, rrtype) in self._records:
+            rdatas, ttl = self._records[(name, rrtype)]
+            response.answer.append(
+                dns.rrset.from_text_list(question.name, ttl, 'IN', rrtype,
+                                         rdatas))
+        elif not any(key[0] == name for key in self._records):
+            response.set_rcode(dns.rcode.NXDOMAIN)
+
+        return response
+
+    def _send(self, response, peer):
+        sock = self._socket
+        if sock is not None:
+            try:
+                sock.sendto(response, peer)
+            except socket.error:
+                pass
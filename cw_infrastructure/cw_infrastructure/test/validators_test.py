@@ -63,6 +63,25 @@ class TestIntegerValidator(unittest.TestCase):
         mock_error.assert_called_once_with('val', mock.ANY)
 
 
+class TestChoiceValidator(unittest.TestCase):
+
+    # Test that each of the choices is validated as OK
+    def test_with_choice(self):
+        validator = validators.create_choice_validator(['gzip', 'xz'])
+        for value in ['gzip', 'xz']:
+            self.assertEqual(validator('val', value),
+                             check_config_utilities.OK)
+
+    # Test that any other value gives an ERROR
+    @mock.patch('cw_infrastructure.check_config_utilities.error',
+                autospec=True)
+    def test_with_other_value(self, mock_error):
+        validator = validators.create_choice_validator(['gzip', 'xz'])
+        self.assertEqual(validator('val', 'bzip2'),
+                         check_config_utilities.ERROR)
+        mock_error.assert_called_once_with('val', mock.ANY)
+
+
 class TestIntegerRangeValidator(unittest.TestCase):
 
     # Test that an error is raised when values less than the minimum allowed
@@ -266,5 +285,55 @@ class TestIpAddrDomainOptionalPortsListValidator(unittest.TestCase):
             self.assertEqual(code, check_config_utilities.ERROR, "Got {} for {}".format(code, addr_list))
 
 
+class TestRunInSigNs(unittest.TestCase):
+
+    def setUp(self):
+        patcher = mock.patch('cw_infrastructure.validators._enter_namespace',
+                             autospec=True)
+        self.mock_namespace = patcher.start()
+        self.addCleanup(patcher.stop)
+
+        patcher = mock.patch.dict('os.environ',
+                                  {'signaling_namespace': 'signaling'})
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def namespace_validator(self, name, value):
+        self.assertEqual(check_config_utilities.current_dns_namespace(),
+                         'signaling')
+        check_config_utilities.error(name, value)
+        return check_config_utilities.ERROR
+
+    # Test that without a pool the namespace is entered for each validator
+    def test_no_pool(self):
+        validator = validators.run_in_sig_ns(self.namespace_validator)
+
+        with mock.patch('cw_infrastructure.check_config_utilities.error',
+                        autospec=True) as mock_error:
+            for ii in range(3):
+                self.assertEqual(validator('val', str(ii)),
+                                 check_config_utilities.ERROR)
+
+        self.assertEqual(self.mock_namespace.call_count, 3)
+        self.assertEqual(mock_error.call_count, 3)
+
+    # Test that with a pool the namespace is only entered once per thread,
+    # and that messages are written out on the calling thread.
+    def test_pool(self):
+        validator = validators.run_in_sig_ns(self.namespace_validator)
+
+        with validators.signaling_namespace_pool(1):
+            with check_config_utilities.capture_messages() as messages:
+                for ii in range(3):
+                    self.assertEqual(validator('val', str(ii)),
+                                     check_config_utilities.ERROR)
+
+        self.mock_namespace.assert_called_once_with('signaling')
+        self.assertEqual(messages, [('ERROR', 'val', '0'),
+                                    ('ERROR', 'val', '1'),
+                                    ('ERROR', 'val', '2')])
+        self.assertIsNone(check_config_utilities.current_dns_namespace())
+
+
 if __name__ == '__main__':
     unittest.main()
@@ -18,10 +18,10 @@
 # - If the value is acceptable but not recommended, produce a warning log
 #   describing the problem and return WARNING.
 
-import dns
 import re
-import os
-from nsenter import Namespace
+import threading
+from contextlib import contextmanager
+from multiprocessing.pool import ThreadPool
 
 import check_config_utilities as utils
 
@@ -83,6 +83,22 @@ def create_integer_range_validator(min_value=None, max_value=None,
     return integer_range_validator
 
 
+def create_choice_validator(choices):
+    """ Creates and returns a choice_validator """
+
+    def choice_validator(name, value):
+        """Validate a config option that should be one of a fixed set of
+        values"""
+        if value in choices:
+            return utils.OK
+
+        utils.error(name,
+                    "{} is not a valid value - should be one of {}".format(
+                        value, ", ".join(choices)))
+        return utils.ERROR
+    return choice_validator
+
+
 def ip_addr_validator(name, value):
     """Validate a config option that should be an IP address"""
     if not utils.is_ip_addr(value):
@@ -312,19 +328,15 @@ def ip_or_domain_name_opt_port_validator(name, value):
 
 
 def run_validator_with_dns(validator, name, value, dns_server):
-    """Run a validator in the signaling namespace"""
-
-    if dns_server:
-        dns.resolver.override_system_resolver()
-        dns.resolver.get_default_resolver().nameservers = dns_server.split(',')
-
-    result = validator(name, value)
+    """Run a validator, using the given DNS server(s) if specified"""
 
+    # The DNS servers are only changed for this thread, so that validators
+    # running on other threads are unaffected.
     if dns_server:
-        dns.resolver.restore_system_resolver()
-        dns.resolver.reset_default_resolver()
-
-    return result
+        with utils.dns_servers(dns_server.split(',')):
+            return validator(name, value)
+    else:
+        return validator(name, value)
 
 
 def run_in_sig_ns(validator):
@@ -332,17 +344,119 @@ def run_in_sig_ns(validator):
 
     def sig_ns_validator(name, value):
 
-        sig_ns = os.environ.get('signaling_namespace')
+        sig_ns = utils.get_option_value('signaling_namespace')
 
         # If we have a configured signaling DNS server
         # use it in preference for both DNS Python requests
         # and none DNS Python requests
-        sig_dns = os.environ.get('signaling_dns_server')
-
-        if sig_ns:
-            with Namespace('/var/run/netns/' + sig_ns, 'net'):
-                return run_validator_with_dns(validator, name, value, sig_dns)
+        sig_dns = utils.get_option_value('signaling_dns_server')
+
+        if sig_ns and utils.checking_remote_config():
+            utils.not_checked(name,
+                              "can't be checked outside the node's signaling "
+                              "namespace ({})".format(sig_ns))
+            return utils.NOT_CHECKED
+        elif sig_ns:
+            return run_in_namespace(sig_ns,
+                                    run_validator_with_dns,
+                                    validator, name, value, sig_dns)
         else:
             return run_validator_with_dns(validator, name, value, sig_dns)
 
+    # Name the wrapper after the validator it runs, so that results and
+    # timings refer to the validator.
+    sig_ns_validator.__name__ = getattr(validator,
+                                        '__name__',
+                                        sig_ns_validator.__name__)
     return sig_ns_validator
+
+
+def _enter_namespace(namespace):
+    """Return a context manager that enters a network namespace. nsenter is
+    only imported when a namespace is actually needed."""
+    from nsenter import Namespace
+    return Namespace('/var/run/netns/' + namespace, 'net')
+
+
+def run_in_namespace(namespace, function, *args):
+    """Run a function in a network namespace, returning its result.
+
+    If this thread is already in the namespace, the function is just called.
+    If a pool of threads is in the namespace (see namespace_pool), the
+    function is run on one of those threads. Otherwise this thread enters the
+    namespace for the duration of the call."""
+
+    if utils.current_dns_namespace() == namespace:
+        return function(*args)
+
+    pool = _namespace_pool
+
+    if pool is not None and pool.namespace == namespace:
+        return pool.run(function, *args)
+
+    with _enter_namespace(namespace), \
+            utils.dns_namespace(namespace):
+        return function(*args)
+
+
+class _NamespacePool(object):
+    """A pool of threads that run functions in a network namespace. Each
+    thread enters the namespace the first time it is used, and stays there
+    until the pool is closed."""
+
+    def __init__(self, namespace, size):
+        self.namespace = namespace
+        self._pool = ThreadPool(size)
+        self._thread_state = threading.local()
+
+    def run(self, function, *args):
+        """Run a function on one of the pool's threads and return its result.
+        The function takes on the calling thread's context (see
+        utils.thread_context), so it reads options and reports messages as if
+        it had been run there."""
+        return self._pool.apply(
+            self._run, (function, args, utils.current_thread_context()))
+
+    def _run(self, function, args, context):
+        if not getattr(self._thread_state, 'entered', False):
+            _enter_namespace(self.namespace).__enter__()
+            self._thread_state.entered = True
+
+        with utils.dns_namespace(self.namespace), \
+                utils.thread_context(context):
+            return function(*args)
+
+    def close(self):
+        self._pool.close()
+        self._pool.join()
+
+
+# The pool of threads in the signaling namespace, if one is in use.
+_namespace_pool = None
+
+
+@contextmanager
+def signaling_namespace_pool(size):
+    """Run all signaling namespace validators on a pool of threads that stay
+    in the signaling namespace, for the duration of the context. This saves
+    entering and leaving the namespace for every validator, and lets
+    management validators run on other threads at the same time.
+
+       @param size - The number of threads in the pool."""
+    global _namespace_pool
+    sig_ns = utils.get_option_value('signaling_namespace')
+
+    if (not sig_ns or
+            utils.checking_remote_config() or
+            _namespace_pool is not None):
+        yield
+        return
+
+    _namespace_pool = _NamespacePool(sig_ns, size)
+
+    try:
+        yield
+    finally:
+        pool = _namespace_pool
+        _namespace_pool = None
+        pool.close()
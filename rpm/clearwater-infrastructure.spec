@@ -1,7 +1,7 @@
 Name:           clearwater-infrastructure
 Summary:        Common infrastructure for all Clearwater servers
 BuildRequires:  python2-devel python-virtualenv zeromq-devel
-Requires:       redhat-lsb-core python zeromq ntp
+Requires:       redhat-lsb-core python zeromq ntp daemonize
 
 %include %{rootdir}/build-infra/cw-rpm.spec.inc
 
@@ -15,10 +15,12 @@ install_to_buildroot < %{rootdir}/debian/clearwater-infrastructure.install
 install_links_in_buildroot < %{rootdir}/debian/clearwater-infrastructure.links
 dirs_to_buildroot < %{rootdir}/debian/clearwater-infrastructure.dirs
 copy_to_buildroot debian/clearwater-infrastructure.init.d /etc/init.d clearwater-infrastructure
+copy_to_buildroot debian/clearwater-infrastructure.clearwater-check-config.init.d /etc/init.d clearwater-check-config
 build_files_list > clearwater-infrastructure.files
 
 %post
 /sbin/chkconfig clearwater-infrastructure on
+/sbin/chkconfig clearwater-check-config on
 /usr/share/clearwater/infrastructure/install/clearwater-infrastructure.postinst
 /sbin/service clearwater-infrastructure restart
 
@@ -27,6 +29,7 @@ build_files_list > clearwater-infrastructure.files
 if [ "$1" == 0 ] ; then
   /usr/share/clearwater/infrastructure/install/clearwater-infrastructure.prerm
   /sbin/chkconfig clearwater-infrastructure off
+  /sbin/chkconfig clearwater-check-config off
 fi
 
 %files -f clearwater-infrastructure.files
@@ -0,0 +1,110 @@
+#! /usr/bin/python2.7
+
+# @file alarm_agent_stub.py
+#
+# Copyright (C) Metaswitch Networks 2018
+# If license terms are provided to you in a COPYING file in the root directory
+# of the source code repository by which you are accessing this code, then
+# the license outlined in that COPYING file applies to your use.
+# Otherwise no rights are granted except for those provided to you by
+# Metaswitch Networks in a separate written agreement.
+
+
+# A stand-in for the net-snmp alarm sub-agent, for testing and benchmarking
+# alarm clients (alarms.py and issue-alarm) without a real agent. It listens
+# on an "alarms" IPC socket in a given directory (the real agent uses
+# /var/run/clearwater), and answers each request with "ok" after a
+# configurable delay. A configurable proportion of requests are not answered
+# at all, as if the agent were overloaded.
+#
+# Run it on its own with:
+#
+#   alarm_agent_stub.py <directory> [--delay SECONDS] [--drop-rate FRACTION]
+
+
+import os
+import sys
+import time
+import random
+import argparse
+import threading
+import zmq
+
+
+class StubAlarmAgent(object):
+  """Stand-in alarm agent, answering requests on a background thread"""
+
+  def __init__(self, directory, delay=0, drop_rate=0):
+    """@param directory - The directory to create the "alarms" socket in.
+       @param delay     - How long (in seconds) to take over each request.
+         Like the real agent, requests are handled one at a time.
+       @param drop_rate - The proportion of requests not to answer."""
+    self.address = "ipc://" + os.path.join(directory, "alarms")
+    self.delay = delay
+    self.drop_rate = drop_rate
+
+    # The requests received, as lists of message parts.
+    self.requests = []
+
+    self._context = zmq.Context()
+    self._stopped = threading.Event()
+    self._thread = None
+
+  def start(self):
+    # A ROUTER socket behaves like the agent's REP socket, but can leave a
+    # request unanswered without blocking the next one.
+    self._socket = self._context.socket(zmq.ROUTER)
+    self._socket.setsockopt(zmq.LINGER, 0)
+    self._socket.bind(self.address)
+
+    self._thread = threading.Thread(target=self._serve, name="stub-alarm-agent")
+    self._thread.daemon = True
+    self._thread.start()
+
+  def stop(self):
+    self._stopped.set()
+    self._thread.join()
+    self._socket.close()
+    self._context.term()
+
+  def _serve(self):
+    while not self._stopped.is_set():
+      if not self._socket.poll(100, zmq.POLLIN):
+        continue
+
+      # Each request is the client's identity, an empty delimiter, then the
+      # parts of the request itself.
+      message = self._socket.recv_multipart()
+      identity, request = message[0], message[2:]
+      self.requests.append(request)
+
+      if self.delay:
+        time.sleep(self.delay)
+
+      if random.random() >= self.drop_rate:
+        self._socket.send_multipart([identity, "", "ok"])
+
+
+def parse_args(args=None):
+  parser = argparse.ArgumentParser(description="Stand-in alarm agent")
+  parser.add_argument("directory",
+                      help='The directory to create the "alarms" socket in')
+  parser.add_argument("--delay", type=float, default=0,
+                      help="How long (in seconds) to take over each request")
+  parser.add_argument("--drop-rate", type=float, default=0,
+                      help="The proportion of requests not to answer")
+  return parser.parse_args(args)
+
+
+if __name__ == "__main__":
+  args = parse_args()
+  agent = StubAlarmAgent(args.directory, args.delay, args.drop_rate)
+  agent.start()
+  print "Listening on %s" % agent.address
+
+  try:
+    while True:
+      time.sleep(1)
+  except KeyboardInterrupt:
+    agent.stop()
+    print "Handled %d requests" % len(agent.requests)
@@ -0,0 +1,219 @@
+#! /usr/bin/python2.7
+
+# @file alarm_benchmark.py
+#
+# Copyright (C) Metaswitch Networks 2018
+# If license terms are provided to you in a COPYING file in the root directory
+# of the source code repository by which you are accessing this code, then
+# the license outlined in that COPYING file applies to your use.
+# Otherwise no rights are granted except for those provided to you by
+# Metaswitch Networks in a separate written agreement.
+
+
+# Measures the throughput and latency of the alarm clients against a
+# stand-in alarm agent (see alarm_agent_stub.py). For each client, it sends a
+# number of issue-alarm requests from several workers at once, and reports
+# the requests handled per second, the median and 99th percentile latencies
+# and the proportion of requests that weren't answered.
+#
+# The clients are:
+#
+# - legacy:      a new ZMQ context and socket for every request, as
+#                alarms.sendrequest used to do.
+# - client:      an alarms.AlarmClient for each worker, kept open throughout.
+# - issue-alarm: the issue-alarm binary, run once for every request.
+#
+# issue-alarm always uses /var/run/clearwater/alarms, so it is only
+# benchmarked when run as root: the benchmark then runs itself in a new mount
+# namespace, with the stand-in agent's directory mounted over
+# /var/run/clearwater.
+
+
+import os
+import sys
+import time
+import shutil
+import tempfile
+import argparse
+import threading
+import subprocess
+import zmq
+
+SCRIPTS_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, SCRIPTS_DIR)
+sys.path.insert(0, os.path.join(SCRIPTS_DIR,
+                                "..",
+                                "clearwater-infrastructure",
+                                "usr", "share", "clearwater", "bin"))
+
+import alarms
+from alarm_agent_stub import StubAlarmAgent
+
+RUN_DIR = "/var/run/clearwater"
+DEFAULT_ISSUE_ALARM = os.path.join(SCRIPTS_DIR, "..", "build", "bin", "issue-alarm")
+
+
+def legacy_request(address, request, timeout_ms):
+  # This is what alarms.sendrequest did for every request, before it used a
+  # long-lived client.
+  context = zmq.Context()
+  client = context.socket(zmq.REQ)
+  client.connect(address)
+
+  poller = zmq.Poller()
+  poller.register(client, zmq.POLLIN)
+
+  for reqelem in request[0:-1]:
+    client.send(reqelem, zmq.SNDMORE)
+  client.send(request[-1])
+
+  reply = None
+  if client in dict(poller.poll(timeout_ms)):
+    reply = client.recv()
+
+  context.destroy(100)
+  return reply
+
+
+# Each worker function returns a function to send a request (returning the
+# reply, or None if it wasn't answered) and a function to tidy up afterwards.
+
+def legacy_worker(args, address):
+  return (lambda request: legacy_request(address, request, args.timeout_ms),
+          lambda: None)
+
+
+def client_worker(args, address):
+  client = alarms.AlarmClient(address, args.timeout_ms)
+  return client.request, client.close
+
+
+def issue_alarm_worker(args, address):
+  def send(request):
+    process = subprocess.Popen([args.issue_alarm, request[1], request[2]],
+                               stderr=subprocess.PIPE)
+    _, errors = process.communicate()
+
+    # issue-alarm always exits with 0, but reports failures on stderr.
+    return None if errors else "ok"
+
+  return send, lambda: None
+
+
+CLIENTS = [("legacy", legacy_worker),
+           ("client", client_worker),
+           ("issue-alarm", issue_alarm_worker)]
+
+
+def percentile(values, fraction):
+  values = sorted(values)
+  return values[min(len(values) - 1, int(len(values) * fraction))]
+
+
+def run_client(args, address, make_worker):
+  """Send the requests from several workers at once. Returns the elapsed
+  time, and the latency of each request (None if it wasn't answered)."""
+  latencies = []
+  lock = threading.Lock()
+
+  def work(worker_index):
+    send, close = make_worker(args, address)
+
+    for request_index in range(worker_index, args.requests, args.concurrency):
+      # Use a different alarm for each request, so that none of them can be
+      # coalesced.
+      request = ["issue-alarm", "benchmark", "%d.3" % (10000 + request_index)]
+
+      start = time.time()
+      reply = send(request)
+      latency = time.time() - start
+
+      with lock:
+        latencies.append(latency if reply is not None else None)
+
+    close()
+
+  threads = [threading.Thread(target=work, args=(index,))
+             for index in range(args.concurrency)]
+
+  start = time.time()
+  for thread in threads:
+    thread.start()
+  for thread in threads:
+    thread.join()
+
+  return time.time() - start, latencies
+
+
+def report(name, elapsed, latencies):
+  answered = [latency for latency in latencies if latency is not None]
+
+  if answered:
+    print "%-12s %9.1f %9.2f %9.2f %8.1f%%" % (
+      name,
+      len(latencies) / elapsed,
+      percentile(answered, 0.5) * 1000,
+      percentile(answered, 0.99) * 1000,
+      100.0 * (len(latencies) - len(answered)) / len(latencies))
+  else:
+    print "%-12s no requests answered" % name
+
+
+def parse_args(args=None):
+  parser = argparse.ArgumentParser(description="Benchmark the alarm clients")
+  parser.add_argument("--requests", type=int, default=2000,
+                      help="The number of requests to send with each client")
+  parser.add_argument("--concurrency", type=int, default=4,
+                      help="The number of workers sending requests at once")
+  parser.add_argument("--delay", type=float, default=0,
+                      help="How long (in seconds) the agent takes over each "
+                           "request")
+  parser.add_argument("--drop-rate", type=float, default=0,
+                      help="The proportion of requests the agent doesn't "
+                           "answer")
+  parser.add_argument("--timeout-ms", type=int, default=alarms.REQUEST_TIMEOUT_MS,
+                      help="How long the Python clients wait for an answer")
+  parser.add_argument("--issue-alarm", default=DEFAULT_ISSUE_ALARM,
+                      help="The issue-alarm binary to benchmark")
+  parser.add_argument("--in-namespace", action="store_true",
+                      help=argparse.SUPPRESS)
+  return parser.parse_args(args)
+
+
+if __name__ == "__main__":
+  args = parse_args()
+
+  run_issue_alarm = os.path.exists(args.issue_alarm) and os.geteuid() == 0
+
+  if run_issue_alarm and not args.in_namespace:
+    # Run again in a new mount namespace, so that the stand-in agent can be
+    # mounted over /var/run/clearwater without affecting the rest of the
+    # system.
+    os.execvp("unshare", ["unshare", "--mount", sys.executable] +
+                         sys.argv + ["--in-namespace"])
+
+  directory = tempfile.mkdtemp()
+  agent = StubAlarmAgent(directory, args.delay, args.drop_rate)
+  agent.start()
+
+  if args.in_namespace:
+    if not os.path.isdir(RUN_DIR):
+      os.makedirs(RUN_DIR)
+    subprocess.check_call(["mount", "--bind", directory, RUN_DIR])
+  else:
+    print "Not benchmarking issue-alarm (needs %s, and root)\n" % args.issue_alarm
+
+  print "%-12s %9s %9s %9s %9s" % ("client", "req/s", "p50 ms", "p99 ms", "dropped")
+
+  for name, make_worker in CLIENTS:
+    if name == "issue-alarm" and not args.in_namespace:
+      continue
+
+    elapsed, latencies = run_client(args, agent.address, make_worker)
+    report(name, elapsed, latencies)
+
+  agent.stop()
+
+  if args.in_namespace:
+    subprocess.call(["umount", RUN_DIR])
+  shutil.rmtree(directory)
@@ -0,0 +1,126 @@
+#! /usr/bin/python2.7
+
+# @file log_cleanup_benchmark.py
+#
+# Copyright (C) Metaswitch Networks 2018
+# If license terms are provided to you in a COPYING file in the root directory
+# of the source code repository by which you are accessing this code, then
+# the license outlined in that COPYING file applies to your use.
+# Otherwise no rights are granted except for those provided to you by
+# Metaswitch Networks in a separate written agreement.
+
+
+# Measures how long log_cleanup.py takes to choose the files to delete from
+# large synthetic log directories. For each directory size, it compares the
+# way log_cleanup.py used to choose them (listdir, then a stat per file to
+# check it's a file, another to total the sizes and another as each file is
+# deleted, after sorting all of them) with its current selection engine.
+# Nothing is deleted, so each run sees the same directory.
+
+
+import os
+import sys
+import time
+import shutil
+import tempfile
+import argparse
+from os.path import isfile, getsize
+
+SCRIPTS_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(SCRIPTS_DIR,
+                                "..",
+                                "clearwater-log-cleanup",
+                                "usr", "share", "clearwater", "bin"))
+
+import log_cleanup
+
+
+def legacy_select(dir, prefix, suffix, maxsize):
+    # This is what log_cleanup.py used to do, without the unlink.
+    logs = [dir+'/'+i for i in os.listdir(dir)
+                if ((isfile(dir+'/'+i)) and (((prefix != "") and (i.startswith(prefix))) or ((suffix != "") and (i.endswith(suffix)))))]
+
+    size_to_delete = sum([getsize(f) for f in logs]) - maxsize
+    selected = []
+
+    for logfile in sorted(logs):
+        if (size_to_delete > 0):
+            size_to_delete -= getsize(logfile)
+            selected.append(logfile)
+
+    return selected
+
+
+def current_select(dir, prefix, suffix, maxsize):
+    return log_cleanup.cleanup(dir, prefix, suffix, maxsize, dry_run=True)
+
+
+def make_logs(dir, files, file_size):
+    # Give the files datestamped names in a random order, so that the order of
+    # the directory listing doesn't match the order they're deleted in, and
+    # mix in some files that don't match the prefix.
+    for index in range(files):
+        stamp = (index * 7919) % files
+        name = "log_%08d.txt" % stamp
+        with open(os.path.join(dir, name), "wb") as f:
+            f.write("x" * file_size)
+
+        if index % 10 == 0:
+            with open(os.path.join(dir, "other_%08d.txt" % stamp), "wb") as f:
+                f.write("x" * file_size)
+
+
+def best_time(function, args, repeats):
+    times = []
+    for _ in range(repeats):
+        start = time.time()
+        function(*args)
+        times.append(time.time() - start)
+    return min(times)
+
+
+def parse_args(args=None):
+    parser = argparse.ArgumentParser(description="Benchmark log_cleanup.py")
+    parser.add_argument("--files", type=int, nargs="+",
+                        default=[1000, 10000, 50000],
+                        help="The numbers of log files to benchmark with")
+    parser.add_argument("--file-size", type=int, default=100,
+                        help="The size (in bytes) of each log file")
+    parser.add_argument("--delete-fraction", type=float, default=0.05,
+                        help="The proportion of the logs that need deleting")
+    parser.add_argument("--repeats", type=int, default=3,
+                        help="How many times to run each engine (the best "
+                             "time is reported)")
+    parser.add_argument("--directory",
+                        help="Where to create the log directories (by default "
+                             "a temporary directory)")
+    return parser.parse_args(args)
+
+
+if __name__ == "__main__":
+    args = parse_args()
+
+    print "%-8s %12s %12s %8s" % ("files", "legacy ms", "current ms", "speedup")
+
+    for files in args.files:
+        dir = tempfile.mkdtemp(dir=args.directory)
+
+        try:
+            make_logs(dir, files, args.file_size)
+            maxsize = int(files * args.file_size * (1 - args.delete_fraction))
+            select_args = (dir, "log_", "", maxsize)
+
+            # Both engines must choose the same files.
+            legacy = legacy_select(*select_args)
+            current = [path for path, _ in current_select(*select_args)]
+            assert legacy == current, "engines chose different files"
+
+            legacy_time = best_time(legacy_select, select_args, args.repeats)
+            current_time = best_time(current_select, select_args, args.repeats)
+
+            print "%-8d %12.1f %12.1f %7.1fx" % (files,
+                                                 legacy_time * 1000,
+                                                 current_time * 1000,
+                                                 legacy_time / current_time)
+        finally:
+            shutil.rmtree(dir)